@@ -0,0 +1,112 @@
+"""Precision of bootstrap critical values with and without the control variate.
+
+The null distribution of a level pair is bootstrapped with several seeds. For
+every number of replicates, the critical value is estimated from the plain
+ECDF and from the ECDF post-stratified by the chi-bar-square control variate
+(the same replicates, see `stratified_critical_index`). The spread (sd across
+seeds) is reported, and the last column shows how many plain replicates would
+give the same precision (sd ~ 1/sqrt(n)).
+
+Usage: python benchmarks/ecdf_control.py --preset hctm --pair N4-N3
+"""
+
+import time
+
+import click
+import numpy as np
+from tabulate import tabulate
+
+from hammlet.chibar import ChiBarNull
+from hammlet.ecdf import NullDistribution
+from hammlet.models import models_nrds
+from hammlet.optimizer import Optimizer
+from hammlet.parsers import parse_input, presets_db
+from hammlet.resultset import ResultSet
+
+
+@click.command()
+@click.option("--preset", type=click.Choice(presets_db), default="hctm")
+@click.option("--pair", default="N4-N3", show_default=True)
+@click.option("-p", "--pvalues", default="0.05,0.01", show_default=True)
+@click.option("--sizes", default="100,200,400", show_default=True)
+@click.option("--seeds", type=int, default=8, show_default=True)
+@click.option("--prune-perms", "prune", type=int, default=2, show_default=True)
+def main(preset, pair, pvalues, sizes, seeds, prune):
+    y = parse_input(preset, None)
+    r = (1, 1, 1, 1)
+    theta0 = (round(0.6 * sum(y), 5), 0.5, 0.5, 0.5, 0.5)
+    method = "SLSQP"
+    pvalues = list(map(float, pvalues.split(",")))
+    sizes = sorted(map(int, sizes.split(",")))
+    level_senior, level_junior = pair.split("-")
+    optimizer = Optimizer(y, r, theta0, method)
+    best_junior = ResultSet.from_results(
+        optimizer.many(models_nrds[level_junior], perms="model", sort=False)
+    ).best()
+    args = (models_nrds[level_senior], best_junior.model, best_junior.theta, r)
+    args += (theta0, method)
+
+    values = {}  # {(estimator, pvalue, size): [critical value per seed]}
+    times = {"fits": 0.0, "control": 0.0}
+    for seed in range(seeds):
+        time_start = time.time()
+        control = ChiBarNull(*args, seed_sequence=seed)
+        control.get_control_sample()
+        times["control"] += time.time() - time_start
+        null = NullDistribution(*args, seed_sequence=seed, prune=prune)
+        for size in sizes:
+            time_start = time.time()
+            null.extend(size - len(null))
+            times["fits"] += time.time() - time_start
+            for pvalue in pvalues:
+                null.control = None
+                values.setdefault(("plain", pvalue, size), []).append(
+                    null.critical_value(pvalue)
+                )
+                time_start = time.time()
+                null.control = control
+                values.setdefault(("control", pvalue, size), []).append(
+                    null.critical_value(pvalue)
+                )
+                times["control"] += time.time() - time_start
+
+    data = []
+    for pvalue in pvalues:
+        for size in sizes:
+            sd_plain = np.std(values["plain", pvalue, size], ddof=1)
+            for estimator in ["plain", "control"]:
+                sample = values[estimator, pvalue, size]
+                sd = np.std(sample, ddof=1)
+                data.append(
+                    [
+                        pvalue,
+                        size,
+                        estimator,
+                        np.mean(sample),
+                        sd,
+                        size * (sd_plain / sd) ** 2 if sd > 0 else float("inf"),
+                    ]
+                )
+    click.echo(
+        "{} {}, {} seeds, {:.1f} s (fits) / {:.1f} s (controls)".format(
+            preset, pair, seeds, times["fits"], times["control"]
+        )
+    )
+    click.echo(
+        tabulate(
+            data,
+            headers=[
+                "p",
+                "Replicates",
+                "Estimator",
+                "Critical LL",
+                "sd",
+                "Plain-equivalent",
+            ],
+            floatfmt=".3f",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-__all__ = ["models", "optimizer", "__version__"]
+__all__ = ["models", "optimizer", "resultset", "__version__"]
 
-from . import models, optimizer
+from . import models, optimizer, resultset
 from .version import version as __version__
@@ -0,0 +1,300 @@
+import contextlib
+import csv
+import io
+import json
+import os
+from collections import OrderedDict
+from functools import partial
+
+from .models import models_nrds
+from .optimizer import CanonicalOptimizer, Optimizer, SharedFits
+from .parallel import parallel_imap
+from .printers import log_info
+from .resultset import ResultSet
+from .selection import (
+    LevelFits,
+    LevelTester,
+    get_forward_fields,
+    get_reverse_fields,
+    result_fields,
+    select_forward,
+    select_reverse,
+)
+from .utils import canonize_y
+
+__all__ = [
+    "y_fields",
+    "r_fields",
+    "pipelines",
+    "detect_format",
+    "read_quartets",
+    "get_headers",
+    "analyze_quartet",
+    "group_quartets",
+    "analyze_group",
+    "AnalysisError",
+    "analyze_quartets",
+]
+
+y_fields = ["y11", "y12", "y13", "y14", "y22", "y23", "y24", "y33", "y34", "y44"]
+r_fields = ["r1", "r2", "r3", "r4"]
+pipelines = ["mle-nr", "stat-levels", "stat-reverse", "stat"]
+
+
+def detect_format(filename):
+    """Guess input format from the file extension.
+
+    >>> detect_format("quartets.tsv.gz"), detect_format("q.jsonl"), detect_format("-")
+    ('tsv', 'jsonl', 'csv')
+    """
+    name = filename.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    ext = os.path.splitext(name)[1]
+    if ext in (".tsv", ".tab"):
+        return "tsv"
+    if ext in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    return "csv"
+
+
+def read_quartets(f, fmt="csv", r_default=(1, 1, 1, 1)):
+    """Yield `(id, y, r)` of every quartet in the open file `f`.
+
+    CSV/TSV files have a header with `id`, `y11`...`y44` and optional
+    `r1`...`r4` columns. JSONL lines are objects with `id`, `y` (ten values)
+    and optional `r` (four values). Missing ids are replaced by the record
+    number (starting from 1), missing r by `r_default`.
+
+    >>> f = io.StringIO("id,y11,y12,y13,y14,y22,y23,y24,y33,y34,y44,r1,r2,r3,r4\\n"
+    ...                 "q1,1,2,3,4,5,6,7,8,9,10,1,1,0.5,1\\n")
+    >>> list(read_quartets(f))
+    [('q1', (1, 2, 3, 4, 5, 6, 7, 8, 9, 10), (1.0, 1.0, 0.5, 1.0))]
+    >>> f = io.StringIO('{"y": [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]}\\n\\n')
+    >>> list(read_quartets(f, "jsonl"))
+    [('1', (1, 2, 3, 4, 5, 6, 7, 8, 9, 10), (1, 1, 1, 1))]
+    """
+    r_default = tuple(r_default)
+    if fmt == "jsonl":
+        number = 0
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                record = json.loads(line)
+                y = tuple(int(x) for x in record["y"])
+                r = tuple(float(x) for x in record["r"]) if "r" in record else r_default
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError("line {}: bad record ({})".format(line_number, e))
+            yield check_quartet(
+                str(record.get("id", number)), y, r, "line {}".format(line_number)
+            )
+    else:
+        reader = csv.DictReader(f, delimiter="\t" if fmt == "tsv" else ",")
+        missing = [name for name in y_fields if name not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError("missing columns: {}".format(", ".join(missing)))
+        has_r = all(name in reader.fieldnames for name in r_fields)
+        for number, row in enumerate(reader, start=1):
+            where = "line {}".format(reader.line_num)
+            try:
+                y = tuple(int(row[name]) for name in y_fields)
+                r = tuple(float(row[name]) for name in r_fields) if has_r else r_default
+            except (ValueError, TypeError):
+                raise ValueError("{}: bad y or r values".format(where))
+            yield check_quartet(row.get("id") or str(number), y, r, where)
+
+
+def check_quartet(id_, y, r, where):
+    if len(y) != 10:
+        raise ValueError("{}: expected ten y values, got {}".format(where, len(y)))
+    if len(r) != 4:
+        raise ValueError("{}: expected four r values, got {}".format(where, len(r)))
+    if any(x < 0 for x in y) or not sum(y):
+        raise ValueError(
+            "{}: y values must be non-negative, not all zero".format(where)
+        )
+    return (id_, y, r)
+
+
+def get_headers(pipeline):
+    """Header of the batch results table for the given pipeline.
+
+    >>> get_headers("mle-nr")[:4]
+    ['id', 'Level', 'Model', 'Mnemo']
+    >>> get_headers("stat")[:3], get_headers("stat")[-1]
+    (['id', 'Procedure', 'Level'], 'pvalue')
+    """
+    if pipeline == "mle-nr":
+        return ["id"] + result_fields[:-3]
+    return ["id", "Procedure"] + result_fields + ["pvalue"]
+
+
+def get_theta0(y):
+    return (round(0.6 * sum(y), 5), 0.5, 0.5, 0.5, 0.5)
+
+
+@contextlib.contextmanager
+def _nullcontext():
+    yield
+
+
+def analyze_quartet(
+    quartet,
+    pipeline,
+    method="SLSQP",
+    critical_pvalues=(0.05,),
+    excluded_models=(),
+    null="chi2",
+    debug=False,
+    shared=None,
+    with_results=False,
+):
+    """Run `pipeline` on one quartet, return rows of the batch results table.
+
+    Module-level function, so it can be mapped over a process pool. Logs of
+    the selection procedures are suppressed unless `debug`. With `shared`
+    fits (see `analyze_group`), fits are taken from them. With
+    `with_results`, returns `(rows, results)` with a ResultSet of all fits of
+    the levels the pipeline has reached.
+    """
+    id_, y, r = quartet
+    theta0 = get_theta0(y)
+    if shared is None:
+        optimizer = Optimizer(y, r, theta0, method)
+    else:
+        optimizer = CanonicalOptimizer(y, r, theta0, method, shared)
+    # Note: keep the level order stable (unlike set difference)
+    models_by_level = {
+        level: [model for model in models if model not in excluded_models]
+        for level, models in models_nrds.items()
+    }
+    levels = [
+        level for level in ["N4", "N3", "N2", "N1", "N0"] if models_by_level[level]
+    ]
+    fits = LevelFits(optimizer, models_by_level)
+    tester = None
+    if null == "chibar":
+        # Note: a fixed seed keeps rows reproducible regardless of jobs and resumes
+        tester = LevelTester(r, theta0, method, chibar=True, seed_sequence=0)
+
+    rows = []
+    if pipeline == "mle-nr":
+        # Note: only the best result of every level
+        for level in levels:
+            result = fits[level]
+            rows.append(
+                [id_, level, result.model.name, result.model.mnemonic_name]
+                + ["".join(map(str, result.permutation)), result.LL]
+                + list(result.theta)
+            )
+    else:
+        levels_reverse = [levels[0]] + levels[:0:-1]
+        with contextlib.redirect_stdout(io.StringIO()) if not debug else _nullcontext():
+            for critical_pvalue in critical_pvalues:
+                if pipeline in ("stat-levels", "stat"):
+                    final_level, final_result = select_forward(
+                        levels, fits, models_by_level, critical_pvalue, tester
+                    )
+                    fields = get_forward_fields(levels, fits, final_level, final_result)
+                    rows.append([id_, "levels"] + fields + [critical_pvalue])
+                if pipeline in ("stat-reverse", "stat"):
+                    final_level, final_result, pgood = select_reverse(
+                        levels_reverse, fits, models_by_level, critical_pvalue, tester
+                    )
+                    fields = get_reverse_fields(
+                        levels_reverse, fits, final_level, final_result, pgood
+                    )
+                    rows.append([id_, "reverse"] + fields + [critical_pvalue])
+
+    if with_results:
+        # Note: all fits of the levels the pipeline has reached
+        return rows, ResultSet.concatenate(fits.results_by_level.values())
+    return rows
+
+
+def group_quartets(quartets):
+    """Group quartets with y related by a relabeling of species (and same r).
+
+    Returns lists of `(index, quartet)`, in order of first appearance.
+
+    >>> y = (10, 8, 7, 4, 21, 7, 2, 39, 30, 28)
+    >>> y_ = (21, 8, 2, 7, 10, 4, 7, 28, 30, 39)  # morph10(y, (2, 1, 4, 3))
+    >>> quartets = [("a", y, (1, 1, 1, 1)), ("b", y[::-1], (1, 1, 1, 1)), ("c", y_, (1, 1, 1, 1))]
+    >>> [[index for index, _ in group] for group in group_quartets(quartets)]
+    [[0, 2], [1]]
+    """
+    groups = OrderedDict()
+    for index, quartet in enumerate(quartets):
+        _, y, r = quartet
+        groups.setdefault((canonize_y(y)[0], r), []).append((index, quartet))
+    return list(groups.values())
+
+
+def analyze_group(group, pipeline, method="SLSQP", **kwargs):
+    """Run `analyze_quartet` on a group of quartets (see `group_quartets`),
+    fitting every (model, permutation) problem once for the whole group.
+
+    Returns a list of `(index, result)` with results of `analyze_quartet`.
+    """
+    _, (_, y, r) = group[0]
+    y_canonical = canonize_y(y)[0]
+    shared = SharedFits(y_canonical, r, get_theta0(y_canonical), method)
+    return [
+        (index, analyze_quartet(quartet, pipeline, method, shared=shared, **kwargs))
+        for index, quartet in group
+    ]
+
+
+class AnalysisError(Exception):
+    """Failure of the analysis of a quartet (not of reading the input)."""
+
+
+def _analyze_quartet(quartet, **kwargs):
+    try:
+        return quartet[0], analyze_quartet(quartet, **kwargs)
+    except Exception as e:
+        raise AnalysisError(
+            "quartet {}: {}: {}".format(quartet[0], type(e).__name__, e)
+        )
+
+
+def _analyze_group(group, **kwargs):
+    try:
+        return analyze_group(group, **kwargs)
+    except Exception as e:
+        raise AnalysisError(
+            "quartets {}: {}: {}".format(
+                ",".join(str(quartet[0]) for _, quartet in group),
+                type(e).__name__,
+                e,
+            )
+        )
+
+
+def analyze_quartets(quartets, share_permutations=False, jobs=1, **kwargs):
+    """Yield `(id, result)` of `analyze_quartet` for every quartet, in order.
+
+    With `share_permutations`, all quartets are read into memory and fitted
+    by groups (see `analyze_group`), results are yielded as soon as they and
+    all previous ones are ready. Errors of the analysis are raised as
+    AnalysisError, errors of reading `quartets` propagate as they are.
+    """
+    if not share_permutations:
+        worker = partial(_analyze_quartet, **kwargs)
+        for result in parallel_imap(worker, quartets, jobs=jobs, chunksize=4):
+            yield result
+        return
+    quartets = list(quartets)
+    groups = group_quartets(quartets)
+    log_info(
+        "Quartets: {}, distinct up to relabeling: {}".format(len(quartets), len(groups))
+    )
+    ready = {}
+    n = 0
+    for results in parallel_imap(partial(_analyze_group, **kwargs), groups, jobs=jobs):
+        ready.update(results)
+        while n in ready:
+            yield quartets[n][0], ready.pop(n)
+            n += 1
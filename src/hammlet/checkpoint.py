@@ -0,0 +1,284 @@
+import csv
+import hashlib
+import json
+import os
+import shutil
+
+import click
+
+from .parallel import get_seed_sequence
+
+__all__ = ["Checkpoint", "get_fingerprint", "BatchCheckpoint"]
+
+
+class Checkpoint(object):
+    """Append-only checkpoint of completed bootstrap replicates.
+
+    The file is in JSON lines format. The first line is a header with the run
+    parameters and the seed entropy, each following line is a chunk of
+    completed replicates: ``{"key": ..., "index": [...], "values": [...]}``.
+    Every replicate has its own random stream derived from the seed and its
+    index, so the seed is the whole RNG state needed to continue a run.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "checkpoint.jsonl")
+    >>> checkpoint = Checkpoint(path, {"y": [1, 2]}, seed=42)
+    >>> checkpoint.append([0, 1], [0.5, 1.5])
+    >>> checkpoint.append([2], [2.5], key="N4-N3")
+    >>> resumed = Checkpoint(path, {"y": [1, 2]}, resume=True)
+    >>> resumed.seed, len(resumed), resumed.completed()
+    (42, 3, {0: 0.5, 1: 1.5})
+    >>> resumed.completed("N4-N3")
+    {2: 2.5}
+    >>> Checkpoint(path, {"y": [2, 1]}, resume=True)
+    Traceback (most recent call last):
+    ...
+    ValueError: checkpoint was created with different parameters
+    >>> Checkpoint(path, {"y": [1, 2]}, seed=7, resume=True)
+    Traceback (most recent call last):
+    ...
+    ValueError: checkpoint was created with seed 42
+
+    A chunk cut short by an interruption is dropped on resume, and new
+    chunks are appended after the complete ones:
+
+    >>> with open(path, "a") as f:
+    ...     _ = f.write('{"key": "", "index": [3], "val')
+    >>> resumed = Checkpoint(path, {"y": [1, 2]}, resume=True)
+    >>> len(resumed)
+    3
+    >>> resumed.append([3], [3.5])
+    >>> Checkpoint(path, {"y": [1, 2]}, resume=True).completed()
+    {0: 0.5, 1: 1.5, 3: 3.5}
+    """
+
+    def __init__(self, path, params, seed=None, resume=False, every=100):
+        self.path = path
+        # Note: normalize tuples into lists to compare with the stored header
+        self.params = json.loads(json.dumps(params))
+        self.every = max(1, every)
+        # Note: only replicates read on resume are kept in memory
+        self.records = {}  # {key: {index: value}}
+        if resume and os.path.exists(path):
+            self.read(seed)
+        else:
+            self.seed = get_seed_sequence(seed).entropy
+            with open(path, "w") as f:
+                f.write(json.dumps({"params": self.params, "seed": self.seed}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read(self, seed=None):
+        with open(self.path, "rb") as f:
+            lines = f.read().split(b"\n")
+        header = json.loads(lines[0].decode("utf-8"))
+        if header["params"] != self.params:
+            raise ValueError("checkpoint was created with different parameters")
+        if seed is not None and seed != header["seed"]:
+            raise ValueError(
+                "checkpoint was created with seed {}".format(header["seed"])
+            )
+        self.seed = header["seed"]
+        size = len(lines[0]) + 1
+        for line in lines[1:-1]:
+            try:
+                chunk = json.loads(line.decode("utf-8"))
+            except ValueError:
+                break
+            self.records.setdefault(chunk["key"], {}).update(
+                zip(chunk["index"], chunk["values"])
+            )
+            size += len(line) + 1
+        # Drop the chunk which was being written when the run was interrupted
+        with open(self.path, "ab") as f:
+            f.truncate(size)
+
+    def __len__(self):
+        return sum(len(records) for records in self.records.values())
+
+    def completed(self, key=""):
+        """Return `{index: value}` of completed replicates."""
+        return dict(self.records.get(key, {}))
+
+    def append(self, indices, values, key=""):
+        """Durably record a chunk of completed replicates."""
+        indices = list(indices)
+        values = list(values)
+        chunk = {"key": key, "index": indices, "values": values}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(chunk) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def get_fingerprint(filename):
+    """Digest of the file contents.
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), "q.csv")
+    >>> with open(filename, "w") as f:
+    ...     _ = f.write("id,y11\\n")
+    >>> get_fingerprint(filename)[:16]
+    '5c3883275d1eac4e'
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BatchCheckpoint(object):
+    """Directory with results of a batch run, committed in chunks of quartets.
+
+    `manifest.json` holds the run parameters, the input fingerprint and the
+    completed chunks (number of quartets, first and last quartet id), every
+    chunk of rows is a CSV file without header. Chunks and the manifest are
+    written atomically, so after a crash the manifest lists exactly the
+    complete chunks, which are a prefix of the input.
+
+    The directory must be missing, empty or a checkpoint. Starting a new
+    run in a checkpoint removes only its manifest and chunks.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "checkpoint")
+    >>> checkpoint = BatchCheckpoint(path, {"pipeline": "mle-nr"}, "abc", every=2)
+    >>> for i in range(3):
+    ...     checkpoint.append("q{}".format(i), [["q{}".format(i), -i]])
+    >>> len(checkpoint)  # the third quartet is not committed yet
+    2
+    >>> checkpoint = BatchCheckpoint(path, {"pipeline": "mle-nr"}, "abc", resume=True)
+    >>> [id_ for id_, _, _ in checkpoint.skip([("q0", (), ()), ("q1", (), ()), ("q2", (), ())])]
+    ['q2']
+    >>> checkpoint.append("q2", [["q2", -2]])
+    >>> checkpoint.commit()
+    >>> import io
+    >>> f = io.StringIO()
+    >>> checkpoint.write_output(f, ["id", "LL"])
+    >>> print(f.getvalue().strip())
+    id,LL
+    q0,0
+    q1,-1
+    q2,-2
+    >>> BatchCheckpoint(path, {"pipeline": "stat"}, "abc", resume=True)
+    Traceback (most recent call last):
+    ...
+    ValueError: checkpoint was created with different parameters
+    >>> BatchCheckpoint(os.path.dirname(path), {}, "abc")
+    Traceback (most recent call last):
+    ...
+    ValueError: directory is not empty and is not a checkpoint
+    """
+
+    def __init__(self, path, params, fingerprint, resume=False, every=1000):
+        self.path = path
+        self.manifest_filename = os.path.join(path, "manifest.json")
+        # Note: normalize tuples into lists to compare with the stored manifest
+        self.params = json.loads(json.dumps(params))
+        self.every = max(1, every)
+        self.buffer = []
+        if resume and os.path.exists(self.manifest_filename):
+            with open(self.manifest_filename) as f:
+                self.manifest = json.load(f)
+            if self.manifest["params"] != self.params:
+                raise ValueError("checkpoint was created with different parameters")
+            if self.manifest["fingerprint"] != fingerprint:
+                raise ValueError("checkpoint was created for a different input")
+        else:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            elif os.path.exists(self.manifest_filename):
+                self._remove()
+            elif os.listdir(path):
+                raise ValueError("directory is not empty and is not a checkpoint")
+            self.manifest = {
+                "params": self.params,
+                "fingerprint": fingerprint,
+                "chunks": [],
+            }
+            self._write_manifest()
+
+    def _remove(self):
+        """Remove the manifest and chunks of the previous run (and nothing else)."""
+        with open(self.manifest_filename) as f:
+            manifest = json.load(f)
+        # Note: a chunk written just before a crash is not in the manifest yet
+        names = [chunk["file"] for chunk in manifest["chunks"]]
+        names.append(self._chunk_name(len(names)))
+        for name in names:
+            filename = os.path.join(self.path, name)
+            if os.path.exists(filename):
+                os.remove(filename)
+        os.remove(self.manifest_filename)
+
+    @staticmethod
+    def _chunk_name(index):
+        return "{:06d}.csv".format(index)
+
+    def __len__(self):
+        """Number of quartets with committed results."""
+        return sum(chunk["quartets"] for chunk in self.manifest["chunks"])
+
+    def _write_manifest(self):
+        with click.open_file(self.manifest_filename, "w", atomic=True) as f:
+            json.dump(self.manifest, f, indent=2)
+
+    def skip(self, quartets):
+        """Yield `quartets` except the committed ones."""
+        chunks = iter(self.manifest["chunks"])
+        chunk = next(chunks, None)
+        n = 0
+        for quartet in quartets:
+            if chunk is None:
+                yield quartet
+                continue
+            id_ = str(quartet[0])
+            if (n == 0 and id_ != chunk["first"]) or (
+                n == chunk["quartets"] - 1 and id_ != chunk["last"]
+            ):
+                raise ValueError(
+                    "quartet {} does not match chunk {} of the checkpoint".format(
+                        id_, chunk["file"]
+                    )
+                )
+            n += 1
+            if n == chunk["quartets"]:
+                chunk = next(chunks, None)
+                n = 0
+        if chunk is not None:
+            raise ValueError("input is shorter than the checkpoint")
+
+    def append(self, id_, rows):
+        """Add all rows of the next quartet `id_`, commit every `every` quartets."""
+        self.buffer.append((str(id_), rows))
+        if len(self.buffer) >= self.every:
+            self.commit()
+
+    def commit(self):
+        """Atomically write buffered rows as a new chunk and update the manifest."""
+        if not self.buffer:
+            return
+        chunks = self.manifest["chunks"]
+        name = self._chunk_name(len(chunks))
+        with click.open_file(os.path.join(self.path, name), "w", atomic=True) as f:
+            writer = csv.writer(f, lineterminator="\n")
+            for _, rows in self.buffer:
+                writer.writerows(rows)
+        chunks.append(
+            {
+                "file": name,
+                "quartets": len(self.buffer),
+                "first": self.buffer[0][0],
+                "last": self.buffer[-1][0],
+            }
+        )
+        self._write_manifest()
+        self.buffer = []
+
+    def write_output(self, f, headers):
+        """Write `headers` and rows of all committed chunks to the open file `f`."""
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(headers)
+        for chunk in self.manifest["chunks"]:
+            with open(os.path.join(self.path, chunk["file"])) as f_chunk:
+                shutil.copyfileobj(f_chunk, f)
@@ -0,0 +1,335 @@
+from __future__ import division
+
+import itertools
+import zlib
+
+import numpy as np
+
+from .ecdf import critical_index
+from .models import constraint_value
+from .optimizer import Optimizer, get_problems
+from .parallel import get_seed_sequence, replicate_rng
+from .printers import log_debug
+from .utils import get_a, morph10
+
+__all__ = [
+    "get_mean",
+    "get_free",
+    "get_jacobian",
+    "get_cones",
+    "cone_norms",
+    "ChiBarNull",
+]
+
+
+def get_mean(model, perm, theta, r):
+    """Expected y (in the order of the input y) of `model` fitted with permutation `perm`.
+
+    >>> from hammlet.models import models_mapping
+    >>> theta, r = (100, 1, 2, 0.6, 0.3), (1, 1, 1, 1)
+    >>> mean = get_mean(models_mapping["2H1"], (2, 4, 3, 1), theta, r)
+    >>> morph10(tuple(mean), (2, 4, 3, 1)) == get_a(models_mapping["2H1"], theta, r)
+    True
+    """
+    index = morph10(tuple(range(10)), perm)
+    mean = np.empty(10)
+    mean[list(index)] = get_a(model, theta, r)
+    return mean
+
+
+def get_free(model):
+    """Indices (in theta) of free parameters of `model`.
+
+    Parameters fixed at 0 or 1 and parameters the model does not use (`n`
+    and `N` in the mnemonic name) are not free.
+
+    >>> from hammlet.models import models_mapping
+    >>> get_free(models_mapping["2H1"]), get_free(models_mapping["PT"])
+    ([0, 1, 2, 3, 4], [0, 2])
+    """
+    free = []
+    for i, bounds in enumerate(model.bounds):
+        if bounds is None:
+            continue
+        low, high = bounds
+        if high is None or high - low > 1e-6:
+            free.append(i)
+    return free
+
+
+def get_jacobian(model, perm, theta, r, indices, h=1e-6):
+    """Derivatives (10, k) of `get_mean` by the parameters listed in `indices`.
+
+    Finite differences step inside the model bounds, so `theta` may lie on
+    the boundary (derivatives are then one-sided).
+
+    >>> from hammlet.models import models_mapping
+    >>> J = get_jacobian(models_mapping["2H1"], (1, 2, 3, 4), (100, 1, 2, 0.6, 1), (1, 1, 1, 1), [0, 4])
+    >>> J.shape, bool(np.allclose(J[:, 0] * 100, get_a(models_mapping["2H1"], (100, 1, 2, 0.6, 1), (1, 1, 1, 1))))
+    ((10, 2), True)
+    """
+    bounds = model.get_safe_bounds()
+    theta = np.asarray(theta, dtype=float)
+    mean = get_mean(model, perm, theta, r)
+    columns = []
+    for i in indices:
+        step = h * max(1.0, abs(theta[i]))
+        high = bounds[i][1]
+        if high is not None and theta[i] + step > high:
+            step = -step
+        theta_step = theta.copy()
+        theta_step[i] += step
+        columns.append((get_mean(model, perm, theta_step, r) - mean) / step)
+    return np.array(columns).reshape(len(indices), 10).T
+
+
+def get_cones(model, perm, theta, r, mean, grid=5, tol=1e-4):
+    """Tangent cones of `model` (fitted with `perm`) at `theta`, where it has `mean`.
+
+    Returns a list of `(W, constrained)`: `W` (10, k) are derivatives of the
+    mean by the free parameters, scaled by the Poisson standard deviations
+    `sqrt(mean)`, and `constrained` marks parameters at a bound (their column
+    is negated at an upper bound, so that the cone is `W b` with `b >= 0` for
+    the constrained parameters). A parameter without effect at `theta` (e.g. a
+    gamma when its T is 0) is unidentified: the cone depends on its value, so
+    there is one cone per point of a `grid` over its range.
+    """
+    free = get_free(model)
+    bounds = model.bounds
+    theta = np.array(theta, dtype=float)
+    signs = []
+    for i in free:
+        low, high = bounds[i]
+        if theta[i] - low < tol:
+            signs.append(1.0)
+        elif high is not None and high - theta[i] < tol:
+            signs.append(-1.0)
+        else:
+            signs.append(0.0)
+    scale = np.sqrt(mean)
+    W = get_jacobian(model, perm, theta, r, free) / scale[:, None]
+    norms = np.sqrt((W**2).sum(axis=0))
+    identified = norms > 1e-5 * norms.max()
+    unidentified = [i for i, ok in zip(free, identified) if not ok]
+    free = [i for i, ok in zip(free, identified) if ok]
+    signs = np.array(signs)[identified]
+    if not unidentified:
+        points = [theta]
+    else:
+        safe_bounds = model.get_safe_bounds(T_high=3)
+        points = []
+        for values in itertools.product(
+            *[np.linspace(*safe_bounds[i], num=grid) for i in unidentified]
+        ):
+            point = theta.copy()
+            point[unidentified] = values
+            points.append(point)
+    cones = []
+    for point in points:
+        W = get_jacobian(model, perm, point, r, free) / scale[:, None]
+        cones.append((W * np.where(signs < 0, -1.0, 1.0), signs != 0))
+    return cones
+
+
+def cone_norms(Z, W, constrained, tol=1e-10):
+    """Squared norms of projections of rows of `Z` on the cone of `W`.
+
+    The cone is `{W b: b_i >= 0 for constrained i}`. A projection on a
+    polyhedral cone is the least squares fit on one of its faces (some
+    constrained columns dropped) with non-negative constrained coefficients,
+    and among such feasible fits it has the largest norm. All faces are
+    enumerated, so this is exact for any number of constraints.
+
+    >>> Z = np.array([[1.0, -2.0], [-3.0, 4.0]])
+    >>> cone_norms(Z, np.eye(2), np.array([True, False])).tolist()
+    [5.0, 16.0]
+    >>> cone_norms(Z, np.eye(2), np.array([True, True])).tolist()
+    [1.0, 16.0]
+    """
+    indices = np.flatnonzero(constrained)
+    best = np.zeros(len(Z))
+    for k in range(len(indices) + 1):
+        for dropped in itertools.combinations(indices, k):
+            columns = [i for i in range(W.shape[1]) if i not in dropped]
+            if not columns:
+                continue
+            W_face = W[:, columns]
+            B = Z.dot(np.linalg.pinv(W_face).T)
+            norms = (B.dot(W_face.T) ** 2).sum(axis=1)
+            check = [j for j, i in enumerate(columns) if constrained[i]]
+            feasible = (B[:, check] >= -tol).all(axis=1)
+            best = np.where(feasible & (norms > best), norms, best)
+    return best
+
+
+class ChiBarNull(object):
+    """Asymptotic null distribution of 2*(LL_senior - LL_junior) at the parameter boundary.
+
+    A faster alternative to `NullDistribution` with the same null hypothesis
+    (the junior model with given theta) and the same statistic (the best
+    senior model and permutation versus the best junior permutation).
+
+    Replicates y are asymptotically Gaussian around a_ij of the junior model,
+    with standardized residuals `z ~ N(0, I)`. Every model and permutation
+    that contains this null point (its fit on the expected a_ij reproduces
+    them within `tol` of deviance) gains `|P_C z|^2` in 2*LL over the null
+    point, where `C` is its tangent cone there: parameters on the boundary
+    restrict the cone, so single comparisons are chi-bar-square mixtures with
+    weights given by the expected information at the null point. Models and
+    permutations which do not contain it are asymptotically irrelevant.
+
+    The statistic is the maximum over cones of the senior level minus the
+    maximum over cones of the junior model, which has no closed form, so it
+    is simulated: `size` draws of `z` (cheap, no fits) instead of refits of
+    bootstrap replicates. Unidentified parameters (e.g. a gamma when its T is
+    0) are handled by a grid of their values, so critical values may be a
+    little too small in such cases.
+
+    The same statistic of bootstrap replicates needs no fits either, so it
+    serves as their control variate (see `NullDistribution`).
+    """
+
+    def __init__(
+        self,
+        models_senior,
+        model_junior,
+        theta,
+        r,
+        theta0,
+        method,
+        seed_sequence=None,
+        size=20000,
+        tol=1e-2,
+        debug=False,
+    ):
+        self.models_senior = list(models_senior)
+        self.model_junior = model_junior
+        self.theta = tuple(theta)
+        self.r = tuple(r)
+        self.theta0 = theta0
+        self.method = method
+        self.seed_sequence = get_seed_sequence(seed_sequence)
+        self.size = size
+        self.tol = tol
+        self.debug = debug
+        self.a = np.array(get_a(model=model_junior, theta=self.theta, r=self.r))
+        self.optimizer = Optimizer(tuple(self.a), self.r, theta0, method)
+        self.sample = None
+        self.control_sample = None
+        self.cones = None  # (senior, junior)
+
+    @property
+    def key(self):
+        return (
+            self.model_junior.name,
+            tuple(sorted(model.name for model in self.models_senior)),
+        )
+
+    def get_cones(self, problems):
+        """Tangent cones of all `problems` (model, permutation) containing the null point."""
+        cones = []
+        for model, perm in problems:
+            # Note: the null theta is a good start where the model contains it
+            start = model.apply_bounds(
+                [
+                    constraint_value(x, b)
+                    for x, b in zip(self.theta, model.get_safe_bounds())
+                ]
+            )
+            result = max(
+                [
+                    self.optimizer.one(model, perm),
+                    self.optimizer.one(model, perm, start),
+                ],
+                key=lambda result: result.LL,
+            )
+            mean = get_mean(model, perm, result.theta, self.r)
+            mask = self.a > 0
+            deviance = 2 * np.sum(
+                self.a[mask] * np.log(self.a[mask] / mean[mask])
+                - self.a[mask]
+                + mean[mask]
+            ) + 2 * np.sum(mean[~mask])
+            if deviance > self.tol:
+                continue
+            if self.debug:
+                log_debug(
+                    "{} ({}) contains the null point (deviance {:.2g})".format(
+                        model, "".join(map(str, perm)), deviance
+                    )
+                )
+            cones.extend(get_cones(model, perm, result.theta, self.r, self.a))
+        return cones
+
+    @property
+    def stream(self):
+        # Note: crc32 (unlike hash) is stable between runs
+        return zlib.crc32(repr(self.key).encode("utf-8"))
+
+    @property
+    def n_cones(self):
+        if self.cones is None:
+            return None
+        cones_senior, cones_junior = self.cones
+        return len(cones_senior), len(cones_junior)
+
+    def get_all_cones(self):
+        """Tangent cones of the senior and of the junior models (computed once)."""
+        if self.cones is None:
+            self.cones = (
+                self.get_cones(get_problems(self.models_senior, "model")),
+                self.get_cones(get_problems([self.model_junior], "model")),
+            )
+        return self.cones
+
+    def statistic(self, Z):
+        """Asymptotic 2*(LL_senior - LL_junior) for rows of standardized residuals `Z`."""
+        cones_senior, cones_junior = self.get_all_cones()
+        senior = np.zeros(len(Z))
+        for W, constrained in cones_senior:
+            senior = np.maximum(senior, cone_norms(Z, W, constrained))
+        junior = np.zeros(len(Z))
+        for W, constrained in cones_junior:
+            junior = np.maximum(junior, cone_norms(Z, W, constrained))
+        return senior - junior
+
+    def control(self, ys):
+        """Asymptotic statistic of replicates `ys`, a control variate of their LL2.
+
+        It needs no fits, and its distribution is known (see `get_control_sample`).
+        """
+        ys = np.asarray(ys, dtype=float).reshape(-1, 10)
+        return self.statistic((ys - self.a) / np.sqrt(self.a))
+
+    def get_control_sample(self):
+        """Sorted `control` of `size` Poisson replicates around a_ij (computed once).
+
+        Bootstrap replicates are Poisson rather than Gaussian draws, so this
+        (and not `sorted`) is the distribution of their control variates.
+        """
+        if self.control_sample is None:
+            ys = replicate_rng(self.seed_sequence, self.stream).poisson(
+                self.a, (self.size, 10)
+            )
+            self.control_sample = np.sort(self.control(ys))
+        return self.control_sample
+
+    def compute(self):
+        Z = replicate_rng(self.seed_sequence, self.stream).standard_normal(
+            (self.size, 10)
+        )
+        self.sample = np.sort(self.statistic(Z))
+
+    def __len__(self):
+        return 0 if self.sample is None else len(self.sample)
+
+    def sorted(self):
+        if self.sample is None:
+            self.compute()
+        return self.sample
+
+    def critical_index(self, pvalue):
+        return critical_index(len(self.sorted()), pvalue)
+
+    def critical_value(self, pvalue):
+        return self.sorted()[self.critical_index(pvalue)]
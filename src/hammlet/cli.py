@@ -60,8 +60,17 @@ cli.add_command(commands.calculate_aij)
 cli.add_command(commands.draw)
 # cli.add_command(commands.chains)
 # cli.add_command(commands.levels)
+cli.add_command(commands.stat)
 cli.add_command(commands.stat_levels)
 cli.add_command(commands.stat_reverse)
+cli.add_command(commands.ecdf_table)
+cli.add_command(commands.ecdf_cache)
+cli.add_command(commands.batch)
+cli.add_command(commands.patterns)
+cli.add_command(commands.export)
+cli.add_command(commands.query)
+cli.add_command(commands.worker)
+cli.add_command(commands.coordinator)
 
 if __name__ == "__main__":
     cli()
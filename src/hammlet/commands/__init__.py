@@ -1,26 +1,44 @@
 __all__ = [
+    "batch",
     "bootstrap",
     "bootstrap_LL",
     "calculate_aij",
     "chains",
+    "coordinator",
     "draw",
+    "ecdf_cache",
+    "ecdf_table",
+    "export",
     "levels",
     "mle",
     "mle_nr",
+    "patterns",
+    "query",
     "show_permutation",
+    "stat",
     "stat_chains",
     "stat_levels",
     "stat_reverse",
+    "worker",
 ]
 
+from .batch import batch
 from .bootstrap import bootstrap
 from .bootstrap_LL import bootstrap_LL
 from .calculate_aij import calculate_aij
 from .chains import chains
+from .coordinator import coordinator
 from .draw import draw
+from .ecdf_cache import ecdf_cache
+from .ecdf_table import ecdf_table
+from .export import export
 from .levels import levels
 from .mle import mle
 from .mle_nr import mle_nr
+from .patterns import patterns
+from .query import query
 from .show_permutation import show_permutation
+from .stat import stat
 from .stat_levels import stat_levels
 from .stat_reverse import stat_reverse
+from .worker import worker
@@ -0,0 +1,536 @@
+import contextlib
+import csv
+import gzip
+from functools import partial
+
+import click
+import numpy as np
+
+from ..batch import (
+    AnalysisError,
+    analyze_quartets,
+    detect_format,
+    get_headers,
+    pipelines,
+    read_quartets,
+)
+from ..checkpoint import BatchCheckpoint, get_fingerprint
+from ..database import ResultsDB
+from ..jobqueue import JobQueue
+from ..markers import iter_quartets, read_markers
+from ..models import models_nrds
+from ..parallel import get_jobs, get_seed_sequence
+from ..parsers import parse_floats, parse_models
+from ..printers import log_info, log_success
+from ..resultstore import ResultStoreWriter
+from ..sampling import (
+    n_quartets,
+    sample_balanced,
+    sample_focal,
+    sample_uniform,
+    samplers,
+)
+from ..utils import autotimeit
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input",
+    "input_filename",
+    type=click.Path(exists=True, allow_dash=True),
+    metavar="<path|->",
+    help="File with quartets: CSV/TSV with id,y11,...,y44[,r1,...,r4] columns or JSONL with id, y and r (optionally gzipped)",
+)
+@click.option(
+    "--markers",
+    "markers_filename",
+    type=click.Path(exists=True, allow_dash=True),
+    metavar="<path|->",
+    help="File with presence/absence of markers in N species (instead of -i), all quartets of species are analyzed",
+)
+@click.option(
+    "--sample",
+    type=click.Choice(samplers),
+    help="Analyze sampled quartets of --markers species instead of all: uniform (--budget quartets), balanced (every species in --coverage quartets) or focal (quartets with --focal species)",
+)
+@click.option(
+    "--budget",
+    type=int,
+    metavar="<int>",
+    help="Maximum number of sampled quartets (required for uniform)",
+)
+@click.option(
+    "--coverage",
+    type=int,
+    metavar="<int>",
+    default=1,
+    show_default=True,
+    help="Number of sampled quartets with every species (balanced)",
+)
+@click.option(
+    "--focal",
+    metavar="<name,...>",
+    help="Comma-separated list of focal species (focal)",
+)
+@click.option(
+    "--seed",
+    type=int,
+    metavar="<int>",
+    help="Seed for sampling random number generator",
+)
+@click.option(
+    "--format",
+    "input_format",
+    type=click.Choice(["auto", "csv", "tsv", "jsonl"]),
+    default="auto",
+    show_default=True,
+    help="Input format (auto: by file extension)",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_filename",
+    type=click.Path(writable=True, allow_dash=True),
+    metavar="<path|->",
+    required=True,
+    help="Output CSV file with results for all quartets",
+)
+@click.option(
+    "--output-mle",
+    "output_filename_mle",
+    type=click.Path(writable=True),
+    metavar="<path>",
+    help="Output directory with all MLE fits of all quartets as .npy columns (see export): new, empty or a store of an earlier run",
+)
+@click.option(
+    "--db",
+    "db_filename",
+    type=click.Path(dir_okay=False, writable=True),
+    metavar="<path>",
+    help="SQLite database to add all MLE fits and selection results to (see query)",
+)
+@click.option(
+    "--queue",
+    "queue_path",
+    type=click.Path(file_okay=False, writable=True),
+    metavar="<path>",
+    help="Only split quartets into shards of a job queue in this directory, to be analyzed by workers on any node (see worker and coordinator)",
+)
+@click.option(
+    "--shard-size",
+    type=int,
+    metavar="<int>",
+    default=100,
+    show_default=True,
+    help="Number of quartets in a shard of the job queue",
+)
+@click.option(
+    "--pipeline",
+    type=click.Choice(pipelines),
+    default="stat-levels",
+    show_default=True,
+    help="Analysis to run on every quartet: mle-nr gives only the best fit of every level (unlike the mle-nr command, which lists all fits), stat-levels, stat-reverse and stat use chi2 critical values only (no ECDF options of these commands)",
+)
+@click.option(
+    "-r",
+    nargs=4,
+    type=float,
+    metavar="<float...>",
+    default=(1, 1, 1, 1),
+    show_default=True,
+    help="Space-separated list of "
+    + click.style("four", bold=True)
+    + " r values for quartets without their own",
+)
+@click.option(
+    "-x",
+    "--exclude",
+    "excluded_models",
+    multiple=True,
+    metavar="<name...|all>",
+    required=False,
+    callback=parse_models,
+    help="Comma-separated list of models to exclude",
+)
+@click.option(
+    "-p",
+    "--pvalue",
+    "critical_pvalues",
+    metavar="<float,...>",
+    callback=parse_floats,
+    default="0.05",
+    show_default=True,
+    help="Comma-separated list of p-values for statistical tests",
+)
+@click.option(
+    "--null",
+    type=click.Choice(["chi2", "chibar"]),
+    default="chi2",
+    show_default=True,
+    help="Null distribution of 2*delta LL (see stat-levels)",
+)
+@click.option(
+    "--method",
+    type=click.Choice(["SLSQP", "L-BFGS-B", "TNC"]),
+    default="SLSQP",
+    show_default=True,
+    help="Optimization method",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=0),
+    metavar="<int>",
+    default=1,
+    show_default=True,
+    help="Number of parallel jobs (0 means all CPUs)",
+)
+@click.option(
+    "--progress-every",
+    type=int,
+    metavar="<int>",
+    default=1000,
+    show_default=True,
+    help="Log progress after this many quartets",
+)
+@click.option(
+    "--share-permutations",
+    is_flag=True,
+    help="Fit quartets with y related by a relabeling of species once (input is read into memory, results keep its order)",
+)
+@click.option(
+    "--checkpoint",
+    "checkpoint_path",
+    type=click.Path(file_okay=False, writable=True),
+    metavar="<path>",
+    help="Commit results of completed quartets in chunks to this directory",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue the interrupted run recorded in --checkpoint, skipping committed quartets",
+)
+@click.option(
+    "--checkpoint-every",
+    type=click.IntRange(min=1),
+    metavar="<int>",
+    default=1000,
+    show_default=True,
+    help="Number of quartets per checkpoint chunk",
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def batch(
+    input_filename,
+    markers_filename,
+    sample,
+    budget,
+    coverage,
+    focal,
+    seed,
+    input_format,
+    output_filename,
+    output_filename_mle,
+    db_filename,
+    queue_path,
+    shard_size,
+    pipeline,
+    r,
+    excluded_models,
+    critical_pvalues,
+    null,
+    method,
+    jobs,
+    progress_every,
+    share_permutations,
+    checkpoint_path,
+    resume,
+    checkpoint_every,
+    debug,
+):
+    """Analyze many quartets from a file."""
+
+    if (input_filename is None) == (markers_filename is None):
+        raise click.UsageError("Exactly one of -i/--input and --markers is required")
+    if markers_filename is not None:
+        input_filename = markers_filename
+        input_format = "markers"
+    elif input_format == "auto":
+        input_format = detect_format(input_filename)
+    sampler = get_sampler(
+        input_format, sample, budget, coverage, focal, seed, checkpoint_path
+    )
+    jobs = get_jobs(jobs)
+    log_info("Input: <{}> ({})".format(input_filename, input_format))
+    log_info("Pipeline: {}, jobs: {}".format(pipeline, jobs))
+
+    if pipeline != "mle-nr" and set(excluded_models) >= set(models_nrds["N4"]):
+        raise click.BadParameter("no models left in N4", param_hint="-x/--exclude")
+
+    params = dict(
+        input=input_filename,
+        pipeline=pipeline,
+        method=method,
+        pvalues=list(critical_pvalues),
+        excluded=[model.name for model in excluded_models],
+        null=null,
+        r=list(r),
+    )
+    if sampler is not None:
+        params["sample"] = dict(sampler.keywords)
+    if queue_path:
+        if output_filename_mle or db_filename:
+            raise click.UsageError("--output-mle and --db can not be used with --queue")
+        if shard_size < 1:
+            raise click.BadParameter("must be positive", param_hint="--shard-size")
+        params.update(output=output_filename, share_permutations=share_permutations)
+        enqueue(
+            queue_path, params, input_filename, input_format, r, shard_size, sampler
+        )
+        return
+
+    checkpoint = open_checkpoint(
+        checkpoint_path,
+        params,
+        input_filename,
+        resume,
+        checkpoint_every,
+        resumable=not (output_filename_mle or db_filename),
+    )
+
+    headers = get_headers(pipeline)
+    n_resumed = len(checkpoint) if checkpoint is not None else 0
+    with open_input(input_filename) as f_input:
+        try:
+            quartets = iter_input(f_input, input_format, r, sampler)
+        except ValueError as e:
+            raise click.ClickException("{}: {}".format(input_filename, e))
+        store, db, run = open_outputs(output_filename_mle, db_filename, params)
+        if n_resumed:
+            log_info(
+                "Resuming from checkpoint <{}> with {} completed quartets".format(
+                    checkpoint_path, n_resumed
+                )
+            )
+            quartets = checkpoint.skip(quartets)
+        outputs = analyze_quartets(
+            quartets,
+            share_permutations,
+            jobs,
+            pipeline=pipeline,
+            method=method,
+            critical_pvalues=critical_pvalues,
+            excluded_models=tuple(excluded_models),
+            null=null,
+            debug=debug,
+            with_results=store is not None or db is not None,
+        )
+        try:
+            n = write_outputs(
+                outputs,
+                output_filename,
+                headers,
+                checkpoint,
+                store,
+                db,
+                run,
+                progress_every,
+            )
+        except AnalysisError as e:
+            raise click.ClickException("Analysis failed: {}".format(e))
+        except ValueError as e:
+            raise click.ClickException("{}: {}".format(input_filename, e))
+    if checkpoint is not None:
+        with click.open_file(output_filename, "w", atomic=True) as f:
+            checkpoint.write_output(f, headers)
+    if db is not None:
+        db.close()
+    if store is not None:
+        store.close()
+        log_info(
+            "MLE results ({} fits) written to <{}>".format(
+                store.n_rows, output_filename_mle
+            )
+        )
+
+    log_success(
+        "Processed {} quartets{}, results written to <{}>".format(
+            n,
+            " (and {} resumed)".format(n_resumed) if n_resumed else "",
+            output_filename,
+        )
+    )
+
+
+def get_sampler(input_format, sample, budget, coverage, focal, seed, checkpoint_path):
+    """Check sampling options, return `sample_quartets` for them (or None)."""
+    if not sample:
+        if budget is not None or focal:
+            raise click.UsageError("--budget and --focal require --sample")
+        return None
+    if input_format != "markers":
+        raise click.UsageError("--sample requires --markers")
+    if budget is None and sample == "uniform":
+        raise click.BadParameter(
+            "uniform sampling requires --budget", param_hint="--sample"
+        )
+    if sample == "focal" and not focal:
+        raise click.BadParameter(
+            "focal sampling requires --focal", param_hint="--sample"
+        )
+    if checkpoint_path and seed is None:
+        raise click.BadParameter(
+            "sampling with --checkpoint requires --seed", param_hint="--seed"
+        )
+    return partial(
+        sample_quartets,
+        sample=sample,
+        budget=budget,
+        coverage=coverage,
+        focal=focal.split(",") if focal else [],
+        seed=get_seed_sequence(seed).entropy,
+    )
+
+
+def open_checkpoint(
+    checkpoint_path, params, input_filename, resume, every, resumable=True
+):
+    """Open `BatchCheckpoint` of the run (None without `checkpoint_path`)."""
+    if resume and not checkpoint_path:
+        raise click.BadParameter(
+            "option --resume requires --checkpoint", param_hint="--resume"
+        )
+    if not checkpoint_path:
+        return None
+    if resume and not resumable:
+        raise click.UsageError("runs with --output-mle or --db can not be resumed")
+    if input_filename == "-":
+        raise click.UsageError("--checkpoint needs an input file")
+    # Note: the input is identified by its contents, not by its name
+    try:
+        return BatchCheckpoint(
+            checkpoint_path,
+            dict(params, command="batch", input=None),
+            get_fingerprint(input_filename),
+            resume=resume,
+            every=every,
+        )
+    except ValueError as e:
+        raise click.ClickException("{}: {}".format(checkpoint_path, e))
+
+
+def write_outputs(
+    outputs,
+    output_filename,
+    headers,
+    checkpoint=None,
+    store=None,
+    db=None,
+    run=None,
+    progress_every=0,
+):
+    """Write `(id, result)` of `analyze_quartets` to all outputs, return their number.
+
+    With a `checkpoint`, rows are committed to it (the output file is written
+    from its chunks once all of them are committed), otherwise they are
+    written to `output_filename` directly.
+    """
+    # Note: rows of mle-nr are fits, not decisions of a selection procedure
+    decisions = "Procedure" in headers
+    n = 0
+    with contextlib.ExitStack() as stack:
+        if checkpoint is None:
+            f = stack.enter_context(click.open_file(output_filename, "w", atomic=True))
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(headers)
+        try:
+            for id_, output in outputs:
+                if store is not None or db is not None:
+                    rows, results = output
+                    if store is not None:
+                        store.append(id_, results)
+                    if db is not None:
+                        db.add_fits(run, id_, results)
+                        if decisions:
+                            db.add_decisions(run, headers, rows)
+                else:
+                    rows = output
+                if checkpoint is None:
+                    writer.writerows(rows)
+                else:
+                    checkpoint.append(id_, rows)
+                n += 1
+                if progress_every and n % progress_every == 0:
+                    log_info("Processed {} quartets...".format(n))
+        except BaseException:
+            if store is not None:
+                store.abort()
+            raise
+        finally:
+            # Note: rows of finished quartets are complete, keep them
+            if checkpoint is not None:
+                checkpoint.commit()
+    return n
+
+
+def open_input(input_filename):
+    if input_filename.endswith(".gz"):
+        return gzip.open(input_filename, "rt")
+    return click.open_file(input_filename, "r")
+
+
+def sample_quartets(matrix, sample, budget, coverage, focal, seed):
+    """Lazily sample quartets of species (indices) of the marker `matrix`."""
+    n = len(matrix)
+    budget = n_quartets(n) if budget is None else budget
+    rng = np.random.default_rng(get_seed_sequence(seed))
+    log_info("Sampling: {}, budget: {}, seed: {}".format(sample, budget, seed))
+    if sample == "uniform":
+        return sample_uniform(n, budget, rng)
+    if sample == "balanced":
+        return sample_balanced(n, coverage, budget, rng)
+    unknown = [name for name in focal if name not in matrix.names]
+    if unknown:
+        raise ValueError("unknown focal species: {}".format(", ".join(unknown)))
+    return sample_focal(n, [matrix.names.index(name) for name in focal], budget, rng)
+
+
+def open_outputs(output_filename_mle, db_filename, params):
+    """Open the MLE store and the database of a batch run (if requested)."""
+    store = db = run = None
+    if output_filename_mle:
+        try:
+            store = ResultStoreWriter(output_filename_mle)
+        except ValueError as e:
+            raise click.ClickException("{}: {}".format(output_filename_mle, e))
+    if db_filename:
+        db = ResultsDB(db_filename)
+        run = db.add_run("batch", params)
+        log_info("Database: <{}>, run {}".format(db_filename, run))
+    return store, db, run
+
+
+def iter_input(f_input, input_format, r, sampler=None):
+    if input_format == "markers":
+        matrix = read_markers(f_input)
+        log_info("Markers: {} species, {} loci".format(len(matrix), matrix.n_loci))
+        if sampler is not None:
+            return iter_quartets(matrix, r, quartets=sampler(matrix))
+        return iter_quartets(matrix, r)
+    return read_quartets(f_input, input_format, r_default=r)
+
+
+def enqueue(queue_path, params, input_filename, input_format, r, shard_size, sampler):
+    with open_input(input_filename) as f_input:
+        try:
+            quartets = iter_input(f_input, input_format, r, sampler)
+            queue = JobQueue.create(queue_path, params, quartets, shard_size)
+        except ValueError as e:
+            raise click.ClickException("{}: {}".format(input_filename, e))
+    log_success(
+        "Queued {} quartets in {} shards to <{}>".format(
+            len(queue), queue.status()["pending"], queue_path
+        )
+    )
+    queue.close()
@@ -1,12 +1,11 @@
-import csv
-
 import click
-from numpy.random import poisson
-from tabulate import tabulate
 
-from ..optimizer import Optimizer
+from ..optimizer import FitCache, fit_replicates, get_warm_starts
+from ..options import echo_summary, open_checkpoint, open_output
+from ..parallel import get_jobs, get_seed_sequence, replicate_rng
 from ..parsers import parse_input, parse_models, parse_permutation, presets_db
-from ..printers import log_debug, log_info, log_success
+from ..printers import log_debug, log_info
+from ..summary import RunningSummary
 from ..utils import autotimeit, pformatf
 
 
@@ -85,6 +84,47 @@ from ..utils import autotimeit, pformatf
     + click.style("five", bold=True)
     + " initial theta components",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=0),
+    metavar="<int>",
+    default=1,
+    show_default=True,
+    help="Number of parallel jobs (0 means all CPUs)",
+)
+@click.option(
+    "--seed",
+    type=int,
+    metavar="<int>",
+    help="Seed for bootstrap random number generator",
+)
+@click.option(
+    "--warm-start/--no-warm-start",
+    default=True,
+    show_default=True,
+    help="Start replicate fits from the fit on the input y (n0 rescaled to the replicate total); results may differ slightly from cold starts",
+)
+@click.option(
+    "--checkpoint",
+    "checkpoint_filename",
+    type=click.Path(dir_okay=False, writable=True),
+    metavar="<path>",
+    help="Append completed replicates to this checkpoint file",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue the interrupted run recorded in --checkpoint",
+)
+@click.option(
+    "--checkpoint-every",
+    type=click.IntRange(min=1),
+    metavar="<int>",
+    default=100,
+    show_default=True,
+    help="Number of replicates per checkpoint and output chunk",
+)
 @click.option("--debug", is_flag=True, help="Debug")
 @autotimeit
 def bootstrap(
@@ -97,6 +137,12 @@ def bootstrap(
     output_filename_bootstrap,
     method,
     theta0,
+    jobs,
+    seed,
+    warm_start,
+    checkpoint_filename,
+    resume,
+    checkpoint_every,
     debug,
 ):
     """Perform MLE bootstrap."""
@@ -104,6 +150,11 @@ def bootstrap(
     if len(models) != 1:
         raise click.BadParameter("specify exactly one model", param_hint="-m/--model")
 
+    if resume and not checkpoint_filename:
+        raise click.BadParameter(
+            "option --resume requires --checkpoint", param_hint="--resume"
+        )
+
     y = parse_input(preset, y, verbose=True)
     model = models[0]
     del preset, models
@@ -118,37 +169,102 @@ def bootstrap(
         if debug:
             log_debug("Using default theta0: {}".format(theta0))
 
-    log_info("Bootstraping {} times...".format(bootstrap_times))
-    data = []
-    for _ in range(bootstrap_times):
-        y_poissoned = tuple(poisson(y))
-        optimizer_boot = Optimizer(y_poissoned, r, theta0, method, debug=debug)
-        result_boot = optimizer_boot.one(model, permutation)
-        LL = result_boot.LL
-        n0, T1, T3, g1, g3 = result_boot.theta
-        data.append(
-            (" ".join(format(x, " >2") for x in y_poissoned), LL, n0, T1, T3, g1, g3)
+    if checkpoint_filename:
+        params = {
+            "command": "bootstrap",
+            "y": list(map(int, y)),
+            "r": r,
+            "model": model.name,
+            "permutation": permutation,
+            "method": method,
+            "theta0": theta0,
+            "warm_start": warm_start,
+        }
+        checkpoint = open_checkpoint(
+            checkpoint_filename, params, seed, resume, checkpoint_every
         )
+        del params
+        seed = checkpoint.seed
+        completed = checkpoint.completed()
+    else:
+        checkpoint = None
+        completed = {}  # {i: [LL, n0, T1, T3, g1, g3]}
+
+    seed_sequence = get_seed_sequence(seed)
+    jobs = get_jobs(jobs)
+    log_info("Seed: {}".format(seed_sequence.entropy))
+
+    log_info("Bootstraping {} times using {} jobs...".format(bootstrap_times, jobs))
+    if warm_start and len(completed) < bootstrap_times:
+        starts = get_warm_starts(y, [(model, permutation)], r, theta0, method)
+    else:
+        starts = None
+    cache = FitCache()
     headers = ["y", "LL", "n0", "T1", "T3", "g1", "g3"]
-    if output_filename_bootstrap:
+    summary = RunningSummary(headers[1:])
+    f, writer = open_output(output_filename_bootstrap, headers)
+    try:
+        for start in range(0, bootstrap_times, checkpoint_every):
+            indices = range(start, min(start + checkpoint_every, bootstrap_times))
+            # Note: each replicate has its own random stream,
+            #       so results do not depend on `jobs`
+            ys_poissoned = [
+                tuple(int(x) for x in replicate_rng(seed_sequence, i).poisson(y))
+                for i in indices
+            ]
+            pending = [k for k, i in enumerate(indices) if i not in completed]
+            if pending:
+                LL, theta = fit_replicates(
+                    [ys_poissoned[k] for k in pending],
+                    [(model, permutation)],
+                    r,
+                    theta0,
+                    method,
+                    starts=starts,
+                    cache=cache,
+                    jobs=jobs,
+                    debug=debug,
+                )
+                values = [
+                    [LL_boot] + theta_boot
+                    for LL_boot, theta_boot in zip(
+                        LL[:, 0].tolist(), theta[:, 0].tolist()
+                    )
+                ]
+                completed.update(
+                    (indices[k], value) for k, value in zip(pending, values)
+                )
+                if checkpoint is not None:
+                    checkpoint.append([indices[k] for k in pending], values)
+                del LL, theta, values
+            for i, y_poissoned in zip(indices, ys_poissoned):
+                row = completed.pop(i)
+                summary.add(row)
+                if writer is not None:
+                    writer.writerow(
+                        [" ".join(map(str, y_poissoned))] + list(map(str, row))
+                    )
+            if f is not None:
+                f.flush()
+            log_info(
+                "{}/{} replicates: mean LL = {:.3f}, median LL = {:.3f}".format(
+                    len(summary),
+                    bootstrap_times,
+                    summary.mean("LL"),
+                    summary.quantile("LL", 0.5),
+                )
+            )
+            del indices, ys_poissoned, pending
+    finally:
+        if f is not None:
+            f.close()
+    if cache.hits:
         log_info(
-            "Writing bootstrap results to <{}>...".format(output_filename_bootstrap)
+            "Reused fits for {} of {} replicates with duplicate y".format(
+                cache.hits, cache.hits + cache.misses
+            )
         )
-        with click.open_file(output_filename_bootstrap, "w", atomic=True) as f:
-            writer = csv.writer(f, lineterminator="\n")
-            writer.writerow(headers)
-            for row in data:
-                row = list(row)
-                row[0] = " ".join(row[0].split())
-                writer.writerow(map(str, row))
-    table = tabulate(
-        data,
-        headers=[click.style(s, bold=True) for s in headers],
-        numalign="center",
-        stralign="center",
-        floatfmt=".3f",
-        tablefmt="simple",
-    )
-    log_success("Bootstrap results:")
-    click.echo(table)
-    del data, headers, table
+    del completed, cache, starts, checkpoint
+
+    echo_summary(summary)
+    del headers, summary
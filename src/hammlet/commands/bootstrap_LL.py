@@ -1,13 +1,19 @@
-import csv
-
 import click
 import numpy as np
-from tabulate import tabulate
 
 from ..models import constraint_bounds, constraint_value, models_nrds
-from ..optimizer import Optimizer
+from ..optimizer import (
+    FitCache,
+    fit_replicates,
+    get_candidates,
+    get_problems,
+    get_warm_starts,
+)
+from ..options import echo_summary, open_checkpoint, open_output
+from ..parallel import get_jobs, get_seed_sequence
 from ..parsers import parse_models
-from ..printers import log_debug, log_info, log_success
+from ..printers import log_debug, log_info
+from ..summary import RunningSummary
 from ..utils import autotimeit, get_a, pformatf
 
 
@@ -93,6 +99,54 @@ from ..utils import autotimeit, get_a, pformatf
     + click.style("five", bold=True)
     + " initial theta components",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=0),
+    metavar="<int>",
+    default=1,
+    show_default=True,
+    help="Number of parallel jobs (0 means all CPUs)",
+)
+@click.option(
+    "--seed",
+    type=int,
+    metavar="<int>",
+    help="Seed for bootstrap random number generator",
+)
+@click.option(
+    "--warm-start/--no-warm-start",
+    default=True,
+    show_default=True,
+    help="Start replicate fits from the fit on the expected a_ij (n0 rescaled to the replicate total); results may differ slightly from cold starts",
+)
+@click.option(
+    "--prune-perms",
+    "prune",
+    type=click.IntRange(min=1),
+    metavar="<int>",
+    help="Fully fit only this many best permutations of every model on each replicate, screen the others",
+)
+@click.option(
+    "--checkpoint",
+    "checkpoint_filename",
+    type=click.Path(dir_okay=False, writable=True),
+    metavar="<path>",
+    help="Append completed replicates to this checkpoint file",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue the interrupted run recorded in --checkpoint",
+)
+@click.option(
+    "--checkpoint-every",
+    type=click.IntRange(min=1),
+    metavar="<int>",
+    default=100,
+    show_default=True,
+    help="Number of replicates per checkpoint and output chunk",
+)
 @click.option("--debug", is_flag=True, help="Debug")
 @autotimeit
 def bootstrap_LL(
@@ -105,6 +159,13 @@ def bootstrap_LL(
     output_filename_bootstrap,
     method,
     theta0,
+    jobs,
+    seed,
+    warm_start,
+    prune,
+    checkpoint_filename,
+    resume,
+    checkpoint_every,
     debug,
 ):
     """Perform MLE bootstrap-LL."""
@@ -116,6 +177,11 @@ def bootstrap_LL(
     model_junior = models[0]
     del models
 
+    if resume and not checkpoint_filename:
+        raise click.BadParameter(
+            "option --resume requires --checkpoint", param_hint="--resume"
+        )
+
     bounds = model_junior.get_safe_bounds()
     theta = tuple(constraint_value(param, bound) for param, bound in zip(theta, bounds))
     del bounds
@@ -140,7 +206,11 @@ def bootstrap_LL(
                 " ".join(model.name for model in excluded_models)
             )
         )
-    models_senior = list(set(models_nrds[level_senior]) - set(excluded_models))
+    # Note: keep the order of models stable, so that checkpointed LL columns
+    #       and ties between equally good models are the same in every run
+    models_senior = [
+        model for model in models_nrds[level_senior] if model not in excluded_models
+    ]
     del excluded_models
 
     log_info(
@@ -150,57 +220,129 @@ def bootstrap_LL(
     if not models_senior:
         raise ValueError("No models left on senior level")
 
+    if checkpoint_filename:
+        params = {
+            "command": "bootstrap-ll",
+            "level": level_senior,
+            "senior": sorted(model.name for model in models_senior),
+            "junior": model_junior.name,
+            "theta": theta,
+            "r": r,
+            "method": method,
+            "theta0": theta0,
+            "warm_start": warm_start,
+            "prune": prune,
+        }
+        checkpoint = open_checkpoint(
+            checkpoint_filename, params, seed, resume, checkpoint_every
+        )
+        del params
+        seed = checkpoint.seed
+        completed = checkpoint.completed()
+    else:
+        checkpoint = None
+        completed = {}  # {i: [LL of every problem]}
+
+    seed_sequence = get_seed_sequence(seed)
+    jobs = get_jobs(jobs)
+    log_info("Seed: {}".format(seed_sequence.entropy))
+
     log_info(
-        "Bootstraping {}/{} (senior/junior) {} times...".format(
-            level_senior, model_junior.name, bootstrap_times
+        "Bootstraping {}/{} (senior/junior) {} times using {} jobs...".format(
+            level_senior, model_junior.name, bootstrap_times, jobs
         )
     )
-    data = []
-    for _ in range(bootstrap_times):
-        y_poissoned = tuple(np.random.poisson(a))
-        optimizer_boot = Optimizer(y_poissoned, r, theta0, method, debug=debug)
-
-        results_boot_senior = optimizer_boot.many(models_senior, "model")
-        results_boot_junior = optimizer_boot.many_perms(model_junior, "model")
-
-        best_result_senior = max(results_boot_senior, key=lambda it: it.LL)
-        best_result_junior = max(results_boot_junior, key=lambda it: it.LL)
-
-        LLx = best_result_senior.LL
-        LLy = best_result_junior.LL
-        LL_diff = 2 * (LLx - LLy)
-        data.append(
-            (
-                " ".join(format(x, " >2") for x in y_poissoned),
-                best_result_senior.model.name,
-                "".join(map(str, best_result_senior.permutation)),
-                LLx,
-                model_junior.name,
-                "".join(map(str, best_result_junior.permutation)),
-                LLy,
-                LL_diff,
+    # Note: senior and junior problems of a replicate are fitted in a single job
+    problems_senior = get_problems(models_senior, "model")
+    problems_junior = get_problems([model_junior], "model")
+    problems = problems_senior + problems_junior
+    n_senior = len(problems_senior)
+    starts = candidates = None
+    if (warm_start or prune) and len(completed) < bootstrap_times:
+        starts = get_warm_starts(a, problems, r, theta0, method)
+        if prune:
+            candidates = get_candidates(a, problems, starts, r, prune)
+            log_info(
+                "Fitting {} of {} permutations on each replicate, screening the rest".format(
+                    candidates.sum(), len(problems)
+                )
             )
-        )
+    cache = FitCache()
+    problem_models = [model.name for model, _ in problems]
+    problem_perms = ["".join(map(str, perm)) for _, perm in problems]
+
     headers = ["y", "Mx", "px", "LLx", "My", "py", "LLy", "LLx-LLy"]
-    if output_filename_bootstrap:
+    summary = RunningSummary(["LLx", "LLy", "LLx-LLy"])
+    f, writer = open_output(output_filename_bootstrap, headers)
+    # Note: replicates are drawn chunk by chunk from a single stream in the main
+    #       process, so results do not depend on `jobs` (nor on resuming)
+    rng = np.random.default_rng(seed_sequence)
+    try:
+        for start in range(0, bootstrap_times, checkpoint_every):
+            indices = range(start, min(start + checkpoint_every, bootstrap_times))
+            ys_poissoned = rng.poisson(a, size=(len(indices), 10))
+            pending = [k for k, i in enumerate(indices) if i not in completed]
+            if pending:
+                LL, _ = fit_replicates(
+                    ys_poissoned[pending],
+                    problems,
+                    r,
+                    theta0,
+                    method,
+                    starts=starts,
+                    candidates=candidates,
+                    cache=cache,
+                    jobs=jobs,
+                    debug=debug,
+                )
+                values = LL.tolist()
+                completed.update(
+                    (indices[k], value) for k, value in zip(pending, values)
+                )
+                if checkpoint is not None:
+                    checkpoint.append([indices[k] for k in pending], values)
+                del LL, values
+            for i, y_poissoned in zip(indices, ys_poissoned.tolist()):
+                LL = completed.pop(i)
+                best_senior = max(range(n_senior), key=LL.__getitem__)
+                best_junior = max(range(n_senior, len(problems)), key=LL.__getitem__)
+                LLx = LL[best_senior]
+                LLy = LL[best_junior]
+                LL_diff = 2 * (LLx - LLy)
+                summary.add([LLx, LLy, LL_diff])
+                if writer is not None:
+                    row = [
+                        " ".join(map(str, y_poissoned)),
+                        problem_models[best_senior],
+                        problem_perms[best_senior],
+                        LLx,
+                        problem_models[best_junior],
+                        problem_perms[best_junior],
+                        LLy,
+                        LL_diff,
+                    ]
+                    writer.writerow(map(str, row))
+            if f is not None:
+                f.flush()
+            log_info(
+                "{}/{} replicates: mean LLx-LLy = {:.3f}, q0.95 LLx-LLy = {:.3f}".format(
+                    len(summary),
+                    bootstrap_times,
+                    summary.mean("LLx-LLy"),
+                    summary.quantile("LLx-LLy", 0.95),
+                )
+            )
+            del indices, ys_poissoned, pending
+    finally:
+        if f is not None:
+            f.close()
+    if cache.hits:
         log_info(
-            "Writing bootstrap results to <{}>...".format(output_filename_bootstrap)
+            "Reused fits for {} of {} replicates with duplicate y".format(
+                cache.hits, cache.hits + cache.misses
+            )
         )
-        with click.open_file(output_filename_bootstrap, "w", atomic=True) as f:
-            writer = csv.writer(f, lineterminator="\n")
-            writer.writerow(headers)
-            for row in data:
-                row = list(row)
-                row[0] = " ".join(row[0].split())
-                writer.writerow(map(str, row))
-    table = tabulate(
-        data,
-        headers=[click.style(s, bold=True) for s in headers],
-        numalign="center",
-        stralign="center",
-        floatfmt=".3f",
-        tablefmt="simple",
-    )
-    log_success("Bootstrap results:")
-    click.echo(table)
-    del data, headers, table
+    del completed, cache, starts, candidates, checkpoint
+
+    echo_summary(summary)
+    del headers, summary
@@ -0,0 +1,138 @@
+import time
+
+import click
+from tabulate import tabulate
+
+from ..jobqueue import JobQueue, merge_outputs
+from ..printers import log_info, log_success, log_warn
+from ..utils import autotimeit
+
+
+def show_shards(queue):
+    rows = [
+        (
+            shard,
+            size,
+            status,
+            worker or "",
+            "{:.0f}".format(time.time() - heartbeat) if status == "claimed" else "",
+            attempts,
+            error or "",
+        )
+        for shard, size, status, worker, heartbeat, attempts, error in queue.shards()
+    ]
+    headers = ["Shard", "Size", "Status", "Worker", "Idle, s", "Attempts", "Error"]
+    click.echo(
+        tabulate(
+            rows,
+            headers=[click.style(s, bold=True) for s in headers],
+            tablefmt="simple",
+        )
+    )
+
+
+@click.command()
+@click.argument(
+    "queue_path", type=click.Path(exists=True, file_okay=False), metavar="<path>"
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_filename",
+    type=click.Path(writable=True, allow_dash=True),
+    metavar="<path|->",
+    help="Output CSV file with merged results  [default: -o of batch --queue]",
+)
+@click.option(
+    "--stale-after",
+    type=float,
+    metavar="<float>",
+    default=300,
+    show_default=True,
+    help="Requeue claims without a heartbeat for this many seconds",
+)
+@click.option(
+    "--max-attempts",
+    type=int,
+    metavar="<int>",
+    default=3,
+    show_default=True,
+    help="Mark shards failed after this many stale claims",
+)
+@click.option("--retry-failed", is_flag=True, help="Requeue failed shards")
+@click.option("--show", is_flag=True, help="Show all shards")
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Keep requeueing stale claims until all shards are done, then merge",
+)
+@click.option(
+    "--poll",
+    type=float,
+    metavar="<float>",
+    default=30,
+    show_default=True,
+    help="Seconds between checks with --watch",
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def coordinator(
+    queue_path,
+    output_filename,
+    stale_after,
+    max_attempts,
+    retry_failed,
+    show,
+    watch,
+    poll,
+    debug,
+):
+    """Requeue stale claims of a job queue and merge results of its shards.
+
+    \b
+    A run split across nodes:
+      batch -i quartets.csv -o results.csv --queue q/   # once
+      worker q/                                         # on every node
+      coordinator q/ --watch                            # once
+    """
+
+    try:
+        queue = JobQueue(queue_path)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="queue_path")
+    output_filename = output_filename or queue.params["output"]
+
+    if retry_failed:
+        log_info("Requeued {} failed shards".format(queue.retry_failed()))
+    while True:
+        requeued = queue.requeue_stale(stale_after, max_attempts)
+        if requeued:
+            log_warn("Requeued stale shards: {}".format(", ".join(map(str, requeued))))
+        status = queue.status()
+        log_info(
+            "Shards: {}".format(
+                ", ".join("{} {}".format(v, k) for k, v in status.items())
+            )
+        )
+        if status["done"] == sum(status.values()):
+            break
+        if not watch:
+            break
+        if not status["pending"] and not status["claimed"]:
+            # Note: only failed shards are left
+            break
+        time.sleep(poll)
+    if show:
+        show_shards(queue)
+
+    if status["done"] == sum(status.values()):
+        with click.open_file(output_filename, "w", atomic=True) as f:
+            n = merge_outputs(queue, f)
+        log_success(
+            "Merged {} rows of {} shards to <{}>".format(
+                n, status["done"], output_filename
+            )
+        )
+    elif status["failed"]:
+        log_warn("Some shards failed, see --show and --retry-failed")
+    queue.close()
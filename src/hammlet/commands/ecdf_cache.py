@@ -0,0 +1,129 @@
+import time
+
+import click
+from tabulate import tabulate
+
+from ..database import ResultsDB
+from ..ecdf import EcdfCache, critical_index
+from ..printers import log_info, log_success, log_warn
+from ..utils import autotimeit, pformatf
+
+
+@click.command()
+@click.option(
+    "--ecdf-cache",
+    "ecdf_cache_dir",
+    type=click.Path(file_okay=False, writable=True),
+    metavar="<path>",
+    envvar="HAMMLET_ECDF_CACHE",
+    required=True,
+    help="Directory with persistent cache of bootstrap samples",
+)
+@click.option(
+    "--prune",
+    "is_prune",
+    is_flag=True,
+    help="Evict least recently used entries exceeding --max-size/--max-age",
+)
+@click.option(
+    "--max-size",
+    type=float,
+    metavar="<MiB>",
+    default=256,
+    show_default=True,
+    help="Maximum cache size in MiB",
+)
+@click.option(
+    "--max-age",
+    type=float,
+    metavar="<days>",
+    help="Evict entries not used for this many days",
+)
+@click.option("--clear", "is_clear", is_flag=True, help="Remove all entries")
+@click.option(
+    "--export-db",
+    "db_filename",
+    type=click.Path(dir_okay=False, writable=True),
+    metavar="<path>",
+    help="Add all entries to SQLite database (see query)",
+)
+@click.option(
+    "-p",
+    "--pvalue",
+    "pvalues",
+    type=float,
+    metavar="<float>",
+    multiple=True,
+    default=(0.05, 0.01),
+    show_default=True,
+    help="p-values to show critical values for",
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def ecdf_cache(
+    ecdf_cache_dir, is_prune, max_size, max_age, is_clear, db_filename, pvalues, debug
+):
+    """Inspect or prune the ECDF cache."""
+
+    cache = EcdfCache(ecdf_cache_dir, max_size=int(max_size * 1024**2))
+    log_info("ECDF cache: <{}>".format(ecdf_cache_dir))
+
+    if is_clear:
+        evicted = cache.clear()
+        log_success("Removed {} entries".format(len(evicted)))
+        return
+
+    if is_prune:
+        evicted = cache.prune(
+            max_age=max_age * 24 * 3600 if max_age is not None else None
+        )
+        log_success("Evicted {} entries".format(len(evicted)))
+
+    entries = cache.entries()
+    if not entries:
+        log_warn("Cache is empty")
+        return
+
+    if db_filename:
+        db = ResultsDB(db_filename)
+        for digest, entry in entries:
+            db.add_ecdf(digest, entry["key"], cache.get_sample(digest))
+        db.close()
+        log_success("Added {} entries to <{}>".format(len(entries), db_filename))
+
+    data = []
+    for digest, entry in entries:
+        key = entry["key"]
+        sample = cache.get_sample(digest)
+        n = len(sample)
+        data.append(
+            [
+                digest[:10],
+                key["junior"],
+                " ".join(key["senior"]),
+                " ".join(map(pformatf, key["theta"])),
+                " ".join(map(pformatf, key["r"])),
+                key["method"],
+                n,
+            ]
+            + [sample[critical_index(n, p)] for p in pvalues]
+            + [time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["accessed"]))]
+        )
+    headers = (
+        ["Key", "Junior", "Senior", "theta", "r", "Method", "Size"]
+        + ["p={}".format(p) for p in pvalues]
+        + ["Accessed"]
+    )
+    table = tabulate(
+        data,
+        headers=[click.style(s, bold=True) for s in headers],
+        numalign="center",
+        stralign="center",
+        floatfmt=".3f",
+        tablefmt="simple",
+    )
+    total = sum(entry["bytes"] for _, entry in entries)
+    log_success(
+        "Cache entries ({}, {:.1f} MiB):".format(len(entries), total / 1024.0**2)
+    )
+    click.echo(table)
@@ -0,0 +1,218 @@
+import click
+
+from ..ecdf import EcdfTable
+from ..parallel import get_jobs, get_seed_sequence
+from ..parsers import parse_floats, parse_models
+from ..printers import log_debug, log_info, log_success
+from ..utils import autotimeit, pformatf
+
+
+@click.command()
+@click.option(
+    "-o",
+    "--output",
+    "output_filename_table",
+    type=click.Path(writable=True),
+    metavar="<path>",
+    required=True,
+    help="Output file with ECDF table (.npz)",
+)
+@click.option(
+    "-r",
+    "rs",
+    nargs=4,
+    type=float,
+    metavar="<float...>",
+    multiple=True,
+    help="Space-separated list of "
+    + click.style("four", bold=True)
+    + " r values (can be specified multiple times)  [default: 1 1 1 1]",
+)
+@click.option(
+    "-x",
+    "--exclude",
+    "excluded_models",
+    multiple=True,
+    metavar="<name...|all>",
+    required=False,
+    callback=parse_models,
+    help="Comma-separated list of models to exclude (use the table with the same -x)",
+)
+@click.option(
+    "--n0",
+    "axis_n0",
+    metavar="<float,...>",
+    callback=parse_floats,
+    default="25,50,100,200,400",
+    show_default=True,
+    help="Grid of n0 values",
+)
+@click.option(
+    "--T1",
+    "axis_T1",
+    metavar="<float,...>",
+    callback=parse_floats,
+    default="0.1,0.5,1,2",
+    show_default=True,
+    help="Grid of T1 values",
+)
+@click.option(
+    "--T3",
+    "axis_T3",
+    metavar="<float,...>",
+    callback=parse_floats,
+    default="0.1,0.5,1,2",
+    show_default=True,
+    help="Grid of T3 values",
+)
+@click.option(
+    "--g1",
+    "axis_g1",
+    metavar="<float,...>",
+    callback=parse_floats,
+    default="0,0.25,0.5,0.75,1",
+    show_default=True,
+    help="Grid of gamma1 values",
+)
+@click.option(
+    "--g3",
+    "axis_g3",
+    metavar="<float,...>",
+    callback=parse_floats,
+    default="0,0.25,0.5,0.75,1",
+    show_default=True,
+    help="Grid of gamma3 values",
+)
+@click.option(
+    "--pair",
+    "pairs",
+    multiple=True,
+    metavar="<Nx-Ny>",
+    type=click.Choice(["N4-N3", "N3-N2", "N2-N1", "N1-N0", "N4-N2", "N4-N1", "N4-N0"]),
+    help="Level pairs to tabulate  [default: all]",
+)
+@click.option(
+    "-p",
+    "--pvalue",
+    "pvalues",
+    metavar="<float,...>",
+    callback=parse_floats,
+    default="0.05,0.01",
+    show_default=True,
+    help="p-values to tabulate critical values for",
+)
+@click.option(
+    "-n",
+    "--times",
+    "bootstrap_times",
+    type=int,
+    metavar="<int>",
+    default=1000,
+    show_default=True,
+    help="Number of bootstrap samples per grid point",
+)
+@click.option(
+    "--method",
+    type=click.Choice(["SLSQP", "L-BFGS-B", "TNC"]),
+    default="SLSQP",
+    show_default=True,
+    help="Optimization method",
+)
+@click.option(
+    "--theta0",
+    nargs=5,
+    type=float,
+    metavar="<n0 T1 T3 g1 g3>",
+    help="Space-separated list of "
+    + click.style("five", bold=True)
+    + " initial theta components",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=0),
+    metavar="<int>",
+    default=1,
+    show_default=True,
+    help="Number of parallel jobs (0 means all CPUs)",
+)
+@click.option(
+    "--seed",
+    type=int,
+    metavar="<int>",
+    help="Seed for bootstrap random number generator",
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def ecdf_table(
+    output_filename_table,
+    rs,
+    excluded_models,
+    axis_n0,
+    axis_T1,
+    axis_T3,
+    axis_g1,
+    axis_g3,
+    pairs,
+    pvalues,
+    bootstrap_times,
+    method,
+    theta0,
+    jobs,
+    seed,
+    debug,
+):
+    """Precompute table of ECDF critical values."""
+
+    if not rs:
+        rs = [(1, 1, 1, 1)]
+    axes = [sorted(axis_n0), sorted(axis_T1), sorted(axis_T3)]
+    axes += [sorted(axis_g1), sorted(axis_g3)]
+    for name, axis in zip(["n0", "T1", "T3", "g1", "g3"], axes):
+        log_info("{} grid: {}".format(name, " ".join(map(pformatf, axis))))
+    for r in rs:
+        log_info("r: ({})".format(", ".join(map(pformatf, r))))
+    log_info("p-values: {}".format(" ".join(map(str, pvalues))))
+    if excluded_models:
+        log_info(
+            "Excluded models: {}".format(
+                " ".join(model.name for model in excluded_models)
+            )
+        )
+
+    if not theta0:
+        theta0 = (10, 0.5, 0.5, 0.5, 0.5)
+        if debug:
+            log_debug("Using default theta0: {}".format(theta0))
+
+    seed_sequence = get_seed_sequence(seed)
+    jobs = get_jobs(jobs)
+    log_info("Seed: {}".format(seed_sequence.entropy))
+
+    table = EcdfTable(
+        axes,
+        rs,
+        pvalues,
+        bootstrap_times,
+        method,
+        excluded=[model.name for model in excluded_models],
+    )
+    log_info(
+        "Bootstrapping {} times per grid point using {} jobs...".format(
+            bootstrap_times, jobs
+        )
+    )
+    table.compute(
+        pairs=pairs or None, theta0=theta0, seed_sequence=seed_sequence, jobs=jobs
+    )
+    for (pair, junior), values in sorted(table.values.items()):
+        log_debug(
+            "{} ({}): {} grid points, critical LL {:.3f}..{:.3f}".format(
+                pair, junior, values[..., 0].size, values.min(), values.max()
+            )
+        )
+
+    log_info("Writing ECDF table to <{}>...".format(output_filename_table))
+    with click.open_file(output_filename_table, "wb", atomic=True) as f:
+        table.save(f)
+    log_success("ECDF table with {} entries written".format(len(table.values)))
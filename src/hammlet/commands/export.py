@@ -0,0 +1,90 @@
+import csv
+
+import click
+import numpy as np
+
+from ..printers import log_info, log_success
+from ..resultset import (
+    level_names,
+    model_levels,
+    model_mnemonic_names,
+    model_names,
+    perm_names,
+    theta_fields,
+)
+from ..resultstore import ResultStore
+from ..utils import autotimeit
+
+
+@click.command()
+@click.argument(
+    "store_path", type=click.Path(exists=True, file_okay=False), metavar="<path>"
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_filename",
+    type=click.Path(writable=True, allow_dash=True),
+    metavar="<path|->",
+    required=True,
+    help="Output CSV file with MLE results",
+)
+@click.option(
+    "--best",
+    is_flag=True,
+    help="Export only the best fit of every level of every quartet",
+)
+@click.option(
+    "--chunk-size",
+    type=int,
+    metavar="<int>",
+    default=100000,
+    show_default=True,
+    help="Number of rows converted at once",
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def export(store_path, output_filename, best, chunk_size, debug):
+    """Export MLE results stored by batch to CSV."""
+
+    store = ResultStore(store_path)
+    log_info(
+        "Store <{}>: {} quartets, {} fits".format(
+            store_path, len(store.ids), len(store)
+        )
+    )
+    ids = np.array(store.ids, dtype=object)
+    columns = ["quartet", "model", "perm", "LL", "n0", "T1", "T3", "g1", "g3"]
+
+    with click.open_file(output_filename, "w", atomic=True) as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["id", "Level", "Model", "Mnemo", "Perm", "LL"] + theta_fields)
+        n = 0
+        last_key = None
+        for start in range(0, len(store), chunk_size):
+            chunk = {
+                name: np.asarray(store[name][start : start + chunk_size])
+                for name in columns
+            }
+            level = model_levels[chunk["model"]]
+            if best:
+                # Note: rows are sorted by LL within every level of a quartet
+                key = chunk["quartet"] * len(level_names) + level
+                first = np.ones(len(key), dtype=bool)
+                first[1:] = key[1:] != key[:-1]
+                first[0] = key[0] != last_key
+                last_key = key[-1]
+                chunk = {name: values[first] for name, values in chunk.items()}
+                level = level[first]
+            rows = zip(
+                ids[chunk["quartet"]],
+                level_names[level],
+                model_names[chunk["model"]],
+                model_mnemonic_names[chunk["model"]],
+                perm_names[chunk["perm"]],
+                *[chunk[name].tolist() for name in columns[3:]],
+            )
+            writer.writerows(rows)
+            n += len(chunk["LL"])
+
+    log_success("Exported {} rows to <{}>".format(n, output_filename))
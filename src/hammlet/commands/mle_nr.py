@@ -12,6 +12,7 @@ from ..parsers import (
     presets_db,
 )
 from ..printers import log_debug, log_info, log_success
+from ..resultset import ResultSet
 from ..utils import autotimeit, pformatf, results_to_data
 
 
@@ -169,7 +170,8 @@ def mle_nr(
     optimizer = Optimizer(y, r, theta0, method, debug=debug)
 
     log_info("Optimizing...")
-    results = optimizer.many(models, perms, sort=True)
+    results = ResultSet.from_results(optimizer.many(models, perms, sort=False))
+    results = results.sorted()
 
     headers, data = results_to_data(results)
     if output_filename_mle:
@@ -0,0 +1,85 @@
+import csv
+
+import click
+
+from ..batch import y_fields
+from ..patterns import read_patterns_y
+from ..printers import log_info, log_success, log_warn
+from ..utils import autotimeit
+
+
+@click.command()
+@click.argument(
+    "input_filenames",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, allow_dash=True),
+    metavar="<path...>",
+)
+@click.option(
+    "--output-y",
+    "output_filename_y",
+    type=click.Path(writable=True),
+    metavar="<path>",
+    help="Output file with y values (single input file only), use as -y $(cat <path>)",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_filename",
+    type=click.Path(writable=True, allow_dash=True),
+    metavar="<path|->",
+    help="Output CSV file with y values of every input file (input for batch)",
+)
+@click.option(
+    "--chunk-size",
+    type=int,
+    metavar="<int>",
+    default=2**24,
+    show_default=True,
+    help="Number of bytes processed at once (bounds memory usage)",
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def patterns(input_filenames, output_filename_y, output_filename, chunk_size, debug):
+    """Count y values in per-locus marker pattern files.
+
+    Every line of a file has a +/- pattern of four species (plain or gzipped,
+    optionally with a header of species names).
+    """
+
+    if output_filename_y and len(input_filenames) > 1:
+        raise click.BadParameter(
+            "only one input file is allowed", param_hint="--output-y"
+        )
+
+    rows = []
+    for filename in input_filenames:
+        log_info("Reading patterns from <{}>...".format(filename))
+        try:
+            y, names, counts = read_patterns_y(filename, chunk_size)
+        except ValueError as e:
+            raise click.ClickException("{}: {}".format(filename, e))
+        if names:
+            log_info("Species: {}".format(", ".join(names[:4])))
+        log_info(
+            "Loci: {}, uninformative: {}".format(counts.sum(), counts.sum() - sum(y))
+        )
+        if debug:
+            log_info("Pattern counts: {}".format(" ".join(map(str, counts))))
+        if not sum(y):
+            log_warn("No informative loci in <{}>".format(filename))
+        log_success("y: {}".format(" ".join(map(str, y))))
+        rows.append([filename] + list(y))
+
+    if output_filename_y:
+        log_info("Writing y values to <{}>...".format(output_filename_y))
+        with click.open_file(output_filename_y, "w", atomic=True) as f:
+            f.write("{}\n".format(" ".join(map(str, rows[0][1:]))))
+
+    if output_filename:
+        log_info("Writing y values to <{}>...".format(output_filename))
+        with click.open_file(output_filename, "w", atomic=True) as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["id"] + y_fields)
+            writer.writerows(rows)
@@ -0,0 +1,129 @@
+import csv
+import sqlite3
+
+import click
+from tabulate import tabulate
+
+from ..database import ResultsDB, queries
+from ..printers import log_info, log_success, log_warn
+from ..utils import autotimeit
+
+
+@click.command()
+@click.argument(
+    "db_filename", type=click.Path(exists=True, dir_okay=False), metavar="<path>"
+)
+@click.argument("name", type=click.Choice(list(queries) + ["sql"]), metavar="<query>")
+@click.argument("sql", required=False, metavar="[<sql>]")
+@click.option("--run", type=int, metavar="<int>", help="Only rows of this run")
+@click.option("--quartet", metavar="<id>", help="Only rows of this quartet")
+@click.option("--level", metavar="<level>", help="Only rows with this level (N0..N4)")
+@click.option("--model", metavar="<name>", help="Only rows with this model")
+@click.option(
+    "--procedure",
+    type=click.Choice(["levels", "reverse"]),
+    help="Only decisions of this procedure",
+)
+@click.option(
+    "-p",
+    "--pvalue",
+    type=float,
+    metavar="<float>",
+    help="Only decisions for this p-value",
+)
+@click.option("--junior", metavar="<name>", help="Only ECDFs of this junior model")
+@click.option(
+    "--top",
+    type=int,
+    metavar="<int>",
+    help="Only this many best (by LL) fits of every quartet",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_filename",
+    type=click.Path(writable=True, allow_dash=True),
+    metavar="<path|->",
+    help="Output CSV file (instead of a table)",
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def query(
+    db_filename,
+    name,
+    sql,
+    run,
+    quartet,
+    level,
+    model,
+    procedure,
+    pvalue,
+    junior,
+    top,
+    output_filename,
+    debug,
+):
+    """Query the results database.
+
+    \b
+    Queries (<query>):
+      runs        runs added to the database by batch, stat, stat-levels and
+                  stat-reverse with --db
+      decisions   results of model selection, e.g. all quartets with N3 accepted:
+                  query <db> decisions --level N3 --procedure levels -p 0.05
+      fits        MLE fits, e.g. best model per quartet: query <db> fits --top 1,
+                  top-5 permutations of 2H1: query <db> fits --model 2H1 --top 5
+      ecdfs       bootstrap samples added by the stat commands with --ecdf --db
+                  or by ecdf-cache --export-db
+      sql         arbitrary read-only SQL given as <sql>
+    """
+
+    try:
+        db = ResultsDB(db_filename, readonly=True)
+    except sqlite3.Error as e:
+        raise click.ClickException("{}: {}".format(db_filename, e))
+    filters = dict(
+        run=run,
+        quartet=quartet,
+        level=level,
+        model=model,
+        procedure=procedure,
+        pvalue=pvalue,
+        junior=junior,
+    )
+    try:
+        if name == "sql":
+            if not sql:
+                raise click.BadParameter("missing SQL query", param_hint="sql")
+            headers, rows = db.execute(sql)
+        else:
+            if sql:
+                raise click.BadParameter(
+                    "SQL is only allowed with the sql query", param_hint="sql"
+                )
+            headers, rows = db.query(name, top=top, **filters)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    except sqlite3.Error as e:
+        raise click.ClickException("SQL error: {}".format(e))
+
+    if output_filename:
+        log_info("Writing {} rows to <{}>...".format(len(rows), output_filename))
+        with click.open_file(output_filename, "w", atomic=True) as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(headers)
+            writer.writerows(rows)
+    elif not rows:
+        log_warn("No rows")
+    else:
+        log_success("Query results ({} rows):".format(len(rows)))
+        click.echo(
+            tabulate(
+                rows,
+                headers=[click.style(s, bold=True) for s in headers],
+                numalign="center",
+                stralign="center",
+                floatfmt=".3f",
+                tablefmt="simple",
+            )
+        )
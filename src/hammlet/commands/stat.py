@@ -0,0 +1,216 @@
+import csv
+from collections import OrderedDict
+from functools import partial
+
+import click
+from tabulate import tabulate
+
+from ..models import models_nrds
+from ..optimizer import Optimizer
+from ..options import (
+    ecdf_options,
+    get_params,
+    get_tester,
+    save_db,
+    save_result,
+    save_samples,
+    selection_options,
+)
+from ..parsers import parse_ecdfs, parse_input
+from ..printers import log_debug, log_info, log_success
+from ..selection import (
+    LevelFits,
+    LevelTester,
+    get_forward_fields,
+    get_reverse_fields,
+    select_forward,
+    select_reverse,
+)
+from ..utils import autotimeit, grouped_results_to_data, pformatf
+
+
+@click.command()
+@selection_options
+@ecdf_options(
+    click.option(
+        "--ecdfs",
+        metavar="<N4-N3, N3-N2, N2-N1, N1-N0>",
+        callback=parse_ecdfs,
+        help="[ecdf] Comma-separated list of "
+        + click.style("four", bold=True)
+        + " precomputed critical values for N4-N3,...,N1-N0 (forward selection)",
+    ),
+    click.option(
+        "--ecdfs-reverse",
+        metavar="<N4-N0, N4-N1, N4-N2, N4-N3>",
+        callback=parse_ecdfs,
+        help="[ecdf] Comma-separated list of "
+        + click.style("four", bold=True)
+        + " precomputed critical values for N4-N0,...,N4-N3 (reverse selection)",
+    ),
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def stat(
+    preset,
+    y,
+    r,
+    excluded_models,
+    output_filename_mle,
+    output_filename_result,
+    db_filename,
+    critical_pvalues,
+    method,
+    theta0,
+    ecdfs_reverse,
+    debug,
+    **ecdf_params,
+):
+    """Perform both 'stepwise' and 'reverse' statistics calculation.
+
+    Every level is fitted once, and bootstrap samples of comparisons
+    common to both procedures (N4-N3) are computed once.
+    """
+
+    y = parse_input(preset, y, verbose=True)
+    quartet = preset or " ".join(map(str, y))
+    del preset
+    log_info("y: {}".format(" ".join(map(str, y))))
+    log_info("r: ({})".format(", ".join(map(pformatf, r))))
+
+    if not theta0:
+        theta0 = (round(0.6 * sum(y), 5), 0.5, 0.5, 0.5, 0.5)
+        if debug:
+            log_debug("Using default theta0: {}".format(theta0))
+    params = get_params(y, r, theta0, method, excluded_models, critical_pvalues)
+
+    ecdfs = ecdf_params["ecdfs"]
+    if (ecdfs is None) != (ecdfs_reverse is None):
+        raise click.BadParameter(
+            "options --ecdfs and --ecdfs-reverse must be used together",
+            param_hint="--ecdfs/--ecdfs-reverse",
+        )
+    # Note: bootstrapped null distributions are kept by key in the tester,
+    #       so sharing it between both procedures shares their samples
+    tester = tester_reverse = get_tester(
+        "stat",
+        y,
+        r,
+        theta0,
+        method,
+        excluded_models,
+        critical_pvalues,
+        debug=debug,
+        **ecdf_params,
+    )
+    if ecdfs is not None:
+        tester_reverse = LevelTester(r, theta0, method, ecdfs=ecdfs_reverse)
+
+    levels = ["N4", "N3", "N2", "N1", "N0"]
+    optimizer = Optimizer(y, r, theta0, method, debug=debug)
+
+    if excluded_models:
+        log_debug(
+            "Excluding models: {}".format(
+                " ".join(model.name for model in excluded_models)
+            )
+        )
+    models_by_level = {
+        level: list(set(models_nrds[level]) - set(excluded_models)) for level in levels
+    }
+    del excluded_models
+    if not models_by_level["N4"]:
+        raise click.BadParameter("no models left in N4", param_hint="-x/--exclude")
+    # Drop empty levels
+    levels = [level for level in levels if models_by_level[level]]
+    levels_reverse = [levels[0]] + levels[:0:-1]
+
+    log_info("Optimizing...")
+    # Note: levels are fitted only when the selection reaches them
+    fits = LevelFits(optimizer, models_by_level, debug=debug)
+
+    if output_filename_mle:
+        results_by_level = OrderedDict((level, fits.results(level)) for level in levels)
+        headers, data = grouped_results_to_data(results_by_level, group_header="Level")
+        log_info("Writing MLE results to <{}>...".format(output_filename_mle))
+        with click.open_file(output_filename_mle, "w", atomic=True) as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(headers)
+            for row in data:
+                writer.writerow(map(str, row))
+            del writer
+        del headers, data
+
+    results = []  # [(critical_pvalue, procedure, get fields)]
+    for critical_pvalue in critical_pvalues:
+        if len(critical_pvalues) > 1:
+            log_info("Critical p-value: {}".format(critical_pvalue))
+        try:
+            log_info("Forward selection...")
+            final_level, final_result = select_forward(
+                levels, fits, models_by_level, critical_pvalue, tester
+            )
+            log_success(
+                "Final result: level {}, model {}".format(
+                    final_level, final_result.model
+                )
+            )
+            results.append(
+                (
+                    critical_pvalue,
+                    "levels",
+                    partial(
+                        get_forward_fields, levels, fits, final_level, final_result
+                    ),
+                )
+            )
+            log_info("Reverse selection...")
+            final_level, final_result, pgood = select_reverse(
+                levels_reverse,
+                fits,
+                models_by_level,
+                critical_pvalue,
+                tester_reverse,
+            )
+            log_success(
+                "Final result: level {}, model {}".format(
+                    final_level, final_result.model
+                )
+            )
+            results.append(
+                (
+                    critical_pvalue,
+                    "reverse",
+                    partial(
+                        get_reverse_fields,
+                        levels_reverse,
+                        fits,
+                        final_level,
+                        final_result,
+                        pgood,
+                    ),
+                )
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    headers, data = grouped_results_to_data(
+        {level: [fits[level]] for level in levels if level in fits},
+        group_header="Level",
+    )
+    table = tabulate(
+        data,
+        headers=[click.style(s, bold=True) for s in headers],
+        numalign="center",
+        stralign="center",
+        floatfmt=".3f",
+        tablefmt="simple",
+    )
+    del headers, data
+    log_success("MLE results (best per fitted level):")
+    click.echo(table)
+
+    save_samples(tester, ecdf_params["output_filename_ecdf"])
+
+    save_result(output_filename_result, results, several=len(critical_pvalues) > 1)
+    save_db(db_filename, "stat", params, quartet, fits, results, tester)
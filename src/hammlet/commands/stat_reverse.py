@@ -1,124 +1,39 @@
 import csv
+from collections import OrderedDict
+from functools import partial
 
 import click
 from tabulate import tabulate
 
 from ..models import models_nrds
 from ..optimizer import Optimizer
-from ..parsers import parse_ecdfs, parse_input, parse_models, presets_db
-from ..printers import log_debug, log_info, log_success, log_warn
-from ..utils import (
-    autotimeit,
-    get_a,
-    get_LL2,
-    get_pvalue,
-    grouped_results_to_data,
-    pformatf,
-    results_to_data,
+from ..options import (
+    ecdf_options,
+    get_params,
+    get_tester,
+    save_db,
+    save_result,
+    save_samples,
+    selection_options,
 )
+from ..parsers import parse_ecdfs, parse_input
+from ..printers import log_debug, log_info, log_success
+from ..resultset import ResultSet
+from ..selection import LevelFits, get_reverse_fields, select_reverse
+from ..utils import autotimeit, grouped_results_to_data, pformatf, results_to_data
 
 
 @click.command()
-@click.option(
-    "--preset",
-    type=click.Choice(presets_db),
-    metavar="<preset>",
-    help="Data preset ({})".format("/".join(presets_db.keys())),
-    hidden=True,
-)
-@click.option(
-    "-y",
-    nargs=10,
-    type=int,
-    metavar="<int...>",
-    help="Space-separated list of "
-    + click.style("ten", bold=True)
-    + " y values (y11 y12 y13 y14 y22 y23 y24 y33 y34 y44)",
-)
-@click.option(
-    "-r",
-    nargs=4,
-    type=float,
-    metavar="<float...>",
-    default=(1, 1, 1, 1),
-    show_default=True,
-    help="Space-separated list of " + click.style("four", bold=True) + " r values",
-)
-@click.option(
-    "-x",
-    "--exclude",
-    "excluded_models",
-    multiple=True,
-    metavar="<name...|all>",
-    required=False,
-    callback=parse_models,
-    help="Comma-separated list of models to exclude",
-)
-@click.option(
-    "--output-mle",
-    "output_filename_mle",
-    type=click.Path(writable=True),
-    metavar="<path>",
-    help="Output file with MLE results table",
-)
-@click.option(
-    "--output-result",
-    "output_filename_result",
-    type=click.Path(writable=True),
-    metavar="<path>",
-    help="Output file with result",
-)
-@click.option(
-    "-p",
-    "--pvalue",
-    "critical_pvalue",
-    type=float,
-    metavar="<float>",
-    default=0.05,
-    show_default=True,
-    help="p-value for statistical tests",
-)
-@click.option(
-    "--method",
-    type=click.Choice(["SLSQP", "L-BFGS-B", "TNC"]),
-    default="SLSQP",
-    show_default=True,
-    help="Optimization method",
-)
-@click.option(
-    "--theta0",
-    nargs=5,
-    type=float,
-    metavar="<n0 T1 T3 g1 g3>",
-    help="Space-separated list of "
-    + click.style("five", bold=True)
-    + " initial theta components",
-)
-@click.option(
-    "--ecdf",
-    is_flag=True,
-    help="Use ecdf criterion",
-)
-@click.option(
-    "--ecdfs",
-    metavar="<N4-N0, N4-N1, N4-N2, N4-N3>",
-    callback=parse_ecdfs,
-    help="[ecdf] Comma-separated list of "
-    + click.style("four", bold=True)
-    + " precomputed critical values for N4-N0,...,N4-N3",
-)
-@click.option(
-    "-n",
-    "--times",
-    "bootstrap_times",
-    type=int,
-    metavar="<int>",
-    help="[ecdf] Number of bootstrap samples",
-)
-@click.option(
-    "--use-best-senior-model",
-    is_flag=True,
-    help="[ecdf] Optimize only the best senior model during bootstrap in ecdf",
+@selection_options
+@ecdf_options(
+    click.option(
+        "--ecdfs",
+        metavar="<N4-N0, N4-N1, N4-N2, N4-N3>",
+        callback=parse_ecdfs,
+        help="[ecdf] Comma-separated list of "
+        + click.style("four", bold=True)
+        + " precomputed critical values for N4-N0,...,N4-N3",
+    ),
 )
 @click.option("--debug", is_flag=True, help="Debug")
 @autotimeit
@@ -129,18 +44,17 @@ def stat_reverse(
     excluded_models,
     output_filename_mle,
     output_filename_result,
-    critical_pvalue,
+    db_filename,
+    critical_pvalues,
     method,
     theta0,
-    ecdf,
-    ecdfs,
-    bootstrap_times,
-    use_best_senior_model,
     debug,
+    **ecdf_params,
 ):
     """Perform 'reverse' statistics calculation."""
 
     y = parse_input(preset, y, verbose=True)
+    quartet = preset or " ".join(map(str, y))
     del preset
     log_info("y: {}".format(" ".join(map(str, y))))
     log_info("r: ({})".format(", ".join(map(pformatf, r))))
@@ -149,38 +63,19 @@ def stat_reverse(
         theta0 = (round(0.6 * sum(y), 5), 0.5, 0.5, 0.5, 0.5)
         if debug:
             log_debug("Using default theta0: {}".format(theta0))
-
-    if ecdfs is not None:
-        ecdf = True
-
-    if bootstrap_times and not ecdf:
-        raise click.BadParameter(
-            "bootstrap is only performed with --ecdf flag", param_hint="-n/--times"
-        )
-
-    if use_best_senior_model and not ecdf:
-        raise click.BadParameter(
-            "option --use-best-senior-model only makes sense with --ecdf flag",
-            param_hint="--use-best-senior-model",
-        )
-
-    if bootstrap_times:
-        rep = bootstrap_times
-    else:
-        if 0.1 <= critical_pvalue:
-            rep = 100
-        elif 0.01 <= critical_pvalue < 0.1:
-            rep = 1000
-        else:
-            log_warn("Are you crazy? p={} is too small!".format(critical_pvalue))
-            rep = 2000
-        # elif 0.001 <= critical_pvalue < 0.01:
-        #     rep = 10000
-        # elif 0.0001 <= critical_pvalue < 0.001:
-        #     rep = 100000
-        # else:
-        #     rep = 1000000
-    log_info("Going to use {} bootstrap samples for p={}".format(rep, critical_pvalue))
+    params = get_params(y, r, theta0, method, excluded_models, critical_pvalues)
+
+    tester = get_tester(
+        "stat-reverse",
+        y,
+        r,
+        theta0,
+        method,
+        excluded_models,
+        critical_pvalues,
+        debug=debug,
+        **ecdf_params,
+    )
 
     levels = ["N4", "N0", "N1", "N2", "N3"]
     optimizer = Optimizer(y, r, theta0, method, debug=debug)
@@ -201,16 +96,12 @@ def stat_reverse(
     levels = [level for level in levels if models_by_level[level]]
 
     log_info("Optimizing...")
-    results_by_level = {
-        level: optimizer.many(models_by_level[level], perms="model") for level in levels
-    }
-    best_result_by_level = {
-        level: max(results, key=lambda r: r.LL)
-        for level, results in results_by_level.items()
-    }
+    # Note: levels are fitted only when the selection reaches them
+    fits = LevelFits(optimizer, models_by_level, debug=debug)
 
     if output_filename_mle:
-        results_all = [r for rs in results_by_level.values() for r in rs]
+        results_by_level = OrderedDict((level, fits.results(level)) for level in levels)
+        results_all = ResultSet.concatenate(results_by_level.values())
         headers, data = results_to_data(results_all)
         del results_all
         log_info("Writing MLE results to <{}>...".format(output_filename_mle))
@@ -222,8 +113,36 @@ def stat_reverse(
             del writer
         del headers, data
 
+    results = []  # [(critical_pvalue, procedure, get fields)]
+    for critical_pvalue in critical_pvalues:
+        if len(critical_pvalues) > 1:
+            log_info("Critical p-value: {}".format(critical_pvalue))
+        try:
+            final_level, final_result, pgood = select_reverse(
+                levels, fits, models_by_level, critical_pvalue, tester
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        log_success(
+            "Final result: level {}, model {}".format(final_level, final_result.model)
+        )
+        results.append(
+            (
+                critical_pvalue,
+                "reverse",
+                partial(
+                    get_reverse_fields,
+                    levels,
+                    fits,
+                    final_level,
+                    final_result,
+                    pgood,
+                ),
+            )
+        )
+
     headers, data = grouped_results_to_data(
-        {level: [best_result] for level, best_result in best_result_by_level.items()},
+        {level: [fits[level]] for level in levels if level in fits},
         group_header="Level",
     )
     table = tabulate(
@@ -235,138 +154,10 @@ def stat_reverse(
         tablefmt="simple",
     )
     del headers, data
-    log_success("MLE results (best per level):")
+    log_success("MLE results (best per fitted level):")
     click.echo(table)
 
-    level_complex = levels[0]
-    result_complex = best_result_by_level[level_complex]
+    save_samples(tester, ecdf_params["output_filename_ecdf"])
 
-    final_level = level_complex
-    final_result = result_complex
-
-    for level_simple in levels[1:]:
-        result_simple = best_result_by_level[level_simple]
-        if ecdf:
-            if ecdfs is not None:
-                z = ecdfs[int(level_simple[1:])]
-            else:
-                a = get_a(model=result_simple.model, theta=result_simple.theta, r=r)
-                if use_best_senior_model:
-                    models_high = [result_complex.model]
-                    log_info(
-                        "Bootstrapping {}/{} {} times...".format(
-                            result_complex.model,
-                            result_simple.model,
-                            rep,
-                        )
-                    )
-                else:
-                    models_high = models_by_level[level_complex]
-                    log_info(
-                        "Bootstrapping {}/{} {} times...".format(
-                            level_complex,
-                            result_simple.model,
-                            rep,
-                        )
-                    )
-                boot = [
-                    get_LL2(
-                        models_high=models_high,
-                        model_low=result_simple.model,
-                        y=a,
-                        r=r,
-                        theta0=theta0,
-                        method=method,
-                        debug=debug,
-                    )
-                    for _ in range(rep)
-                ]
-                boot.sort()
-                i = int(rep - critical_pvalue * rep)
-                z = boot[min([i, rep - 1])]
-            LLx = result_complex.LL
-            LLy = result_simple.LL
-            d = 2 * (LLx - LLy)
-            if ecdfs is not None:
-                log_info(
-                    "{}-{}: 2*delta LL = {:.3f}, critical LL = {:.3f}".format(
-                        level_complex, level_simple, d, z
-                    )
-                )
-                del LLx, LLy
-            else:
-                log_info(
-                    "{}-{}: 2*delta LL = {:.3f}, critical LL = {:.3f} ({}th of {}, range={:.3f}..{:.3f})".format(
-                        level_complex, level_simple, d, z, i, rep, boot[0], boot[-1]
-                    )
-                )
-                del a, boot, i, LLx, LLy
-            if d < z:
-                log_success("Last 2*delta LL < critical LL, stopping")
-                final_level = level_simple
-                final_result = result_simple
-                break
-        else:
-            df = int(level_complex[1:]) - int(level_simple[1:])
-            stat, p = get_pvalue(result_complex, result_simple, df=df)
-            log_info(
-                "{}-{}: df = {}, stat = {:.3f}, p-value = {:.5f}".format(
-                    level_complex, level_simple, df, stat, p
-                )
-            )
-            if p >= critical_pvalue:
-                log_success("Last p-value >= critical_pvalue, stopping")
-                final_level = level_simple
-                final_result = result_simple
-                break
-
-    log_success(
-        "Final result: level {}, model {}".format(final_level, final_result.model)
-    )
-
-    if output_filename_result:
-        log_info("Writing result to <{}>...".format(output_filename_result))
-        with click.open_file(output_filename_result, "w", atomic=True) as f:
-            name = final_result.model.name
-            mnemo = final_result.model.mnemonic_name
-            permutation = final_result.permutation
-            LL = final_result.LL
-            (n0, T1, T3, g1, g3) = final_result.theta
-            if final_level == levels[0] or final_level == levels[1]:
-                pbad = 0
-            else:
-                level_prev = levels[levels.index(final_level) - 1]
-                _, pbad = get_pvalue(
-                    result_complex,
-                    best_result_by_level[level_prev],
-                    df=int(level_complex[1:]) - int(level_prev[1:]),
-                )
-            if ecdf:
-                pgood = 0  # meaningless value
-            else:
-                pgood = p
-            if final_level == "N0":
-                ppoly = 1
-            else:
-                _, ppoly = get_pvalue(
-                    final_result,
-                    best_result_by_level["N0"],
-                    df=int(final_level[1:]),
-                )
-            f.write(
-                "[reverse],{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(
-                    final_level,
-                    name,
-                    mnemo,
-                    "".join(map(str, permutation)),
-                    LL,
-                    n0,
-                    T1,
-                    T3,
-                    g1,
-                    g3,
-                    pbad,
-                    pgood,
-                    ppoly,
-                )
-            )
+    save_result(output_filename_result, results, several=len(critical_pvalues) > 1)
+    save_db(db_filename, "stat-reverse", params, quartet, fits, results, tester)
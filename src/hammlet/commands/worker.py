@@ -0,0 +1,115 @@
+from functools import partial
+
+import click
+
+from ..batch import analyze_quartets, get_headers
+from ..jobqueue import JobQueue, get_worker_id, run_worker
+from ..models import models_mapping
+from ..parallel import get_jobs
+from ..printers import log_info, log_success, log_warn
+from ..utils import autotimeit
+
+
+def analyze_shard(quartets, params, jobs=1, debug=False):
+    """Yield rows of the batch results table of every quartet, in order."""
+    outputs = analyze_quartets(
+        quartets,
+        params.get("share_permutations", False),
+        jobs,
+        pipeline=params["pipeline"],
+        method=params["method"],
+        critical_pvalues=tuple(params["pvalues"]),
+        excluded_models=tuple(models_mapping[name] for name in params["excluded"]),
+        null=params.get("null", "chi2"),
+        debug=debug,
+    )
+    return (rows for _, rows in outputs)
+
+
+@click.command()
+@click.argument(
+    "queue_path", type=click.Path(exists=True, file_okay=False), metavar="<path>"
+)
+@click.option(
+    "--worker-id",
+    metavar="<str>",
+    help="Name of this worker in the queue  [default: <hostname>:<pid>]",
+)
+@click.option(
+    "--heartbeat",
+    type=float,
+    metavar="<float>",
+    default=30,
+    show_default=True,
+    help="Seconds between heartbeats of a claimed shard",
+)
+@click.option(
+    "--max-shards",
+    type=int,
+    metavar="<int>",
+    help="Stop after processing this many shards",
+)
+@click.option(
+    "--wait",
+    is_flag=True,
+    help="Keep polling while other workers hold claims (they may be requeued)",
+)
+@click.option(
+    "--poll",
+    type=float,
+    metavar="<float>",
+    default=10,
+    show_default=True,
+    help="Seconds between polls with --wait",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=0),
+    metavar="<int>",
+    default=1,
+    show_default=True,
+    help="Number of parallel jobs (0 means all CPUs)",
+)
+@click.option("--debug", is_flag=True, help="Debug")
+@autotimeit
+def worker(queue_path, worker_id, heartbeat, max_shards, wait, poll, jobs, debug):
+    """Analyze shards of quartets from a job queue created by batch --queue.
+
+    Any number of workers (on any nodes sharing the queue directory) can run
+    at once, every shard is claimed by one of them.
+    """
+
+    try:
+        queue = JobQueue(queue_path)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="queue_path")
+    params = queue.params
+    queue.close()
+    worker_id = worker_id or get_worker_id()
+    jobs = get_jobs(jobs)
+    log_info(
+        "Worker {}, pipeline: {}, jobs: {}".format(worker_id, params["pipeline"], jobs)
+    )
+
+    n_shards = n_quartets = 0
+    for shard, size, status in run_worker(
+        queue_path,
+        partial(analyze_shard, params=params, jobs=jobs, debug=debug),
+        get_headers(params["pipeline"]),
+        worker=worker_id,
+        heartbeat=heartbeat,
+        max_shards=max_shards,
+        wait=wait,
+        poll=poll,
+    ):
+        if status == "done":
+            log_info("Shard {} ({} quartets) done".format(shard, size))
+            n_shards += 1
+            n_quartets += size
+        elif status == "failed":
+            log_warn("Shard {} failed (see coordinator --show)".format(shard))
+        else:
+            log_warn("Shard {} was requeued meanwhile, results discarded".format(shard))
+
+    log_success("Processed {} shards ({} quartets)".format(n_shards, n_quartets))
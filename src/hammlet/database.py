@@ -0,0 +1,258 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from urllib.request import pathname2url
+
+import numpy as np
+
+from .resultset import (
+    level_names,
+    model_levels,
+    model_mnemonic_names,
+    model_names,
+    perm_names,
+    theta_fields,
+)
+
+__all__ = ["schema", "queries", "ResultsDB"]
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL,
+    command TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS fits (
+    run INTEGER REFERENCES runs(id),
+    quartet TEXT,
+    level TEXT,
+    model TEXT,
+    mnemo TEXT,
+    perm TEXT,
+    LL REAL,
+    n0 REAL, T1 REAL, T3 REAL, g1 REAL, g3 REAL
+);
+CREATE INDEX IF NOT EXISTS fits_quartet ON fits (quartet, level, LL DESC);
+CREATE INDEX IF NOT EXISTS fits_model ON fits (model, LL DESC);
+CREATE TABLE IF NOT EXISTS decisions (
+    run INTEGER REFERENCES runs(id),
+    quartet TEXT,
+    procedure TEXT,
+    pvalue REAL,
+    level TEXT,
+    model TEXT,
+    mnemo TEXT,
+    perm TEXT,
+    LL REAL,
+    n0 REAL, T1 REAL, T3 REAL, g1 REAL, g3 REAL,
+    pbad REAL, pgood REAL, ppoly REAL
+);
+CREATE INDEX IF NOT EXISTS decisions_quartet ON decisions (quartet);
+CREATE INDEX IF NOT EXISTS decisions_level ON decisions (level, procedure, pvalue);
+CREATE TABLE IF NOT EXISTS ecdfs (
+    digest TEXT PRIMARY KEY,
+    junior TEXT,
+    senior TEXT,
+    method TEXT,
+    key TEXT,
+    size INTEGER,
+    sample BLOB
+);
+"""
+
+fit_columns = ["run", "quartet", "level", "model", "mnemo", "perm", "LL"]
+fit_columns += theta_fields
+decision_columns = ["run", "quartet", "procedure", "pvalue"] + fit_columns[2:]
+decision_columns += ["pbad", "pgood", "ppoly"]
+
+
+def _filters(*names):
+    return OrderedDict((name, name) for name in names)
+
+
+# Note: {name: (table, columns, {filter: column})}
+queries = OrderedDict(
+    [
+        ("runs", ("runs", ["id", "created", "command", "params"], {"run": "id"})),
+        (
+            "decisions",
+            (
+                "decisions",
+                decision_columns,
+                _filters("run", "quartet", "procedure", "pvalue", "level", "model"),
+            ),
+        ),
+        ("fits", ("fits", fit_columns, _filters("run", "quartet", "level", "model"))),
+        (
+            "ecdfs",
+            (
+                "ecdfs",
+                ["digest", "junior", "senior", "method", "size", "key"],
+                _filters("junior"),
+            ),
+        ),
+    ]
+)
+
+
+class ResultsDB(object):
+    """SQLite database with MLE fits, selection decisions and bootstrap ECDFs.
+
+    Rows are buffered and inserted in bulk, one transaction per `flush`.
+    With `readonly`, an existing database is opened for queries only: the
+    file is neither created nor migrated (no schema, no WAL switch).
+
+    >>> from hammlet.models import models_mapping
+    >>> from hammlet.optimizer import OptimizationResult
+    >>> from hammlet.resultset import ResultSet
+    >>> db = ResultsDB(":memory:")
+    >>> run = db.add_run("batch", {"pipeline": "stat"})
+    >>> db.add_fits(run, "q1", ResultSet.from_results([
+    ...     OptimizationResult(models_mapping["PT"], (2, 1, 3, 4), -7.5, (9, 0, 1, 0.5, 1)),
+    ...     OptimizationResult(models_mapping["2H1"], (1, 2, 3, 4), -5.0, (9, 1, 1, 0.5, 0.5)),
+    ... ]))
+    >>> db.flush()
+    >>> headers, rows = db.query("fits", top=1)
+    >>> rows
+    [(1, 'q1', 'N4', '2H1', 'H1:TTgg', '1234', -5.0, 9.0, 1.0, 1.0, 0.5, 0.5)]
+    >>> db.query("fits", level="N1")[1][0][:6]
+    (1, 'q1', 'N1', 'PT', 'H1:0Tn1', '2134')
+    """
+
+    def __init__(self, path, buffer_size=100000, readonly=False):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffers = OrderedDict([("fits", []), ("decisions", [])])
+        if readonly:
+            uri = "file:{}?mode=ro".format(pathname2url(os.path.abspath(path)))
+            self.connection = sqlite3.connect(uri, uri=True)
+            return
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(schema)
+
+    def add_run(self, command, params):
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (created, command, params) VALUES (?, ?, ?)",
+                (time.time(), command, json.dumps(params, sort_keys=True)),
+            )
+        return cursor.lastrowid
+
+    def add_fits(self, run, quartet, results):
+        """Add all `results` (ResultSet) of a quartet."""
+        data = results.data
+        model = data["model"]
+        columns = [
+            level_names[model_levels[model]].tolist(),
+            model_names[model].tolist(),
+            model_mnemonic_names[model].tolist(),
+            perm_names[data["perm"]].tolist(),
+        ] + [data[name].tolist() for name in ["LL"] + theta_fields]
+        self.buffers["fits"].extend((run, quartet) + row for row in zip(*columns))
+        self._check_buffers()
+
+    def add_decisions(self, run, headers, rows):
+        """Add rows of the batch results table (with the given `headers`)."""
+        names = [header.lower() for header in headers]
+        names[names.index("id")] = "quartet"
+        index = [names.index(column.lower()) for column in decision_columns[1:]]
+        self.buffers["decisions"].extend(
+            (run,) + tuple(row[i] for i in index) for row in rows
+        )
+        self._check_buffers()
+
+    def add_ecdf(self, digest, key, sample):
+        """Add (or replace) a bootstrap sample of an `EcdfCache` entry."""
+        sample = np.asarray(sample, dtype=np.float64)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO ecdfs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    digest,
+                    key["junior"],
+                    ",".join(key["senior"]),
+                    key["method"],
+                    json.dumps(key, sort_keys=True),
+                    len(sample),
+                    sample.tobytes(),
+                ),
+            )
+
+    def get_ecdf(self, digest):
+        row = self.connection.execute(
+            "SELECT sample FROM ecdfs WHERE digest = ?", (digest,)
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float64)
+
+    def _check_buffers(self):
+        if sum(len(rows) for rows in self.buffers.values()) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            for table, rows in self.buffers.items():
+                if rows:
+                    columns = fit_columns if table == "fits" else decision_columns
+                    self.connection.executemany(
+                        "INSERT INTO {} ({}) VALUES ({})".format(
+                            table, ", ".join(columns), ", ".join("?" * len(columns))
+                        ),
+                        rows,
+                    )
+                    del rows[:]
+
+    def query(self, name, top=None, **filters):
+        """Run a named query from `queries`, return `(headers, rows)`.
+
+        Filters with None values are ignored. With `top`, only `top` rows with
+        the highest LL of every run and quartet are returned (for tables with
+        LL), in order of quartets.
+        """
+        table, columns, allowed = queries[name]
+        where = []
+        args = []
+        for name_, value in filters.items():
+            if value is None:
+                continue
+            if name_ not in allowed:
+                raise ValueError("{} can not be filtered by {}".format(name, name_))
+            where.append("{} = ?".format(allowed[name_]))
+            args.append(value)
+        where = " WHERE " + " AND ".join(where) if where else ""
+        if top is None:
+            sql = "SELECT {} FROM {}{} ORDER BY rowid".format(
+                ", ".join(columns), table, where
+            )
+        else:
+            if "LL" not in columns:
+                raise ValueError("{} can not be ranked by LL".format(name))
+            sql = (
+                "SELECT {} FROM (SELECT *,"
+                " ROW_NUMBER() OVER (PARTITION BY run, quartet ORDER BY LL DESC) AS rank_,"
+                " MIN(rowid) OVER (PARTITION BY run, quartet) AS first_"
+                " FROM {}{}) WHERE rank_ <= ? ORDER BY first_, rank_"
+            ).format(", ".join(columns), table, where)
+            args.append(top)
+        cursor = self.connection.execute(sql, args)
+        return columns, cursor.fetchall()
+
+    def execute(self, sql):
+        """Run an arbitrary read-only SQL query, return `(headers, rows)`."""
+        self.connection.execute("PRAGMA query_only = ON")
+        try:
+            cursor = self.connection.execute(sql)
+            headers = [column[0] for column in cursor.description or []]
+            return headers, cursor.fetchall()
+        finally:
+            self.connection.execute("PRAGMA query_only = OFF")
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,621 @@
+from __future__ import division
+
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+import zlib
+from functools import partial
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from scipy.stats import beta
+
+from .models import constraint_value, models_nrds
+from .optimizer import (
+    FitCache,
+    fit_replicates,
+    get_candidates,
+    get_problems,
+    get_warm_starts,
+)
+from .parallel import get_seed_sequence, parallel_map, replicate_rng, replicate_seed
+from .utils import get_a
+
+__all__ = [
+    "NullDistribution",
+    "EcdfCache",
+    "get_ecdf_key",
+    "EcdfTable",
+    "critical_index",
+    "stratified_critical_index",
+    "proportion_interval",
+]
+
+theta_names = ["n0", "T1", "T3", "g1", "g3"]
+
+
+def critical_index(n, pvalue):
+    """Index of the critical value in the sorted bootstrap sample of size `n`.
+
+    >>> critical_index(1000, 0.05)
+    950
+    >>> critical_index(100, 0.001)
+    99
+    """
+    return min(int(n - pvalue * n), n - 1)
+
+
+def stratified_critical_index(sample, controls, control_sample, pvalue):
+    """Index of the critical value in the sorted `sample`, post-stratified by `controls`.
+
+    `controls` are control variates of the replicates in `sample` with known
+    distribution, given by a large `control_sample` of them. Replicates are
+    split into strata by quantiles of the control at `1 - pvalue * (10, 4,
+    2, 1, 0.5)` and weighted by the probability of their stratum divided by
+    their number in it, so the random shares of the strata in `sample` do
+    not add to the error of the quantile. A stratum without replicates
+    passes its probability to the nearest one. With equal weights, this is
+    `critical_index`.
+
+    >>> sample = np.arange(1000.0)
+    >>> stratified_critical_index(sample, sample, sample, 0.05) == critical_index(1000, 0.05)
+    True
+    >>> # Large controls are over-represented in the sample
+    >>> stratified_critical_index(sample, sample, np.arange(-100, 1000.0), 0.05)
+    945
+    """
+    n = len(sample)
+    levels = np.clip(1 - pvalue * np.array([10, 4, 2, 1, 0.5]), 0, 1)
+    edges = np.unique(np.quantile(control_sample, levels))
+    strata = np.searchsorted(edges, controls, side="right")
+    probabilities = np.bincount(
+        np.searchsorted(edges, control_sample, side="right"), minlength=len(edges) + 1
+    ) / len(control_sample)
+    counts = np.bincount(strata, minlength=len(edges) + 1)
+    filled = np.flatnonzero(counts)
+    for k in np.flatnonzero(counts == 0):
+        probabilities[filled[np.argmin(np.abs(filled - k))]] += probabilities[k]
+    weights = probabilities[strata] / counts[strata]
+    cdf = np.cumsum(weights[np.argsort(sample, kind="stable")])
+    # Note: as in critical_index, the first value with the ECDF above 1 - pvalue
+    return min(int(np.searchsorted(cdf, 1 - pvalue + 1e-9, side="right")), n - 1)
+
+
+def proportion_interval(k, n, confidence):
+    """Clopper-Pearson confidence interval for the proportion `k/n`.
+
+    >>> [round(x, 4) for x in proportion_interval(0, 100, 0.99)]
+    [0.0, 0.0516]
+    >>> [round(x, 4) for x in proportion_interval(10, 20, 0.99)]
+    [0.2177, 0.7823]
+    """
+    alpha = 1 - confidence
+    lower = 0.0 if k == 0 else float(beta.ppf(alpha / 2, k, n - k + 1))
+    upper = 1.0 if k == n else float(beta.ppf(1 - alpha / 2, k + 1, n - k))
+    return lower, upper
+
+
+class NullDistribution(object):
+    """Bootstrap distribution of 2*(LL_senior - LL_junior) under the junior model.
+
+    Replicates are Poisson draws around a_ij of the junior model with given
+    theta. Replicate `i` always uses the same random stream (derived from the
+    seed, the senior models and the junior model), so the sample can be grown
+    incrementally and does not depend on the number of jobs.
+
+    With `warm_start`, replicate fits start from the fits on the expected a_ij
+    (with n0 rescaled to the replicate total) instead of the generic `theta0`.
+    With `prune`, only that many best permutations of every model are fitted
+    on each replicate, the others are screened (see `fit_replicate`).
+
+    With a `checkpoint`, previously completed replicates are restored and new
+    ones are recorded in chunks as soon as they are fitted.
+
+    With a `control` (a `ChiBarNull` of the same comparison), the asymptotic
+    statistic of every replicate is its control variate, and critical values
+    are estimated by `stratified_critical_index`. Replicates are drawn again
+    from their streams to compute controls, so the sample must come from
+    this seed (not from an `EcdfCache`).
+    """
+
+    def __init__(
+        self,
+        models_senior,
+        model_junior,
+        theta,
+        r,
+        theta0,
+        method,
+        seed_sequence=None,
+        warm_start=True,
+        prune=None,
+        checkpoint=None,
+        control=None,
+        debug=False,
+    ):
+        self.models_senior = list(models_senior)
+        self.model_junior = model_junior
+        self.theta = tuple(theta)
+        self.r = tuple(r)
+        self.theta0 = theta0
+        self.method = method
+        self.seed_sequence = get_seed_sequence(seed_sequence)
+        self.debug = debug
+        self.a = get_a(model=model_junior, theta=self.theta, r=self.r)
+        self.problems_senior = get_problems(self.models_senior, "model")
+        self.problems_junior = get_problems([model_junior], "model")
+        self.warm_start = warm_start
+        self.prune = prune
+        self.starts = None
+        self.candidates = None
+        self.cache = FitCache()
+        self.sample = np.empty(0)
+        self.control = control
+        self.controls = np.empty(0)
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            completed = checkpoint.completed(self.checkpoint_key)
+            n = 0
+            while n in completed:
+                n += 1
+            self.sample = np.array([completed[i] for i in range(n)], dtype=float)
+
+    @property
+    def key(self):
+        return (
+            self.model_junior.name,
+            tuple(sorted(model.name for model in self.models_senior)),
+        )
+
+    @property
+    def stream(self):
+        # Note: crc32 (unlike hash) is stable between runs
+        return zlib.crc32(repr(self.key).encode("utf-8"))
+
+    @property
+    def checkpoint_key(self):
+        junior, senior = self.key
+        return "{}/{}".format(",".join(senior), junior)
+
+    def __len__(self):
+        return len(self.sample)
+
+    def extend(self, times, jobs=1):
+        """Draw and fit `times` more replicates."""
+        if self.checkpoint is not None:
+            while times > 0:
+                chunk = min(times, self.checkpoint.every)
+                n = len(self.sample)
+                self._extend(chunk, jobs)
+                self.checkpoint.append(
+                    range(n, n + chunk), self.sample[n:].tolist(), self.checkpoint_key
+                )
+                times -= chunk
+        else:
+            self._extend(times, jobs)
+
+    def draw(self, start, times):
+        """Replicates `start`, ..., `start + times - 1` (rows)."""
+        return np.array(
+            [
+                replicate_rng(self.seed_sequence, self.stream, start + i).poisson(
+                    self.a
+                )
+                for i in range(times)
+            ]
+        ).reshape(-1, 10)
+
+    def _extend(self, times, jobs=1):
+        ys = self.draw(len(self.sample), times)
+        problems = self.problems_senior + self.problems_junior
+        if (self.warm_start or self.prune) and self.starts is None:
+            self.starts = get_warm_starts(
+                self.a, problems, self.r, self.theta0, self.method, debug=self.debug
+            )
+            if self.prune:
+                self.candidates = get_candidates(
+                    self.a, problems, self.starts, self.r, self.prune
+                )
+        LL, _ = fit_replicates(
+            ys,
+            problems,
+            self.r,
+            self.theta0,
+            self.method,
+            starts=self.starts,
+            candidates=self.candidates,
+            cache=self.cache,
+            jobs=jobs,
+            debug=self.debug,
+        )
+        n_senior = len(self.problems_senior)
+        LL2 = 2 * (LL[:, :n_senior].max(axis=1) - LL[:, n_senior:].max(axis=1))
+        self.sample = np.concatenate([self.sample, LL2])
+
+    def sorted(self):
+        return np.sort(self.sample)
+
+    def get_controls(self):
+        """Control variates of the replicates in the sample (see `control`)."""
+        n = len(self.controls)
+        if n < len(self.sample):
+            ys = self.draw(n, len(self.sample) - n)
+            self.controls = np.concatenate([self.controls, self.control.control(ys)])
+        return self.controls
+
+    def critical_index(self, pvalue):
+        if self.control is None:
+            return critical_index(len(self.sample), pvalue)
+        return stratified_critical_index(
+            self.sample, self.get_controls(), self.control.get_control_sample(), pvalue
+        )
+
+    def critical_value(self, pvalue):
+        return float(self.sorted()[self.critical_index(pvalue)])
+
+    def sequential_test(
+        self, stat, pvalue, max_times, confidence=0.99, batch=10, jobs=1, strict=True
+    ):
+        """Grow the sample until it is settled whether `stat` is significant.
+
+        `stat` is significant when the proportion `k/n` of replicates with LL2
+        at least `stat` (above `stat` unless `strict`) is below `pvalue`, which
+        for the full sample is the same as `stat > critical_value(pvalue)`
+        (`>=` unless `strict`). After each batch of replicates `k/n` is bounded
+        by a Clopper-Pearson interval, and sampling stops once the interval
+        lies entirely below or above `pvalue`. Every interval has confidence
+        `1 - (1 - confidence) / looks` for the at most `looks` batches, so by
+        the Bonferroni inequality an early decision differs from the decision
+        for the exact exceedance probability with probability at most
+        `1 - confidence`. Without an early decision, the full `max_times`
+        replicates decide.
+
+        Returns True when `stat` is significant.
+        """
+        batch = max(batch, jobs)
+        looks = max(1, -(-max_times // batch))
+        confidence = 1 - (1 - confidence) / looks
+        while True:
+            n = len(self.sample)
+            if n:
+                if strict:
+                    k = int(np.count_nonzero(self.sample >= stat))
+                else:
+                    k = int(np.count_nonzero(self.sample > stat))
+                if n >= max_times:
+                    return k < n - self.critical_index(pvalue)
+                lower, upper = proportion_interval(k, n, confidence)
+                if upper < pvalue:
+                    return True
+                if lower > pvalue:
+                    return False
+            self.extend(min(batch, max_times - n), jobs=jobs)
+
+
+def _round(values, digits):
+    if values is None:
+        return None
+    return [round(float(x), digits) + 0.0 for x in values]
+
+
+def get_ecdf_key(null, digits=3):
+    """Key of the bootstrap sample of `null` in `EcdfCache` (and in the results database)."""
+    junior, senior = null.key
+    return dict(
+        junior=junior,
+        theta=_round(null.theta, digits),
+        r=_round(null.r, digits),
+        senior=list(senior),
+        method=null.method,
+        theta0=_round(null.theta0, digits),
+        warm_start=bool(null.warm_start),
+        prune=null.prune,
+    )
+
+
+class EcdfCache(object):
+    """Persistent cache of sorted bootstrap samples of `NullDistribution`s.
+
+    Entries are keyed by the junior model, its theta and r (both rounded to
+    `digits` decimal places), the senior models and the optimization method,
+    and by the options which change fits of replicates (initial theta0, warm
+    starts and pruning of permutations), so that samples of pruned or warm
+    started runs are never reused by exact runs (and the other way round).
+    Every entry is stored as a separate `.npy` file next to `index.json`.
+    When the total size exceeds `max_size` bytes, least recently used
+    entries are evicted.
+    """
+
+    index_filename = "index.json"
+
+    def __init__(self, path, max_size=256 * 1024**2, digits=3):
+        self.path = path
+        self.max_size = max_size
+        self.digits = digits
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def get_key(self, null):
+        """Return cache key of `null`.
+
+        >>> from hammlet.models import models_mapping
+        >>> null = NullDistribution([models_mapping['2H1']], models_mapping['1H1'],
+        ...                         (100.00012, 1, 2, 0.5, 0), (1, 1, 1, 1), None, 'SLSQP')
+        >>> cache = EcdfCache(tempfile.mkdtemp())
+        >>> cache.get_key(null)
+        {'junior': '1H1', 'theta': [100.0, 1.0, 2.0, 0.5, 0.0], 'r': [1.0, 1.0, 1.0, 1.0], 'senior': ['2H1'], 'method': 'SLSQP', 'theta0': None, 'warm_start': True, 'prune': None}
+        """
+        return get_ecdf_key(null, self.digits)
+
+    @staticmethod
+    def get_digest(key):
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _filename(self, digest):
+        return os.path.join(self.path, digest + ".npy")
+
+    def read_index(self):
+        filename = os.path.join(self.path, self.index_filename)
+        if not os.path.exists(filename):
+            return {}
+        with open(filename) as f:
+            return json.load(f)
+
+    def write_index(self, index):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.rename(tmp, os.path.join(self.path, self.index_filename))
+
+    def load(self, null):
+        """Fill `null` with the cached sample (if any). Returns number of cached replicates."""
+        key = self.get_key(null)
+        digest = self.get_digest(key)
+        index = self.read_index()
+        if digest not in index or not os.path.exists(self._filename(digest)):
+            return 0
+        sample = np.load(self._filename(digest))
+        if len(sample) > len(null.sample):
+            null.sample = sample
+        index[digest]["accessed"] = time.time()
+        self.write_index(index)
+        return len(sample)
+
+    def store(self, null):
+        key = self.get_key(null)
+        digest = self.get_digest(key)
+        sample = null.sorted()
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, sample)
+        os.rename(tmp, self._filename(digest))
+        index = self.read_index()
+        now = time.time()
+        index[digest] = dict(
+            key=key,
+            size=len(sample),
+            bytes=os.path.getsize(self._filename(digest)),
+            created=index.get(digest, {}).get("created", now),
+            accessed=now,
+        )
+        self.write_index(index)
+        self.prune()
+
+    def entries(self):
+        """Return list of (digest, entry) pairs, most recently used first."""
+        index = self.read_index()
+        return sorted(index.items(), key=lambda it: it[1]["accessed"], reverse=True)
+
+    def get_sample(self, digest):
+        return np.load(self._filename(digest))
+
+    def prune(self, max_size=None, max_age=None):
+        """Evict least recently used entries until the cache fits `max_size` bytes.
+
+        Entries not accessed for `max_age` seconds are evicted as well.
+        Returns list of evicted digests.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        index = self.read_index()
+        evicted = []
+        total = 0
+        now = time.time()
+        for digest, entry in self.entries():
+            total += entry["bytes"]
+            too_old = max_age is not None and now - entry["accessed"] > max_age
+            if total > max_size or too_old:
+                evicted.append(digest)
+                total -= entry["bytes"]
+        if evicted:
+            for digest in evicted:
+                del index[digest]
+                if os.path.exists(self._filename(digest)):
+                    os.remove(self._filename(digest))
+            self.write_index(index)
+        return evicted
+
+    def clear(self):
+        return self.prune(max_size=0)
+
+
+def get_model_axes(model, axes):
+    """Restrict theta grid `axes` to the free parameters of `model`.
+
+    Parameters fixed by the model (point bounds) or not identifiable (no
+    bounds, e.g. gammas of polytomy) collapse to a single value.
+
+    >>> from hammlet.models import models_mapping
+    >>> axes = [[50, 100], [0.5, 1], [0.5, 1], [0, 0.5, 1], [0, 0.5, 1]]
+    >>> get_model_axes(models_mapping['1H1'], axes)
+    [[50, 100], [0.5, 1], [0.5, 1], [0, 0.5, 1], [0]]
+    >>> get_model_axes(models_mapping['P'], axes)
+    [[50, 100], [1e-09], [1e-09], [0.5], [0.5]]
+    """
+    result = []
+    for axis, bound in zip(axes, model.bounds):
+        if bound is None:
+            result.append([0.5])
+        elif bound[1] is not None and bound[1] - bound[0] < 1e-6:
+            result.append([constraint_value(axis[0], bound)])
+        else:
+            result.append(list(axis))
+    return result
+
+
+def table_point(task, models_senior, times, pvalues, theta0, method, seed_sequence):
+    index, model_junior, theta, r = task
+    null = NullDistribution(
+        models_senior=models_senior,
+        model_junior=model_junior,
+        theta=theta,
+        r=r,
+        theta0=theta0,
+        method=method,
+        seed_sequence=replicate_seed(seed_sequence, index),
+    )
+    null.extend(times)
+    return [null.critical_value(pvalue) for pvalue in pvalues]
+
+
+class EcdfTable(object):
+    """Precomputed critical 2*delta LL values over a grid of junior-model thetas.
+
+    For every level pair (e.g. "N4-N3") and every junior model of the lower
+    level, `values[pair, junior]` has shape `(len(rs), k_n0, k_T1, k_T3, k_g1,
+    k_g3, len(pvalues))`, where `k_*` is the length of the axis restricted to
+    the model (see `get_model_axes`). Critical values are looked up for an
+    exact r and p-value and linearly interpolated over theta (clipped to the
+    grid range).
+
+    Models in `excluded` (names) are left out of both levels of every pair,
+    so the table is only valid for the same excluded models.
+    """
+
+    def __init__(self, axes, rs, pvalues, times, method, values=None, excluded=()):
+        self.axes = [list(map(float, axis)) for axis in axes]
+        self.rs = [tuple(map(float, r)) for r in rs]
+        self.pvalues = list(map(float, pvalues))
+        self.times = times
+        self.method = method
+        self.excluded = sorted(excluded)
+        self.values = values if values is not None else {}  # {(pair, junior): array}
+        self._interpolators = {}
+
+    @staticmethod
+    def get_pairs(pairs=None):
+        if pairs is None:
+            pairs = ["N4-N3", "N3-N2", "N2-N1", "N1-N0", "N4-N2", "N4-N1", "N4-N0"]
+        return [tuple(pair.split("-")) for pair in pairs]
+
+    def compute(self, pairs=None, theta0=None, seed_sequence=None, jobs=1):
+        """Bootstrap critical values for every grid point (in parallel)."""
+        seed_sequence = get_seed_sequence(seed_sequence)
+        index = 0
+        for level_senior, level_junior in self.get_pairs(pairs):
+            pair = "{}-{}".format(level_senior, level_junior)
+            models_senior = [
+                model
+                for model in models_nrds[level_senior]
+                if model.name not in self.excluded
+            ]
+            models_junior = [
+                model
+                for model in models_nrds[level_junior]
+                if model.name not in self.excluded
+            ]
+            if not models_senior:
+                continue
+            for model_junior in models_junior:
+                model_axes = get_model_axes(model_junior, self.axes)
+                shape = [len(self.rs)] + list(map(len, model_axes))
+                tasks = []
+                for r in self.rs:
+                    for theta in itertools.product(*model_axes):
+                        tasks.append((index, model_junior, theta, r))
+                        index += 1
+                values = parallel_map(
+                    partial(
+                        table_point,
+                        models_senior=models_senior,
+                        times=self.times,
+                        pvalues=self.pvalues,
+                        theta0=theta0,
+                        method=self.method,
+                        seed_sequence=seed_sequence,
+                    ),
+                    tasks,
+                    jobs=jobs,
+                )
+                self.values[pair, model_junior.name] = np.array(
+                    values, dtype=np.float32
+                ).reshape(shape + [len(self.pvalues)])
+
+    def save(self, f):
+        meta = dict(
+            axes=self.axes,
+            rs=self.rs,
+            pvalues=self.pvalues,
+            times=self.times,
+            method=self.method,
+            excluded=self.excluded,
+        )
+        arrays = {
+            "{}/{}".format(pair, junior): values
+            for (pair, junior), values in self.values.items()
+        }
+        np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            meta = json.loads(str(data["meta"]))
+            values = {
+                tuple(name.split("/")): data[name] for name in data if name != "meta"
+            }
+        return cls(values=values, **meta)
+
+    def check_excluded(self, excluded_models):
+        """Raise ValueError unless the table was computed without `excluded_models`."""
+        excluded = sorted(model.name for model in excluded_models)
+        if excluded != self.excluded:
+            raise ValueError(
+                "ECDF table was computed with excluded models: {} (not {})".format(
+                    " ".join(self.excluded) or "none", " ".join(excluded) or "none"
+                )
+            )
+
+    def critical_value(self, pair, model_junior, theta, r, pvalue):
+        if (pair, model_junior.name) not in self.values:
+            raise ValueError(
+                "No critical values for {} with junior model {} in ECDF table".format(
+                    pair, model_junior.name
+                )
+            )
+        r_index = [i for i, r_ in enumerate(self.rs) if np.allclose(r_, r, atol=1e-6)]
+        if not r_index:
+            raise ValueError("r={} is not in ECDF table".format(tuple(r)))
+        p_index = [i for i, p in enumerate(self.pvalues) if abs(p - pvalue) < 1e-12]
+        if not p_index:
+            raise ValueError("p-value {} is not in ECDF table".format(pvalue))
+        key = (pair, model_junior.name, r_index[0], p_index[0])
+        if key not in self._interpolators:
+            values = self.values[pair, model_junior.name][r_index[0], ..., p_index[0]]
+            model_axes = get_model_axes(model_junior, self.axes)
+            free = [i for i, axis in enumerate(model_axes) if len(axis) > 1]
+            if free:
+                interpolator = RegularGridInterpolator(
+                    [model_axes[i] for i in free],
+                    values.reshape([len(model_axes[i]) for i in free]),
+                )
+            else:
+                interpolator = float(values.ravel()[0])
+            self._interpolators[key] = (free, interpolator)
+        free, interpolator = self._interpolators[key]
+        if not free:
+            return interpolator
+        point = [min(max(theta[i], self.axes[i][0]), self.axes[i][-1]) for i in free]
+        return float(interpolator([point])[0])
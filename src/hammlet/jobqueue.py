@@ -0,0 +1,388 @@
+import csv
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = ["JobQueue", "Heartbeat", "get_worker_id", "run_worker", "merge_outputs"]
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    quartets TEXT,
+    size INTEGER,
+    status TEXT DEFAULT 'pending',
+    worker TEXT,
+    claimed REAL,
+    heartbeat REAL,
+    attempts INTEGER DEFAULT 0,
+    output TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS shards_status ON shards (status, id);
+"""
+
+statuses = ["pending", "claimed", "done", "failed"]
+
+
+def get_worker_id():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class JobQueue(object):
+    """Shards of quartets in an SQLite job table, shared by workers on any node.
+
+    The queue is a directory with `queue.db` and per-shard results in
+    `shards/`, so it can live on a shared filesystem. Workers claim pending
+    shards in exclusive transactions and send heartbeats while processing.
+    Claims without a recent heartbeat are requeued by `requeue_stale`.
+    The default rollback journal is used (WAL does not work over network
+    filesystems).
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "queue")
+    >>> quartets = [("q{}".format(i), (1,) * 10, (1, 1, 1, 1)) for i in range(5)]
+    >>> queue = JobQueue.create(path, {"pipeline": "stat"}, quartets, shard_size=2)
+    >>> len(queue), queue.params, queue.status()
+    (5, {'pipeline': 'stat'}, OrderedDict([('pending', 3), ('claimed', 0), ('done', 0), ('failed', 0)]))
+    >>> shard, shard_quartets = queue.claim("w1")
+    >>> shard, [id_ for id_, _, _ in shard_quartets]
+    (1, ['q0', 'q1'])
+    >>> queue.requeue_stale(timeout=0), queue.claim("w2")[0]
+    ([1], 1)
+    >>> queue.complete(shard, "w1", "1.w1.csv"), queue.complete(shard, "w2", "1.w2.csv")
+    (False, True)
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.shards_path = os.path.join(path, "shards")
+        filename = os.path.join(path, "queue.db")
+        if not os.path.exists(filename):
+            raise ValueError("no job queue in <{}>".format(path))
+        self.connection = sqlite3.connect(filename, timeout=timeout)
+        # Note: transactions are managed explicitly
+        self.connection.isolation_level = None
+        self.params = json.loads(self._get_meta("params"))
+
+    @classmethod
+    def create(cls, path, params, quartets, shard_size=100):
+        """Create queue in the directory `path` with shards of `quartets`."""
+        if os.path.exists(os.path.join(path, "queue.db")):
+            raise ValueError("job queue <{}> already exists".format(path))
+        if not os.path.isdir(os.path.join(path, "shards")):
+            os.makedirs(os.path.join(path, "shards"))
+        # Note: filled under a temporary name, so a failed read leaves no queue
+        filename = os.path.join(path, "queue.db")
+        if os.path.exists(filename + ".tmp"):
+            os.remove(filename + ".tmp")
+        connection = sqlite3.connect(filename + ".tmp")
+        with connection:
+            connection.executescript(schema)
+            connection.execute(
+                "INSERT INTO meta VALUES (?, ?)",
+                ("params", json.dumps(params, sort_keys=True)),
+            )
+            shard = []
+            for quartet in quartets:
+                shard.append(quartet)
+                if len(shard) == shard_size:
+                    cls._insert_shard(connection, shard)
+                    shard = []
+            if shard:
+                cls._insert_shard(connection, shard)
+        connection.close()
+        os.rename(filename + ".tmp", filename)
+        return cls(path)
+
+    @staticmethod
+    def _insert_shard(connection, quartets):
+        connection.execute(
+            "INSERT INTO shards (quartets, size) VALUES (?, ?)",
+            (json.dumps([list(quartet) for quartet in quartets]), len(quartets)),
+        )
+
+    def __len__(self):
+        """Number of quartets in all shards."""
+        return self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM shards"
+        ).fetchone()[0]
+
+    def _get_meta(self, name):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _transaction(self, statements):
+        """Run `statements(cursor)` in an exclusive (immediate) transaction."""
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(cursor)
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+        return result
+
+    def claim(self, worker):
+        """Claim the first pending shard, return `(shard, quartets)` or None."""
+
+        def statements(cursor):
+            row = cursor.execute(
+                "SELECT id, quartets FROM shards WHERE status = 'pending'"
+                " ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            cursor.execute(
+                "UPDATE shards SET status = 'claimed', worker = ?, claimed = ?,"
+                " heartbeat = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now, now, row[0]),
+            )
+            quartets = [(id_, tuple(y), tuple(r)) for id_, y, r in json.loads(row[1])]
+            return row[0], quartets
+
+        return self._transaction(statements)
+
+    def heartbeat(self, shard, worker):
+        """Refresh the claim, return False if the shard is no longer ours."""
+        cursor = self.connection.execute(
+            "UPDATE shards SET heartbeat = ?"
+            " WHERE id = ? AND worker = ? AND status = 'claimed'",
+            (time.time(), shard, worker),
+        )
+        return cursor.rowcount == 1
+
+    def _finish(self, shard, worker, status, output=None, error=None):
+        cursor = self.connection.execute(
+            "UPDATE shards SET status = ?, output = ?, error = ?"
+            " WHERE id = ? AND worker = ? AND status = 'claimed'",
+            (status, output, error, shard, worker),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, shard, worker, output):
+        """Mark shard done with results in `output` (a file in `shards/`).
+
+        Returns False (and changes nothing) when the claim was requeued and
+        the shard has been claimed by another worker since.
+        """
+        return self._finish(shard, worker, "done", output=output)
+
+    def fail(self, shard, worker, error):
+        return self._finish(shard, worker, "failed", error=error)
+
+    def release(self, shard, worker):
+        """Give an unfinished claim back (e.g. on interrupt)."""
+        cursor = self.connection.execute(
+            "UPDATE shards SET status = 'pending', worker = NULL"
+            " WHERE id = ? AND worker = ? AND status = 'claimed'",
+            (shard, worker),
+        )
+        return cursor.rowcount == 1
+
+    def requeue_stale(self, timeout, max_attempts=None):
+        """Requeue claims without heartbeat for `timeout` seconds.
+
+        Shards claimed `max_attempts` times already are marked failed.
+        Returns ids of requeued shards.
+        """
+
+        def statements(cursor):
+            rows = cursor.execute(
+                "SELECT id, attempts FROM shards WHERE status = 'claimed'"
+                " AND heartbeat <= ?",
+                (time.time() - timeout,),
+            ).fetchall()
+            requeued = []
+            for shard, attempts in rows:
+                if max_attempts is not None and attempts >= max_attempts:
+                    cursor.execute(
+                        "UPDATE shards SET status = 'failed', worker = NULL,"
+                        " error = 'too many stale claims' WHERE id = ?",
+                        (shard,),
+                    )
+                else:
+                    cursor.execute(
+                        "UPDATE shards SET status = 'pending', worker = NULL"
+                        " WHERE id = ?",
+                        (shard,),
+                    )
+                    requeued.append(shard)
+            return requeued
+
+        return self._transaction(statements)
+
+    def retry_failed(self):
+        """Requeue failed shards, return their number."""
+        cursor = self.connection.execute(
+            "UPDATE shards SET status = 'pending', worker = NULL, error = NULL,"
+            " attempts = 0 WHERE status = 'failed'"
+        )
+        return cursor.rowcount
+
+    def status(self):
+        """Number of shards by status."""
+        counts = OrderedDict((status, 0) for status in statuses)
+        for status, count in self.connection.execute(
+            "SELECT status, COUNT(*) FROM shards GROUP BY status"
+        ):
+            counts[status] = count
+        return counts
+
+    def shards(self):
+        """List of `(id, size, status, worker, heartbeat, attempts, error)`."""
+        return self.connection.execute(
+            "SELECT id, size, status, worker, heartbeat, attempts, error"
+            " FROM shards ORDER BY id"
+        ).fetchall()
+
+    def outputs(self):
+        """Result files of all shards in order (None for unfinished ones)."""
+        return [
+            os.path.join(self.shards_path, output) if output else None
+            for (output,) in self.connection.execute(
+                "SELECT output FROM shards ORDER BY id"
+            )
+        ]
+
+    def close(self):
+        self.connection.close()
+
+
+class Heartbeat(object):
+    """Background thread refreshing a claim every `interval` seconds.
+
+    Uses its own connection, as SQLite connections are bound to a thread.
+    `lost` is set when the claim was taken over.
+    """
+
+    def __init__(self, path, shard, worker, interval):
+        self.path = path
+        self.shard = shard
+        self.worker = worker
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _run(self):
+        queue = JobQueue(self.path)
+        try:
+            while not self.stopped.wait(self.interval):
+                if not queue.heartbeat(self.shard, self.worker):
+                    self.lost = True
+                    break
+        finally:
+            queue.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+
+def _write_shard(filename, headers, outputs):
+    # Note: write-and-rename, so a shard file is either complete or missing
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(headers)
+        for rows in outputs:
+            writer.writerows(rows)
+    os.rename(tmp_filename, filename)
+
+
+def run_worker(
+    path,
+    analyze,
+    headers,
+    worker=None,
+    heartbeat=30,
+    max_shards=None,
+    wait=False,
+    poll=10,
+):
+    """Claim and process shards of the queue at `path` until none are left.
+
+    `analyze(quartets)` returns an iterable with rows of the results table
+    (`headers`) of every quartet. Results of every shard are written to
+    `shards/<shard>.<worker>.csv`. With `wait`, the worker keeps polling
+    while other workers hold claims, which may be requeued.
+
+    Yields `(shard, number of quartets, status)` of every processed shard,
+    status is "done", "failed" (`analyze` raised an exception) or "lost"
+    (the claim was requeued meanwhile, results are discarded).
+    """
+    if worker is None:
+        worker = get_worker_id()
+    queue = JobQueue(path)
+    n = 0
+    try:
+        while max_shards is None or n < max_shards:
+            claimed = queue.claim(worker)
+            if claimed is None:
+                if wait and queue.status()["claimed"]:
+                    time.sleep(poll)
+                    continue
+                break
+            shard, quartets = claimed
+            output = "{:06d}.{}.csv".format(shard, worker.replace(os.sep, "_"))
+            filename = os.path.join(queue.shards_path, output)
+            try:
+                with Heartbeat(path, shard, worker, heartbeat) as beat:
+                    _write_shard(filename, headers, analyze(quartets))
+            except Exception as e:
+                queue.fail(shard, worker, "{}: {}".format(type(e).__name__, e))
+                status = "failed"
+            except BaseException:
+                queue.release(shard, worker)
+                raise
+            else:
+                if not beat.lost and queue.complete(shard, worker, output):
+                    status = "done"
+                else:
+                    os.remove(filename)
+                    status = "lost"
+            n += 1
+            yield shard, len(quartets), status
+    finally:
+        queue.close()
+
+
+def merge_outputs(queue, f):
+    """Concatenate results of all shards (in order) into the open file `f`.
+
+    All shards must be done. Returns the number of rows written.
+    """
+    status = queue.status()
+    if status["done"] != sum(status.values()):
+        raise ValueError(
+            "not all shards are done: {}".format(
+                ", ".join("{} {}".format(v, k) for k, v in status.items() if v)
+            )
+        )
+    n = 0
+    for index, filename in enumerate(queue.outputs()):
+        with open(filename) as f_shard:
+            header = f_shard.readline()
+            if index == 0:
+                f.write(header)
+            for line in f_shard:
+                f.write(line)
+                n += 1
+    return n
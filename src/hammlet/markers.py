@@ -0,0 +1,304 @@
+import itertools
+
+import numpy as np
+
+__all__ = [
+    "MarkerMatrix",
+    "read_markers",
+    "pack_bits",
+    "popcount",
+    "quartet_counts",
+    "sampled_counts",
+    "iter_quartets",
+]
+
+# Note: (i, j) of y11, y12, ..., y44 (0-based positions in the quartet)
+y_pairs = [(i, j) for i in range(4) for j in range(i, 4)]
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def pack_bits(bits):
+    """Pack rows of a boolean matrix into uint64 words.
+
+    >>> pack_bits(np.array([[1, 0, 1], [0, 0, 0]], dtype=bool))
+    array([[5],
+           [0]], dtype=uint64)
+    """
+    bits = np.asarray(bits, dtype=bool)
+    packed = np.packbits(bits, axis=1, bitorder="little")
+    padding = -packed.shape[1] % 8
+    if padding or not packed.shape[1]:
+        packed = np.pad(packed, ((0, 0), (0, padding or 8)))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def popcount(words):
+    """Number of set bits in uint64 `words`, summed over the last axis.
+
+    >>> popcount(np.array([[1, 3], [255, 0]], dtype=np.uint64)).tolist()
+    [3, 8]
+    """
+    words = np.ascontiguousarray(words)
+    if hasattr(np, "bitwise_count"):  # numpy>=2.0
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    octets = words.view(np.uint8).reshape(words.shape[:-1] + (8 * words.shape[-1],))
+    return _POPCOUNT8[octets].sum(axis=-1, dtype=np.int64)
+
+
+class MarkerMatrix(object):
+    """Presence/absence of markers in N species at M loci.
+
+    Absence bits are packed per species into uint64 words, so intersections
+    over several species are bitwise ANDs and counting is a popcount.
+    """
+
+    def __init__(self, names, present):
+        present = np.asarray(present, dtype=bool)
+        assert present.ndim == 2 and present.shape[0] == len(names)
+        self.names = list(names)
+        self.n_loci = present.shape[1]
+        self.absent = pack_bits(~present)
+
+    @classmethod
+    def from_packed(cls, names, absent, n_loci):
+        """Matrix with already packed absence bits (N, words) of `n_loci` loci.
+
+        Unset bits beyond the loci (e.g. padding of separately packed chunks)
+        are loci present in all species, which are in no y and so are harmless.
+        """
+        matrix = cls.__new__(cls)
+        matrix.names = list(names)
+        matrix.n_loci = n_loci
+        matrix.absent = np.ascontiguousarray(absent, dtype=np.uint64)
+        return matrix
+
+    def __len__(self):
+        return len(self.names)
+
+
+# Note: names of the column with numbers of loci (as in files with y_ij of a quartet)
+count_columns = ["y_ij", "count", "counts"]
+
+_PRESENT = np.zeros(256, dtype=np.int8) - 1
+_PRESENT[[ord("+"), ord("1")]] = 1
+_PRESENT[[ord("-"), ord("0")]] = 0
+
+
+def _pack_loci(symbols, counts, line_numbers, n):
+    """Pack absence bits of loci given by lines of `n` symbols each."""
+    codes = np.frombuffer("".join(symbols).encode("latin1", "replace"), dtype=np.uint8)
+    present = _PRESENT[codes].reshape(len(symbols), n)
+    bad = (present < 0).any(axis=1)
+    if bad.any():
+        raise ValueError(
+            "line {}: expected {} symbols of +/-/1/0".format(
+                line_numbers[int(np.argmax(bad))], n
+            )
+        )
+    present = np.repeat(present.astype(bool), counts, axis=0)
+    return pack_bits(~present.T), len(present)
+
+
+def read_markers(f, chunk_size=65536):
+    """Read marker matrix: a header with species names, then one line per locus.
+
+    Each locus line has a presence (`+` or `1`) or absence (`-` or `0`) symbol
+    for every species (separated by spaces or not), optionally followed by the
+    number of such loci. The last header column is the number of loci if it
+    is named as one of `count_columns` (e.g. `y_ij`), otherwise all header
+    columns are species and a number of loci is only read from a token after
+    all the symbols. Loci are packed in chunks of `chunk_size` lines.
+
+    >>> import io
+    >>> f = io.StringIO("A B C D y_ij\\n+ + - - 2\\n- + + +\\n")
+    >>> matrix = read_markers(f)
+    >>> matrix.names, matrix.n_loci
+    (['A', 'B', 'C', 'D'], 3)
+    >>> matrix = read_markers(io.StringIO("A B C D\\n1 0 1 1\\n0 1 1 0\\n0110 3\\n"))
+    >>> matrix.names, matrix.n_loci
+    (['A', 'B', 'C', 'D'], 5)
+    """
+    names = f.readline().split()
+    if names and names[-1].lower() in count_columns:
+        names = names[:-1]
+    n = len(names)
+    if not n:
+        raise ValueError("header must contain species names")
+    chunks = []
+    n_loci = 0
+    symbols = []
+    counts = []
+    line_numbers = []
+    for line_number, line in enumerate(f, start=2):
+        tokens = line.split()
+        if not tokens:
+            continue
+        line_symbols = "".join(tokens)
+        count = 1
+        if len(line_symbols) != n:
+            if len(tokens) > 1 and tokens[-1].isdigit():
+                line_symbols = "".join(tokens[:-1])
+                count = int(tokens[-1])
+            if len(line_symbols) != n:
+                raise ValueError(
+                    "line {}: expected {} symbols of +/-/1/0 (and an optional"
+                    " number of loci)".format(line_number, n)
+                )
+        symbols.append(line_symbols)
+        counts.append(count)
+        line_numbers.append(line_number)
+        if len(symbols) == chunk_size:
+            absent, size = _pack_loci(symbols, counts, line_numbers, n)
+            chunks.append(absent)
+            n_loci += size
+            symbols, counts, line_numbers = [], [], []
+    if symbols:
+        absent, size = _pack_loci(symbols, counts, line_numbers, n)
+        chunks.append(absent)
+        n_loci += size
+    if not chunks:
+        raise ValueError("no loci")
+    return MarkerMatrix.from_packed(names, np.concatenate(chunks, axis=1), n_loci)
+
+
+def _pair_counts(A):
+    """Numbers of loci where both species of every pair are absent (n, n)."""
+    n = len(A)
+    pair = np.zeros((n, n), dtype=np.int64)
+    for a in range(n - 1):
+        counts = popcount(A[a] & A[a + 1 :])
+        pair[a, a + 1 :] = counts
+        pair[a + 1 :, a] = counts
+    return pair
+
+
+def _patterns(q, single, pair, triples, quad):
+    """y11, ..., y44 (K, 10) of quartets `q` (four index arrays) by inclusion-exclusion.
+
+    `triples` maps positions `(i, j, k)` (i<j<k) in the quartet to numbers of
+    loci where these three species are absent, `quad` is the number of loci
+    where all four are absent.
+    """
+    ys = np.empty((len(quad), 10), dtype=np.int64)
+    for column, (i, j) in enumerate(y_pairs):
+        others = [k for k in range(4) if k not in (i, j)]
+        if i == j:
+            # Only i absent
+            y = single[q[i]] - sum(pair[q[i], q[k]] for k in others)
+            y += sum(
+                triples[tuple(sorted((i, k, l)))]
+                for k, l in itertools.combinations(others, 2)
+            )
+            y -= quad
+        else:
+            # Exactly i and j absent
+            y = pair[q[i], q[j]] - sum(
+                triples[tuple(sorted((i, j, k)))] for k in others
+            )
+            y += quad
+        ys[:, column] = y
+    return ys
+
+
+def quartet_counts(matrix, max_words=2**22):
+    """Yield `(quartets, ys)` for all quartets `a<b<c<d` of species, in chunks.
+
+    `quartets` is an array of species indices (K, 4) and `ys` is an array
+    (K, 10) of y11, y12, ..., y44: y_ij (i<j) is the number of loci where
+    exactly the species i and j of the quartet are absent, y_ii is the number
+    of loci where only the species i is absent.
+
+    The numbers of loci where all species of a set are absent are counted for
+    every pair, triple and quartet by popcounts, and the exact patterns are
+    derived from them by inclusion-exclusion. Intermediate intersections take
+    at most `max_words` uint64 words.
+
+    >>> present = [[1, 0, 1, 1, 0], [1, 1, 0, 1, 0], [1, 1, 1, 0, 1], [0, 0, 1, 1, 1]]
+    >>> [(q.tolist(), y.tolist()) for q, y in quartet_counts(MarkerMatrix("ABCD", present))]
+    [([[0, 1, 2, 3]], [[0, 1, 0, 1, 1, 0, 0, 1, 0, 1]])]
+    """
+    A = matrix.absent
+    n = len(matrix)
+    single = popcount(A)
+    pair = _pair_counts(A)
+    triple = np.zeros((n, n, n), dtype=np.int64)
+    for a, b in itertools.combinations(range(n), 2):
+        c = np.arange(b + 1, n)
+        counts = popcount(A[a] & A[b] & A[c])
+        for i, j, k in itertools.permutations((a, b, c)):
+            triple[i, j, k] = counts
+
+    # Note: bound memory of the (quartets, words) intersections
+    block = max(1, max_words // A.shape[1])
+    for a, b in itertools.combinations(range(n - 2), 2):
+        ab = A[a] & A[b]
+        cs, ds = np.triu_indices(n - b - 1, k=1)
+        cs += b + 1
+        ds += b + 1
+        for start in range(0, len(cs), block):
+            c = cs[start : start + block]
+            d = ds[start : start + block]
+            quad = popcount(ab & A[c] & A[d])
+            q = [np.full_like(c, a), np.full_like(c, b), c, d]
+            triples = {
+                (i, j, k): triple[q[i], q[j], q[k]]
+                for i, j, k in itertools.combinations(range(4), 3)
+            }
+            yield np.stack(q, axis=1), _patterns(q, single, pair, triples, quad)
+
+
+def sampled_counts(matrix, quartets, max_words=2**22):
+    """Yield `(quartets, ys)` as `quartet_counts` does, for the given quartets.
+
+    `quartets` is an iterable of 4-tuples of species indices, consumed
+    lazily. Only numbers for single species and pairs are precomputed (which
+    is cheap for hundreds of species), triples and quartets are counted for
+    the given quartets only.
+
+    >>> present = [[1, 0, 1, 1, 0], [1, 1, 0, 1, 0], [1, 1, 1, 0, 1], [0, 0, 1, 1, 1]]
+    >>> matrix = MarkerMatrix("ABCD", present)
+    >>> [(q.tolist(), y.tolist()) for q, y in sampled_counts(matrix, [(0, 1, 2, 3)])]
+    [([[0, 1, 2, 3]], [[0, 1, 0, 1, 1, 0, 0, 1, 0, 1]])]
+    """
+    A = matrix.absent
+    single = popcount(A)
+    pair = _pair_counts(A)
+    block = max(1, max_words // A.shape[1])
+    quartets = iter(quartets)
+    while True:
+        chunk = np.array(list(itertools.islice(quartets, block)), dtype=np.intp)
+        if not len(chunk):
+            return
+        q = list(chunk.T)
+        ab = A[q[0]] & A[q[1]]
+        cd = A[q[2]] & A[q[3]]
+        triples = {
+            (0, 1, 2): popcount(ab & A[q[2]]),
+            (0, 1, 3): popcount(ab & A[q[3]]),
+            (0, 2, 3): popcount(A[q[0]] & cd),
+            (1, 2, 3): popcount(A[q[1]] & cd),
+        }
+        quad = popcount(ab & cd)
+        yield chunk, _patterns(q, single, pair, triples, quad)
+
+
+def iter_quartets(matrix, r=(1, 1, 1, 1), skip_empty=True, quartets=None):
+    """Yield `(id, y, r)` of all quartets, as `read_quartets` does for batch.
+
+    The id is the comma-separated names of the quartet species (in order of
+    the matrix). With `quartets` (e.g. sampled ones, see `sampling`), only
+    these quartets are counted, in the given order.
+    Quartets without informative loci are skipped unless not `skip_empty`.
+    """
+    r = tuple(r)
+    if quartets is None:
+        chunks = quartet_counts(matrix)
+    else:
+        chunks = sampled_counts(matrix, quartets)
+    for quartets, ys in chunks:
+        for quartet, y in zip(quartets, ys):
+            if skip_empty and not y.any():
+                continue
+            name = ",".join(matrix.names[i] for i in quartet)
+            yield (name, tuple(int(x) for x in y), r)
@@ -1,14 +1,36 @@
 import itertools
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from functools import partial
 from operator import attrgetter
 
+import numpy as np
 from scipy.optimize import minimize
 
 from .models import constraint_value, models_H1_nr, models_H2_nr
+from .parallel import parallel_map
 from .printers import log_debug
-from .utils import convert_permutation, likelihood, morph10
+from .utils import (
+    canonize_y,
+    compose_permutations,
+    convert_permutation,
+    invert_permutation,
+    likelihood,
+    morph10,
+)
 
-__all__ = ["Optimizer"]
+PRUNE_MARGIN = 2.0
+
+__all__ = [
+    "Optimizer",
+    "SharedFits",
+    "CanonicalOptimizer",
+    "get_permutations",
+    "get_problems",
+    "get_warm_starts",
+    "get_candidates",
+    "FitCache",
+    "fit_replicates",
+]
 
 OptimizationResult = namedtuple("OptimizationResult", "model permutation LL theta")
 
@@ -25,7 +47,9 @@ class Optimizer:
         self.options = {"maxiter": 500}
         self.options.update(kwargs)
 
-    def one(self, model, perm):
+    def one(self, model, perm, theta0=None):
+        if theta0 is None:
+            theta0 = self.theta0
         if self.debug:
             log_debug(
                 "Optimizing model {} for permutation {}...".format(
@@ -34,7 +58,7 @@ class Optimizer:
             )
         bounds = model.get_safe_bounds()
         theta0 = tuple(
-            constraint_value(param, bound) for param, bound in zip(self.theta0, bounds)
+            constraint_value(param, bound) for param, bound in zip(theta0, bounds)
         )
         # maximize `likelihood`  ==  minimize `-likelihood`
         result = minimize(
@@ -51,30 +75,8 @@ class Optimizer:
     def many(self, models, perms="all", sort=True):
         results = []
 
-        for model in models:
-            if perms == "model":
-                ps = model.perms
-            elif perms == "model_nr":
-                if model in models_H1_nr:
-                    ps = "all"
-                elif model in models_H2_nr:
-                    ps = "half"
-                else:
-                    raise ValueError(
-                        "Bad model '{}' for model_nr perms mode".format(model)
-                    )
-            else:
-                ps = perms
-
-            if ps == "all":
-                ps = list(itertools.permutations((1, 2, 3, 4)))
-            elif ps == "half":
-                ps = list(itertools.permutations((1, 2, 3, 4)))[:12]
-            else:
-                ps = list(map(convert_permutation, ps))
-
-            for perm in ps:
-                results.append(self.one(model, perm))
+        for model, perm in get_problems(models, perms):
+            results.append(self.one(model, perm))
 
         if sort:
             results.sort(key=attrgetter("LL"), reverse=True)
@@ -86,3 +88,285 @@ class Optimizer:
 
     def many_models(self, models, perm, sort=True):
         return self.many(models, [perm], sort=sort)
+
+
+class SharedFits(object):
+    """Fits of a canonical y (see `canonize_y`), shared by quartets whose y
+    are its relabelings, keyed by (model, permutation, theta0)."""
+
+    def __init__(self, y, r, theta0, method, debug=False, **kwargs):
+        self.optimizer = Optimizer(y, r, theta0, method, debug=debug, **kwargs)
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def one(self, model, perm, theta0=None):
+        key = (model.name, perm, theta0)
+        if key in self.results:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.results[key] = self.optimizer.one(model, perm, theta0)
+        return self.results[key]
+
+
+class CanonicalOptimizer(Optimizer):
+    """Optimizer taking fits from `SharedFits` of the canonical y.
+
+    Fitting `y` with permutation `p` is fitting `y_canonical =
+    morph10(y, tau)` with permutation `tau^-1 * p` (see
+    `compose_permutations`), so results are identical to `Optimizer` ones,
+    for any `r`. Pass the same `shared` fits to all quartets with the same
+    canonical y, r, theta0 and method.
+
+    >>> from hammlet.models import models_mapping
+    >>> y, r, theta0 = (10, 8, 7, 4, 21, 7, 2, 39, 30, 28), (1, 2, 1, 1), (70, .5, .5, .5, .5)
+    >>> y_ = morph10(y, (3, 1, 4, 2))
+    >>> shared = SharedFits(canonize_y(y)[0], r, theta0, "SLSQP")
+    >>> models = [models_mapping["T2"]]
+    >>> _ = CanonicalOptimizer(y, r, theta0, "SLSQP", shared).many(models, "model")
+    >>> results = CanonicalOptimizer(y_, r, theta0, "SLSQP", shared).many(models, "all")
+    >>> results == Optimizer(y_, r, theta0, "SLSQP").many(models, "all")
+    True
+    >>> shared.hits, shared.misses
+    (12, 24)
+    """
+
+    def __init__(self, y, r, theta0, method, shared=None, debug=False, **kwargs):
+        super(CanonicalOptimizer, self).__init__(
+            y, r, theta0, method, debug=debug, **kwargs
+        )
+        y_canonical, permutation = canonize_y(y)
+        if shared is None:
+            shared = SharedFits(y_canonical, r, theta0, method, debug, **kwargs)
+        assert shared.optimizer.y == y_canonical and shared.optimizer.r == r
+        self.shared = shared
+        self.inverse = invert_permutation(permutation)
+
+    def one(self, model, perm, theta0=None):
+        perm = tuple(perm)
+        result = self.shared.one(
+            model, compose_permutations(self.inverse, perm), theta0
+        )
+        return result._replace(permutation=perm)
+
+
+def get_permutations(model, perms="all"):
+    if perms == "model":
+        ps = model.perms
+    elif perms == "model_nr":
+        if model in models_H1_nr:
+            ps = "all"
+        elif model in models_H2_nr:
+            ps = "half"
+        else:
+            raise ValueError("Bad model '{}' for model_nr perms mode".format(model))
+    else:
+        ps = perms
+
+    if ps == "all":
+        ps = list(itertools.permutations((1, 2, 3, 4)))
+    elif ps == "half":
+        ps = list(itertools.permutations((1, 2, 3, 4)))[:12]
+    else:
+        ps = list(map(convert_permutation, ps))
+    return ps
+
+
+def get_problems(models, perms="all"):
+    """Return list of (model, permutation) pairs, in `Optimizer.many` order."""
+    return [
+        (model, perm) for model in models for perm in get_permutations(model, perms)
+    ]
+
+
+def get_warm_starts(y, problems, r, theta0, method, debug=False):
+    """Fit every problem on `y` to warm-start the fits of replicates drawn around it.
+
+    `y` is usually the expected a_ij (or the observed y) the replicates are
+    Poisson draws of. Returns theta of shape (P,5) with n0 divided by the total
+    of `y`; `fit_replicate` scales it back by the total of each replicate.
+    """
+    optimizer = Optimizer(tuple(y), r, theta0, method, debug=debug)
+    starts = np.array([optimizer.one(model, perm).theta for model, perm in problems])
+    starts[:, 0] /= sum(y)
+    return starts
+
+
+def get_start(starts, i, total):
+    """Initial theta of `i`-th problem for data with given `total` (see `get_warm_starts`)."""
+    if starts is None:
+        return None
+    return (starts[i, 0] * total,) + tuple(starts[i, 1:])
+
+
+def group_by_model(problems):
+    """Group consecutive problems of the same model.
+
+    >>> from hammlet.models import models_mapping
+    >>> problems = get_problems([models_mapping['T1'], models_mapping['PT']], "model")
+    >>> [(model.name, indices) for model, indices in group_by_model(problems)]
+    [('T1', [0, 1, 2, 3, 4, 5]), ('PT', [6, 7, 8, 9, 10, 11])]
+    """
+    return [
+        (model, [i for i, _ in group])
+        for model, group in itertools.groupby(
+            enumerate(problems), key=lambda item: item[1][0]
+        )
+    ]
+
+
+def get_candidates(y, problems, starts, r, top):
+    """Mark `top` permutations of every model to be always fitted on replicates.
+
+    Permutations are ranked by the likelihood of the reference fit `starts`
+    (see `get_warm_starts`) on the reference data `y`.
+    Returns a boolean mask of shape (P,).
+    """
+    total = float(sum(y))
+    LL = [
+        likelihood(model, morph10(tuple(y), perm), get_start(starts, i, total), r)
+        for i, (model, perm) in enumerate(problems)
+    ]
+    candidates = np.zeros(len(problems), dtype=bool)
+    for _, indices in group_by_model(problems):
+        indices = sorted(indices, key=lambda i: LL[i], reverse=True)
+        candidates[indices[:top]] = True
+    return candidates
+
+
+def fit_replicate(
+    y,
+    problems,
+    r,
+    theta0,
+    method,
+    starts=None,
+    candidates=None,
+    margin=PRUNE_MARGIN,
+    debug=False,
+):
+    """Fit every problem on a single replicate `y`.
+
+    With `candidates` (see `get_candidates`), only the candidate permutations
+    are fitted right away. Every other permutation is screened by its
+    likelihood at the theta of the best candidate of the same model and at its
+    own start; it is fitted only when the screened LL is within `margin` of
+    that best candidate, otherwise the screened LL and theta are reported.
+    """
+    optimizer = Optimizer(tuple(int(x) for x in y), r, theta0, method, debug=debug)
+    total = float(sum(optimizer.y))
+    LL = np.empty(len(problems))
+    theta = np.empty((len(problems), 5))
+    for i, (model, perm) in enumerate(problems):
+        if candidates is None or candidates[i]:
+            result = optimizer.one(model, perm, theta0=get_start(starts, i, total))
+            LL[i] = result.LL
+            theta[i] = result.theta
+    if candidates is not None:
+        for model, indices in group_by_model(problems):
+            leader = max((i for i in indices if candidates[i]), key=LL.__getitem__)
+            for i in indices:
+                if candidates[i]:
+                    continue
+                perm = problems[i][1]
+                y_ = morph10(optimizer.y, perm)
+                screens = [tuple(theta[leader])]
+                if starts is not None:
+                    screens.append(get_start(starts, i, total))
+                values = [likelihood(model, y_, theta_, r) for theta_ in screens]
+                j = int(np.argmax(values))
+                if values[j] >= LL[leader] - margin:
+                    result = optimizer.one(model, perm, theta0=screens[j])
+                    LL[i] = result.LL
+                    theta[i] = result.theta
+                else:
+                    LL[i] = values[j]
+                    theta[i] = screens[j]
+    return LL, theta
+
+
+class FitCache(object):
+    """Per-run cache of replicate fits keyed by the y tuple.
+
+    Small expected counts make Poisson replicates repeat exact y vectors,
+    which then are fitted only once. The cache must only be shared between
+    calls with the same problems (and starts). At most `max_size` fits are
+    stored; further ones are still deduplicated within a single call.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.fits = {}  # {y: (LL, theta)}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.fits)
+
+
+def fit_replicates(
+    ys,
+    problems,
+    r,
+    theta0,
+    method,
+    starts=None,
+    candidates=None,
+    cache=None,
+    jobs=1,
+    debug=False,
+):
+    """Fit every (model, permutation) problem on every replicate.
+
+    `ys` is an (R,10) array of replicate y values. Replicates are distributed
+    over `jobs` processes, each job fitting all problems of one replicate.
+    Fits start from `theta0`, or from per-problem `starts` (see
+    `get_warm_starts`) when given. With `candidates`, permutations are pruned
+    as described in `fit_replicate`.
+    Identical replicates are fitted once; pass a `FitCache` to also reuse fits
+    between calls and to count the hits.
+    Returns LL of shape (R,P) and theta of shape (R,P,5).
+
+    >>> from hammlet.models import models_mapping
+    >>> cache = FitCache()
+    >>> ys = [(9, 9, 9, 9, 9, 9, 9, 9, 9, 9)] * 2 + [(9, 9, 9, 9, 9, 9, 9, 9, 9, 8)]
+    >>> problems = [(models_mapping['P'], (1, 2, 3, 4))]
+    >>> LL, theta = fit_replicates(ys, problems, (1, 1, 1, 1), (50, .5, .5, .5, .5), "SLSQP", cache=cache)
+    >>> LL[0, 0] == LL[1, 0] != LL[2, 0]
+    True
+    >>> _ = fit_replicates(ys[:1], problems, (1, 1, 1, 1), (50, .5, .5, .5, .5), "SLSQP", cache=cache)
+    >>> cache.hits, cache.misses
+    (2, 2)
+    """
+    if cache is None:
+        cache = FitCache()
+    keys = [tuple(int(x) for x in y) for y in np.asarray(ys).reshape(-1, 10).tolist()]
+    fits = {key: cache.fits[key] for key in keys if key in cache.fits}
+    missing = [key for key in OrderedDict.fromkeys(keys) if key not in fits]
+    results = parallel_map(
+        partial(
+            fit_replicate,
+            problems=problems,
+            r=r,
+            theta0=theta0,
+            method=method,
+            starts=starts,
+            candidates=candidates,
+            debug=debug,
+        ),
+        missing,
+        jobs=jobs,
+    )
+    fits.update(zip(missing, results))
+    for key, fit in zip(missing, results):
+        if len(cache.fits) >= cache.max_size:
+            break
+        cache.fits[key] = fit
+    cache.hits += len(keys) - len(missing)
+    cache.misses += len(missing)
+    LL = np.empty((len(keys), len(problems)))
+    theta = np.empty((len(keys), len(problems), 5))
+    for i, key in enumerate(keys):
+        LL[i], theta[i] = fits[key]
+    return LL, theta
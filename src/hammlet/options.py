@@ -0,0 +1,554 @@
+import csv
+import sqlite3
+
+import click
+from tabulate import tabulate
+
+from .checkpoint import Checkpoint
+from .database import ResultsDB
+from .ecdf import EcdfCache, EcdfTable, NullDistribution, get_ecdf_key
+from .parallel import get_jobs, get_seed_sequence
+from .parsers import parse_floats, parse_models, presets_db
+from .printers import log_info, log_success, log_warn
+from .resultset import ResultSet
+from .selection import LevelTester, format_result, get_bootstrap_times, result_fields
+
+__all__ = [
+    "selection_options",
+    "ecdf_options",
+    "get_tester",
+    "save_samples",
+    "save_result",
+    "get_params",
+    "save_db",
+    "open_checkpoint",
+    "open_output",
+    "echo_summary",
+]
+
+
+def _apply(options, f):
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def selection_options(f):
+    """Add input, output and fitting options of the stat commands."""
+    options = [
+        click.option(
+            "--preset",
+            type=click.Choice(presets_db),
+            metavar="<preset>",
+            help="Data preset ({})".format("/".join(presets_db.keys())),
+            hidden=True,
+        ),
+        click.option(
+            "-y",
+            nargs=10,
+            type=int,
+            metavar="<int...>",
+            help="Space-separated list of "
+            + click.style("ten", bold=True)
+            + " y values (y11 y12 y13 y14 y22 y23 y24 y33 y34 y44)",
+        ),
+        click.option(
+            "-r",
+            nargs=4,
+            type=float,
+            metavar="<float...>",
+            default=(1, 1, 1, 1),
+            show_default=True,
+            help="Space-separated list of "
+            + click.style("four", bold=True)
+            + " r values",
+        ),
+        click.option(
+            "-x",
+            "--exclude",
+            "excluded_models",
+            multiple=True,
+            metavar="<name...|all>",
+            required=False,
+            callback=parse_models,
+            help="Comma-separated list of models to exclude",
+        ),
+        click.option(
+            "--output-mle",
+            "output_filename_mle",
+            type=click.Path(writable=True),
+            metavar="<path>",
+            help="Output file with MLE results table",
+        ),
+        click.option(
+            "--output-result",
+            "output_filename_result",
+            type=click.Path(writable=True),
+            metavar="<path>",
+            help="Output file with result (with several -p, a line per p-value ending with it)",
+        ),
+        click.option(
+            "--db",
+            "db_filename",
+            type=click.Path(dir_okay=False, writable=True),
+            metavar="<path>",
+            help="Add fits, results and bootstrap samples to this SQLite database (see query)",
+        ),
+        click.option(
+            "-p",
+            "--pvalue",
+            "critical_pvalues",
+            metavar="<float,...>",
+            callback=parse_floats,
+            default="0.05",
+            show_default=True,
+            help="Comma-separated list of p-values for statistical tests",
+        ),
+        click.option(
+            "--method",
+            type=click.Choice(["SLSQP", "L-BFGS-B", "TNC"]),
+            default="SLSQP",
+            show_default=True,
+            help="Optimization method",
+        ),
+        click.option(
+            "--theta0",
+            nargs=5,
+            type=float,
+            metavar="<n0 T1 T3 g1 g3>",
+            help="Space-separated list of "
+            + click.style("five", bold=True)
+            + " initial theta components",
+        ),
+    ]
+    return _apply(options, f)
+
+
+def ecdf_options(*ecdfs_options):
+    """Add options of the ECDF criterion of the stat commands.
+
+    `ecdfs_options` (precomputed critical values, which differ by command)
+    go right after `--ecdf`. The values of all these options are passed on
+    to `get_tester`.
+    """
+    options = [
+        click.option(
+            "--null",
+            type=click.Choice(["chi2", "ecdf", "chibar"]),
+            help="Null distribution of 2*delta LL: chi2 (default), ecdf (same as --ecdf) or asymptotic chi-bar-square mixture at the parameter boundary (chibar, simulated without bootstrap fits)",
+        ),
+        click.option(
+            "--ecdf",
+            is_flag=True,
+            help="Use ecdf criterion",
+        ),
+    ]
+    options += list(ecdfs_options)
+    options += [
+        click.option(
+            "--ecdf-table",
+            "ecdf_table_filename",
+            type=click.Path(exists=True, dir_okay=False),
+            metavar="<path>",
+            help="[ecdf] Interpolate critical values from table precomputed by ecdf-table",
+        ),
+        click.option(
+            "-n",
+            "--times",
+            "bootstrap_times",
+            type=click.IntRange(min=1),
+            metavar="<int>",
+            help="[ecdf] Number of bootstrap samples",
+        ),
+        click.option(
+            "--use-best-senior-model",
+            is_flag=True,
+            help="[ecdf] Optimize only the best senior model during bootstrap in ecdf",
+        ),
+        click.option(
+            "--sequential",
+            is_flag=True,
+            help="[ecdf] Stop bootstrapping as soon as the decision is statistically settled",
+        ),
+        click.option(
+            "--sequential-confidence",
+            type=click.FloatRange(0, 1, min_open=True, max_open=True),
+            metavar="<float>",
+            default=0.99,
+            show_default=True,
+            help="[ecdf] Probability that the sequential decision agrees with the one for the exact bootstrap p-value (over all looks at the sample)",
+        ),
+        click.option(
+            "--control-variate",
+            is_flag=True,
+            help="[ecdf] Post-stratify bootstrap replicates by their asymptotic chi-bar-square statistic (a control variate which needs no fits) for more precise critical values",
+        ),
+        click.option(
+            "--ecdf-cache",
+            "ecdf_cache_dir",
+            type=click.Path(file_okay=False, writable=True),
+            metavar="<path>",
+            envvar="HAMMLET_ECDF_CACHE",
+            help="[ecdf] Directory with persistent cache of bootstrap samples",
+        ),
+        click.option(
+            "--output-ecdf",
+            "output_filename_ecdf",
+            type=click.Path(writable=True),
+            metavar="<path>",
+            help="[ecdf] Output .npz file (numpy.savez) with a sorted array of bootstrap samples per level pair, keyed as N4-N3",
+        ),
+        click.option(
+            "-j",
+            "--jobs",
+            type=click.IntRange(min=0),
+            metavar="<int>",
+            default=1,
+            show_default=True,
+            help="[ecdf] Number of parallel jobs (0 means all CPUs)",
+        ),
+        click.option(
+            "--seed",
+            type=int,
+            metavar="<int>",
+            help="[ecdf] Seed for bootstrap random number generator",
+        ),
+        click.option(
+            "--warm-start/--no-warm-start",
+            default=True,
+            show_default=True,
+            help="[ecdf] Start replicate fits from the fit on the expected a_ij (n0 rescaled to the replicate total); results may differ slightly from cold starts",
+        ),
+        click.option(
+            "--prune-perms",
+            "prune",
+            type=click.IntRange(min=1),
+            metavar="<int>",
+            help="[ecdf] Fully fit only this many best permutations of every model on each replicate, screen the others",
+        ),
+        click.option(
+            "--checkpoint",
+            "checkpoint_filename",
+            type=click.Path(dir_okay=False, writable=True),
+            metavar="<path>",
+            help="[ecdf] Append completed bootstrap replicates to this checkpoint file",
+        ),
+        click.option(
+            "--resume",
+            is_flag=True,
+            help="[ecdf] Continue the interrupted run recorded in --checkpoint",
+        ),
+        click.option(
+            "--checkpoint-every",
+            type=click.IntRange(min=1),
+            metavar="<int>",
+            default=100,
+            show_default=True,
+            help="[ecdf] Number of replicates per checkpoint chunk",
+        ),
+    ]
+
+    def decorator(f):
+        return _apply(options, f)
+
+    return decorator
+
+
+def check_ecdf_options(
+    ecdf,
+    ecdfs,
+    ecdf_table_filename,
+    bootstrap_times,
+    use_best_senior_model,
+    sequential,
+    control_variate,
+    output_filename_ecdf,
+    checkpoint_filename,
+    resume,
+):
+    """Raise BadParameter for combinations of ECDF options that make no sense."""
+    precomputed = ecdfs is not None or ecdf_table_filename
+    if ecdf_table_filename and (ecdfs is not None or use_best_senior_model):
+        raise click.BadParameter(
+            "option --ecdf-table can not be combined with --ecdfs or --use-best-senior-model",
+            param_hint="--ecdf-table",
+        )
+    if bootstrap_times and not ecdf:
+        raise click.BadParameter(
+            "bootstrap is only performed with --ecdf flag", param_hint="-n/--times"
+        )
+    if use_best_senior_model and not ecdf:
+        raise click.BadParameter(
+            "option --use-best-senior-model only makes sense with --ecdf flag",
+            param_hint="--use-best-senior-model",
+        )
+    if sequential and not ecdf:
+        raise click.BadParameter(
+            "option --sequential only makes sense with --ecdf flag",
+            param_hint="--sequential",
+        )
+    if control_variate and (not ecdf or precomputed):
+        raise click.BadParameter(
+            "bootstrap is only performed with --ecdf flag and without --ecdfs/--ecdf-table",
+            param_hint="--control-variate",
+        )
+    if output_filename_ecdf and (not ecdf or precomputed):
+        raise click.BadParameter(
+            "bootstrap samples are only computed with --ecdf flag and without --ecdfs/--ecdf-table",
+            param_hint="--output-ecdf",
+        )
+    if checkpoint_filename and (not ecdf or precomputed):
+        raise click.BadParameter(
+            "bootstrap is only performed with --ecdf flag and without --ecdfs/--ecdf-table",
+            param_hint="--checkpoint",
+        )
+    if resume and not checkpoint_filename:
+        raise click.BadParameter(
+            "option --resume requires --checkpoint", param_hint="--resume"
+        )
+
+
+def open_checkpoint(checkpoint_filename, params, seed, resume, every):
+    try:
+        checkpoint = Checkpoint(
+            checkpoint_filename, params, seed=seed, resume=resume, every=every
+        )
+    except ValueError as e:
+        raise click.ClickException("{}: {}".format(checkpoint_filename, e))
+    if resume:
+        log_info(
+            "Resuming from checkpoint <{}> with {} completed replicates".format(
+                checkpoint_filename, len(checkpoint)
+            )
+        )
+    return checkpoint
+
+
+def open_output(output_filename, headers):
+    """Open CSV output of bootstrap replicates with `headers`, return `(f, writer)`.
+
+    The file is not atomic, rows are flushed as soon as they are computed.
+    Returns `(None, None)` without `output_filename`.
+    """
+    if not output_filename:
+        return None, None
+    log_info("Writing bootstrap results to <{}>...".format(output_filename))
+    f = click.open_file(output_filename, "w")
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(headers)
+    return f, writer
+
+
+def echo_summary(summary):
+    """Print the table of a `RunningSummary` of bootstrap replicates."""
+    table = tabulate(
+        summary.to_data(),
+        headers=[click.style(s, bold=True) for s in summary.headers],
+        numalign="center",
+        stralign="center",
+        floatfmt=".3f",
+        tablefmt="simple",
+    )
+    log_success("Bootstrap results summary:")
+    click.echo(table)
+    if not summary.exact:
+        log_warn(
+            "Quantiles are estimated from a random sample of {} of {} replicates".format(
+                summary.max_values, len(summary)
+            )
+        )
+
+
+def get_tester(
+    command,
+    y,
+    r,
+    theta0,
+    method,
+    excluded_models,
+    critical_pvalues,
+    null,
+    ecdf,
+    ecdfs,
+    ecdf_table_filename,
+    bootstrap_times,
+    use_best_senior_model,
+    sequential,
+    sequential_confidence,
+    control_variate,
+    ecdf_cache_dir,
+    output_filename_ecdf,
+    jobs,
+    seed,
+    warm_start,
+    prune,
+    checkpoint_filename,
+    resume,
+    checkpoint_every,
+    debug=False,
+):
+    """Check options of the ECDF criterion of `command`, return its `LevelTester`.
+
+    Returns None without the ECDF criterion (chi2 critical values). Options of
+    the bootstrap (seed, cache, checkpoint) are only set up when critical
+    values are not precomputed (`ecdfs` or `ecdf_table_filename`). With
+    `null` chibar, critical values are simulated from the asymptotic
+    chi-bar-square mixture, which only takes the seed.
+    """
+    if ecdfs is not None or ecdf_table_filename or null == "ecdf":
+        ecdf = True
+    if ecdf and null in ("chi2", "chibar"):
+        raise click.BadParameter(
+            "option --null {} can not be combined with ecdf options".format(null),
+            param_hint="--null",
+        )
+    check_ecdf_options(
+        ecdf,
+        ecdfs,
+        ecdf_table_filename,
+        bootstrap_times,
+        use_best_senior_model,
+        sequential,
+        control_variate,
+        output_filename_ecdf,
+        checkpoint_filename,
+        resume,
+    )
+    if null == "chibar":
+        seed_sequence = get_seed_sequence(seed)
+        log_info("Seed: {}".format(seed_sequence.entropy))
+        return LevelTester(
+            r, theta0, method, chibar=True, seed_sequence=seed_sequence, debug=debug
+        )
+    if not ecdf:
+        return None
+    rep = get_bootstrap_times(critical_pvalues, bootstrap_times)
+
+    ecdf_table = None
+    if ecdf_table_filename:
+        log_info("Loading ECDF table from <{}>...".format(ecdf_table_filename))
+        ecdf_table = EcdfTable.load(ecdf_table_filename)
+        try:
+            ecdf_table.check_excluded(excluded_models)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="-x/--exclude")
+
+    seed_sequence = checkpoint = ecdf_cache = None
+    if ecdfs is None and ecdf_table is None:
+        if checkpoint_filename:
+            params = {
+                "command": command,
+                "y": list(map(int, y)),
+                "r": r,
+                "excluded": sorted(model.name for model in excluded_models),
+                "method": method,
+                "theta0": theta0,
+                "use_best_senior_model": use_best_senior_model,
+                "warm_start": warm_start,
+                "prune": prune,
+            }
+            checkpoint = open_checkpoint(
+                checkpoint_filename, params, seed, resume, checkpoint_every
+            )
+            seed = checkpoint.seed
+        seed_sequence = get_seed_sequence(seed)
+        jobs = get_jobs(jobs)
+        log_info("Seed: {}".format(seed_sequence.entropy))
+        if ecdf_cache_dir:
+            ecdf_cache = EcdfCache(ecdf_cache_dir)
+            log_info("Using ECDF cache at <{}>".format(ecdf_cache_dir))
+
+    return LevelTester(
+        r,
+        theta0,
+        method,
+        ecdfs=ecdfs,
+        ecdf_table=ecdf_table,
+        rep=rep,
+        use_best_senior_model=use_best_senior_model,
+        sequential=sequential,
+        sequential_confidence=sequential_confidence,
+        seed_sequence=seed_sequence,
+        warm_start=warm_start,
+        prune=prune,
+        ecdf_cache=ecdf_cache,
+        checkpoint=checkpoint,
+        control_variate=control_variate,
+        jobs=jobs,
+        debug=debug,
+    )
+
+
+def save_samples(tester, output_filename_ecdf):
+    """Write bootstrap samples of `tester` (if any) to `output_filename_ecdf`."""
+    if output_filename_ecdf and tester.nulls:
+        log_info("Writing bootstrap samples to <{}>...".format(output_filename_ecdf))
+        with click.open_file(output_filename_ecdf, "wb", atomic=True) as f:
+            tester.save_samples(f)
+
+
+def save_result(output_filename_result, results, several=False):
+    """Write final `results` [(critical p-value, procedure, function returning fields)].
+
+    Lines are only formatted here, as they need fits of levels (e.g. N0)
+    which the selection itself may never reach. With `several` p-values, the
+    critical p-value is appended to every line as the last column.
+    """
+    if not output_filename_result:
+        return
+    log_info("Writing result to <{}>...".format(output_filename_result))
+    with click.open_file(output_filename_result, "w", atomic=True) as f:
+        for critical_pvalue, procedure, get_fields in results:
+            line = format_result(procedure, get_fields())
+            if several:
+                line += ",{}".format(critical_pvalue)
+            f.write(line + "\n")
+
+
+def get_params(y, r, theta0, method, excluded_models, critical_pvalues):
+    """Parameters of a run of a stat command, as recorded by `save_db`."""
+    return dict(
+        y=list(map(int, y)),
+        r=list(r),
+        method=method,
+        theta0=list(theta0),
+        pvalues=list(critical_pvalues),
+        excluded=sorted(model.name for model in excluded_models),
+    )
+
+
+def save_db(db_filename, command, params, quartet, fits, results, tester=None):
+    """Add a run of `command` on one quartet to the results database.
+
+    The run has all fits of the levels the selection has reached, final
+    `results` (see `save_result`) as decisions and bootstrap samples of
+    `tester` (if any) as ECDFs, keyed as in `EcdfCache`.
+    """
+    if not db_filename:
+        return
+    log_info("Adding results to database <{}>...".format(db_filename))
+    # Note: fields may fit more levels (e.g. N0), so compute them before the fits
+    rows = [
+        [quartet, procedure] + get_fields() + [critical_pvalue]
+        for critical_pvalue, procedure, get_fields in results
+    ]
+    nulls = [null for _, null in tester.nulls.values()] if tester is not None else []
+    try:
+        db = ResultsDB(db_filename)
+        try:
+            run = db.add_run(command, params)
+            results = ResultSet.concatenate(fits.results_by_level.values())
+            db.add_fits(run, quartet, results)
+            db.add_decisions(
+                run, ["id", "Procedure"] + result_fields + ["pvalue"], rows
+            )
+            for null in nulls:
+                # Note: chi-bar-square samples are simulated, not bootstrapped
+                if isinstance(null, NullDistribution) and len(null):
+                    key = get_ecdf_key(null)
+                    db.add_ecdf(EcdfCache.get_digest(key), key, null.sorted())
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        raise click.ClickException("{}: {}".format(db_filename, e))
+    log_info("Added run {} to <{}>".format(run, db_filename))
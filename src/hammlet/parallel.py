@@ -0,0 +1,130 @@
+import itertools
+import multiprocessing
+from collections import deque
+from contextlib import closing
+
+import numpy as np
+
+__all__ = [
+    "get_seed_sequence",
+    "replicate_seed",
+    "replicate_rng",
+    "get_jobs",
+    "parallel_map",
+    "parallel_imap",
+]
+
+
+def get_seed_sequence(seed=None):
+    """Return root `SeedSequence` (fresh OS entropy when `seed` is None).
+
+    >>> get_seed_sequence(42).entropy
+    42
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def replicate_seed(seed_sequence, *index):
+    """Return child `SeedSequence` of the replicate with given `index`.
+
+    Equivalent to `seed_sequence.spawn(n)[i]`, but does not depend on how many
+    children were already spawned, so every replicate gets the same stream no
+    matter how replicates are distributed across workers.
+
+    >>> root = np.random.SeedSequence(42)
+    >>> replicate_seed(root, 3).generate_state(2).tolist() == root.spawn(4)[3].generate_state(2).tolist()
+    True
+    >>> replicate_seed(root, 1, 2).spawn_key
+    (1, 2)
+    """
+    return np.random.SeedSequence(
+        seed_sequence.entropy,
+        spawn_key=tuple(seed_sequence.spawn_key) + tuple(index),
+        pool_size=seed_sequence.pool_size,
+    )
+
+
+def replicate_rng(seed_sequence, *index):
+    """Return `Generator` of the replicate with given `index`.
+
+    >>> root = np.random.SeedSequence(42)
+    >>> replicate_rng(root, 5).poisson(10) == replicate_rng(root, 5).poisson(10)
+    True
+    """
+    return np.random.default_rng(replicate_seed(seed_sequence, *index))
+
+
+def get_jobs(jobs):
+    """Resolve number of worker processes (0 or None means all CPUs).
+
+    >>> get_jobs(3)
+    3
+    >>> get_jobs(0) == multiprocessing.cpu_count()
+    True
+    """
+    if not jobs:
+        return multiprocessing.cpu_count()
+    if jobs < 0:
+        raise ValueError("Number of jobs must be non-negative")
+    return jobs
+
+
+def parallel_map(func, items, jobs=1, chunksize=None):
+    """Ordered `map` over a process pool (plain `map` when `jobs` is 1).
+
+    `func` must be picklable, i.e. a module-level function or a `partial` of it.
+
+    >>> parallel_map(abs, [-1, 2, -3])
+    [1, 2, 3]
+    >>> parallel_map(abs, [-1, 2, -3], jobs=2)
+    [1, 2, 3]
+    """
+    jobs = get_jobs(jobs)
+    if jobs == 1:
+        return list(map(func, items))
+    items = list(items)
+    if chunksize is None:
+        chunksize = max(1, len(items) // (4 * jobs))
+    with closing(multiprocessing.Pool(jobs)) as pool:
+        return pool.map(func, items, chunksize=chunksize)
+
+
+def _map_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def parallel_imap(func, items, jobs=1, chunksize=1, prefetch=4):
+    """Ordered lazy `map` over a process pool, for long streams of `items`.
+
+    Results are yielded as soon as they (and all previous ones) are ready.
+    Items are submitted in chunks of `chunksize`, with at most `prefetch`
+    chunks per job ahead of the yielded results, so only a bounded number of
+    `items` and results is kept in memory, however long the stream is.
+
+    >>> list(parallel_imap(abs, iter([-1, 2, -3]), jobs=2))
+    [1, 2, 3]
+    >>> items = iter(range(-1000, 0))
+    >>> results = parallel_imap(abs, items, jobs=2, chunksize=3, prefetch=2)
+    >>> next(results), len(list(items))  # 2*2 chunks of 3 items were submitted
+    (1000, 988)
+    """
+    jobs = get_jobs(jobs)
+    if jobs == 1:
+        for item in items:
+            yield func(item)
+        return
+    items = iter(items)
+    pending = deque()
+    with closing(multiprocessing.Pool(jobs)) as pool:
+        while True:
+            while len(pending) < prefetch * jobs:
+                chunk = list(itertools.islice(items, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.apply_async(_map_chunk, (func, chunk)))
+            if not pending:
+                return
+            for result in pending.popleft().get():
+                yield result
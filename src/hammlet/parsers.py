@@ -230,3 +230,11 @@ def parse_ecdfs(ctx, param, value):
         if len(ecdfs) != 4:
             raise click.BadParameter("must be exactly 4 values")
         return ecdfs
+
+
+def parse_floats(ctx, param, value):
+    if value:
+        try:
+            return [float(x.strip()) for x in re.split(r"[,;]", value)]
+        except ValueError:
+            raise click.BadParameter("must be a comma-separated list of numbers")
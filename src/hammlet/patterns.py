@@ -0,0 +1,174 @@
+import gzip
+import os
+import sys
+
+import numpy as np
+
+from .utils import pattern2ij
+
+__all__ = [
+    "get_pattern_columns",
+    "pattern_columns",
+    "iter_chunks",
+    "count_patterns",
+    "patterns_to_y",
+    "read_patterns_y",
+]
+
+
+def get_pattern_columns():
+    """Map codes of +/- patterns to indices in y (-1 for uninformative ones).
+
+    Bit k of a code is set when species k+1 is absent (`-`).
+
+    >>> get_pattern_columns().tolist()
+    [-1, 0, 4, 1, 7, 2, 5, -1, 9, 3, 6, -1, 8, -1, -1, -1]
+    """
+    pairs = [(i, j) for i in range(1, 5) for j in range(i, 5)]
+    columns = np.full(16, -1, dtype=np.int64)
+    for code in range(16):
+        if bin(code).count("1") in (1, 2):
+            pattern = "".join("-" if code >> k & 1 else "+" for k in range(4))
+            columns[code] = pairs.index(pattern2ij(pattern))
+    return columns
+
+
+pattern_columns = get_pattern_columns()
+
+_PLUS, _MINUS, _NEWLINE = ord("+"), ord("-"), ord("\n")
+_ALLOWED = np.zeros(256, dtype=bool)
+_ALLOWED[[_PLUS, _MINUS, _NEWLINE, ord(" "), ord("\t"), ord("\r")]] = True
+
+
+def _iter_blocks(filename, chunk_size):
+    if filename == "-":
+        stream = getattr(sys.stdin, "buffer", sys.stdin)
+        for block in iter(lambda: stream.read(chunk_size), b""):
+            yield np.frombuffer(block, dtype=np.uint8)
+    elif filename.endswith(".gz"):
+        with gzip.open(filename, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                yield np.frombuffer(block, dtype=np.uint8)
+    elif os.path.getsize(filename):
+        data = np.memmap(filename, dtype=np.uint8, mode="r")
+        for start in range(0, len(data), chunk_size):
+            yield data[start : start + chunk_size]
+
+
+def iter_chunks(filename, chunk_size=2**24):
+    """Yield chunks (uint8 arrays) of a file, each ending at a line end.
+
+    Plain files are memory-mapped, gzipped files (`.gz`) and `-` (stdin) are
+    decompressed or read in blocks of `chunk_size` bytes.
+    """
+    rest = np.zeros(0, dtype=np.uint8)
+    for block in _iter_blocks(filename, chunk_size):
+        newlines = np.flatnonzero(block == _NEWLINE)
+        if not len(newlines):
+            rest = np.concatenate([rest, block])
+            continue
+        end = newlines[-1] + 1
+        yield np.concatenate([rest, block[:end]]) if len(rest) else block[:end]
+        rest = np.array(block[end:])
+    if len(rest):
+        yield np.concatenate([rest, [_NEWLINE]]).astype(np.uint8)
+
+
+def _get_codes_fixed(chunk):
+    """Codes of patterns when all lines of `chunk` are laid out as the first one."""
+    width = np.flatnonzero(chunk == _NEWLINE)[0] + 1
+    if len(chunk) % width:
+        return None
+    lines = chunk.reshape(-1, width)
+    template = lines[0]
+    columns = np.flatnonzero((template == _PLUS) | (template == _MINUS))
+    others = np.setdiff1d(np.arange(width), columns)
+    if len(columns) != 4 or not _ALLOWED[template].all():
+        return None
+    if not (lines[:, others] == template[others]).all():
+        return None
+    symbols = lines[:, columns]
+    absent = symbols == _MINUS
+    if not (absent | (symbols == _PLUS)).all():
+        return None
+    return absent[:, 0] | absent[:, 1] << 1 | absent[:, 2] << 2 | absent[:, 3] << 3
+
+
+def _get_codes(chunk, lines_before):
+    """Codes of patterns in `chunk` of lines with any whitespace, blank lines."""
+    bad = np.flatnonzero(~_ALLOWED[chunk])
+    if len(bad):
+        line = lines_before + np.count_nonzero(chunk[: bad[0]] == _NEWLINE) + 1
+        raise ValueError("line {}: expected +/- symbols".format(line))
+    symbols = chunk[(chunk == _PLUS) | (chunk == _MINUS) | (chunk == _NEWLINE)]
+    newlines = np.flatnonzero(symbols == _NEWLINE)
+    lengths = np.diff(newlines, prepend=-1) - 1
+    wrong = np.flatnonzero((lengths != 0) & (lengths != 4))
+    if len(wrong):
+        line = lines_before + wrong[0] + 1
+        raise ValueError(
+            "line {}: expected 4 symbols, got {}".format(line, lengths[wrong[0]])
+        )
+    absent = symbols[symbols != _NEWLINE].reshape(-1, 4) == _MINUS
+    return absent[:, 0] | absent[:, 1] << 1 | absent[:, 2] << 2 | absent[:, 3] << 3
+
+
+def count_patterns(chunks):
+    """Count loci of each of 16 +/- patterns in the chunks of a pattern file.
+
+    Every line has four `+` (present) or `-` (absent) symbols, optionally
+    separated by whitespace. The first line may be a header with species
+    names. Blank lines are skipped. Returns `(counts, names)`, where
+    `counts[code]` is the number of loci with the pattern `code` (bit k is
+    set when species k+1 is absent).
+
+    Chunks where all lines have the same layout are counted by columns of
+    the reshaped chunk, others symbol by symbol.
+
+    >>> chunk = np.frombuffer(b"A B C D\\n+ - - +\\n+--+\\n\\n- + + +\\n", dtype=np.uint8)
+    >>> counts, names = count_patterns([chunk])
+    >>> names, counts[6], counts[1], counts.sum()
+    (['A', 'B', 'C', 'D'], 2, 1, 3)
+    """
+    counts = np.zeros(16, dtype=np.int64)
+    names = None
+    lines_before = 0
+    for number, chunk in enumerate(chunks):
+        if number == 0:
+            first = np.flatnonzero(chunk == _NEWLINE)[0] + 1
+            if not _ALLOWED[chunk[:first]].all():
+                names = bytes(chunk[:first]).decode().split()
+                chunk = chunk[first:]
+                lines_before = 1
+            if not len(chunk):
+                continue
+        codes = _get_codes_fixed(chunk)
+        if codes is None:
+            codes = _get_codes(chunk, lines_before)
+        counts += np.bincount(codes, minlength=16)
+        lines_before += np.count_nonzero(chunk == _NEWLINE)
+    return counts, names
+
+
+def patterns_to_y(counts):
+    """Sum pattern counts into y11, y12, ..., y44.
+
+    Patterns with zero, three or four absent species are not informative.
+
+    >>> counts = np.zeros(16, dtype=int)
+    >>> counts[[1, 6, 8, 15]] = [5, 2, 3, 7]  # -+++, +--+, +++-, ----
+    >>> patterns_to_y(counts)
+    (5, 0, 0, 0, 0, 2, 0, 0, 0, 3)
+    """
+    mask = pattern_columns >= 0
+    y = np.bincount(pattern_columns[mask], weights=counts[mask], minlength=10)
+    return tuple(int(x) for x in y)
+
+
+def read_patterns_y(filename, chunk_size=2**24):
+    """Aggregate a per-locus pattern file into `(y, names, counts)` in one pass.
+
+    Memory is bounded by `chunk_size` regardless of the file size.
+    """
+    counts, names = count_patterns(iter_chunks(filename, chunk_size))
+    return patterns_to_y(counts), names, counts
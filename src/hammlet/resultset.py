@@ -0,0 +1,241 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from .models import all_models, models_nrds
+from .optimizer import OptimizationResult
+
+__all__ = ["ResultSet", "pack_permutation", "unpack_permutation"]
+
+levels = ["N0", "N1", "N2", "N3", "N4"]
+
+# Note: model id is the index of the model in `all_models`
+model_ids = {model.name: i for i, model in enumerate(all_models)}
+model_names = np.array([model.name for model in all_models], dtype=object)
+model_mnemonic_names = np.array(
+    [model.mnemonic_name for model in all_models], dtype=object
+)
+model_levels = np.full(len(all_models), -1, dtype=np.int8)
+for _i, _level in enumerate(levels):
+    for _model in models_nrds[_level]:
+        model_levels[model_ids[_model.name]] = _i
+del _i, _level, _model
+
+result_dtype = np.dtype(
+    [
+        ("model", np.int16),
+        ("perm", np.uint8),
+        ("LL", np.float64),
+        ("n0", np.float64),
+        ("T1", np.float64),
+        ("T3", np.float64),
+        ("g1", np.float64),
+        ("g3", np.float64),
+    ]
+)
+theta_fields = ["n0", "T1", "T3", "g1", "g3"]
+
+
+def pack_permutation(perm):
+    """Pack permutation of (1,2,3,4) into a single byte (2 bits per element).
+
+    >>> pack_permutation((1, 2, 3, 4))
+    27
+    >>> pack_permutation((4, 3, 2, 1))
+    228
+    >>> pack_permutation(np.array([[1, 2, 3, 4], [2, 1, 3, 4]])).tolist()
+    [27, 75]
+    """
+    p = np.asarray(perm, dtype=np.uint8) - 1
+    packed = (p[..., 0] << 6) | (p[..., 1] << 4) | (p[..., 2] << 2) | p[..., 3]
+    if packed.ndim == 0:
+        return int(packed)
+    return packed.astype(np.uint8)
+
+
+def unpack_permutation(packed):
+    """Unpack permutation(s) packed by `pack_permutation`.
+
+    >>> unpack_permutation(27)
+    (1, 2, 3, 4)
+    >>> unpack_permutation(np.array([228, 75], dtype=np.uint8)).tolist()
+    [[4, 3, 2, 1], [2, 1, 3, 4]]
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+    perm = ((packed[..., np.newaxis] >> shifts) & 3) + 1
+    if perm.ndim == 1:
+        return tuple(int(x) for x in perm)
+    return perm
+
+
+# Note: "1234" strings of all packed permutations
+perm_names = np.array(
+    ["".join(map(str, unpack_permutation(packed))) for packed in range(256)],
+    dtype=object,
+)
+# Note: level names by `ResultSet.levels` index ("" for models without level)
+level_names = np.array(levels + [""], dtype=object)
+
+
+class ResultSet(object):
+    """Columnar container of optimization results.
+
+    Backed by a structured numpy array with `result_dtype` fields: int model id
+    (index in `all_models`), packed permutation, LL and five theta columns.
+
+    >>> from hammlet.models import models_mapping
+    >>> rs = ResultSet.from_results([
+    ...     OptimizationResult(models_mapping['2H1'], (1, 2, 3, 4), -10.0, (1, 2, 3, 0.5, 0.5)),
+    ...     OptimizationResult(models_mapping['P'], (1, 2, 3, 4), -30.0, (1, 0, 0, 0.5, 0.5)),
+    ...     OptimizationResult(models_mapping['2H1'], (2, 1, 3, 4), -5.0, (1, 2, 3, 0.1, 0.9)),
+    ... ])
+    >>> len(rs)
+    3
+    >>> [(r.model.name, r.permutation, r.LL) for r in rs.sorted()]
+    [('2H1', (2, 1, 3, 4), -5.0), ('2H1', (1, 2, 3, 4), -10.0), ('P', (1, 2, 3, 4), -30.0)]
+    >>> rs.best().permutation
+    (2, 1, 3, 4)
+    >>> [r.LL for r in rs.top(2)]
+    [-5.0, -10.0]
+    >>> [(m.name, len(g)) for m, g in rs.group_by_model().items()]
+    [('2H1', 2), ('P', 1)]
+    >>> [(level, len(g)) for level, g in rs.group_by_level().items()]
+    [('N4', 2), ('N0', 1)]
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data=None):
+        if data is None:
+            data = np.empty(0, dtype=result_dtype)
+        self.data = data
+
+    @classmethod
+    def from_results(cls, results):
+        results = list(results)
+        data = np.empty(len(results), dtype=result_dtype)
+        if results:
+            data["model"] = [model_ids[result.model.name] for result in results]
+            data["perm"] = pack_permutation([result.permutation for result in results])
+            data["LL"] = [result.LL for result in results]
+            theta = np.array([result.theta for result in results], dtype=np.float64)
+            for i, field in enumerate(theta_fields):
+                data[field] = theta[:, i]
+        return cls(data)
+
+    @classmethod
+    def from_arrays(cls, models, perms, LL, theta):
+        """Build from model ids (or models), (n,4) permutations, LL and (n,5) theta."""
+        models = [model_ids[m.name] if hasattr(m, "name") else int(m) for m in models]
+        data = np.empty(len(models), dtype=result_dtype)
+        data["model"] = models
+        data["perm"] = pack_permutation(np.asarray(perms).reshape(-1, 4))
+        data["LL"] = LL
+        theta = np.asarray(theta, dtype=np.float64).reshape(-1, 5)
+        for i, field in enumerate(theta_fields):
+            data[field] = theta[:, i]
+        return cls(data)
+
+    @classmethod
+    def concatenate(cls, resultsets):
+        resultsets = list(resultsets)
+        if not resultsets:
+            return cls()
+        return cls(np.concatenate([rs.data for rs in resultsets]))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self._result(self.data[index])
+        return self.__class__(self.data[index])
+
+    def __iter__(self):
+        for row in self.data:
+            yield self._result(row)
+
+    @staticmethod
+    def _result(row):
+        return OptimizationResult(
+            all_models[row["model"]],
+            unpack_permutation(row["perm"]),
+            float(row["LL"]),
+            tuple(float(row[field]) for field in theta_fields),
+        )
+
+    @property
+    def LL(self):
+        return self.data["LL"]
+
+    @property
+    def theta(self):
+        return np.column_stack([self.data[field] for field in theta_fields])
+
+    @property
+    def permutations(self):
+        return unpack_permutation(self.data["perm"]).reshape(-1, 4)
+
+    @property
+    def levels(self):
+        """Level index (0..4 for N0..N4, -1 for models without level) per row."""
+        return model_levels[self.data["model"]]
+
+    def sorted(self, reverse=True):
+        """Return results sorted by LL (descending by default), stable."""
+        key = -self.data["LL"] if reverse else self.data["LL"]
+        return self.__class__(self.data[np.argsort(key, kind="stable")])
+
+    def top(self, k):
+        """Return `k` best (by LL) results, sorted."""
+        if k >= len(self):
+            return self.sorted()
+        LL = self.data["LL"]
+        index = np.argpartition(-LL, k - 1)[:k]
+        index = index[np.argsort(-LL[index], kind="stable")]
+        return self.__class__(self.data[index])
+
+    def best(self):
+        if not len(self):
+            raise ValueError("best() of empty ResultSet")
+        return self[int(np.argmax(self.data["LL"]))]
+
+    def _group_by(self, keys):
+        # Note: groups are ordered by first appearance
+        unique, first, inverse, counts = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+        order = np.argsort(inverse.ravel(), kind="stable")
+        chunks = np.split(self.data[order], np.cumsum(counts)[:-1])
+        groups = OrderedDict()
+        for u in np.argsort(first, kind="stable"):
+            groups[int(unique[u])] = self.__class__(chunks[u])
+        return groups
+
+    def group_by_model(self):
+        return OrderedDict(
+            (all_models[model_id], rs)
+            for model_id, rs in self._group_by(self.data["model"]).items()
+        )
+
+    def group_by_level(self):
+        return OrderedDict(
+            (levels[level] if level >= 0 else None, rs)
+            for level, rs in self._group_by(self.levels).items()
+        )
+
+    def to_data(self):
+        """Return `(headers, data)` in the same layout as `results_to_data`."""
+        model_id = self.data["model"]
+        columns = [
+            model_names[model_id].tolist(),
+            model_mnemonic_names[model_id].tolist(),
+            ["".join(map(str, p)) for p in self.permutations.tolist()],
+            self.data["LL"].tolist(),
+        ] + [self.data[field].tolist() for field in theta_fields]
+        headers = ("Model", "Mnemo", "Perm", "LL", "n0", "T1", "T3", "g1", "g3")
+        return headers, list(zip(*columns))
+
+    def __repr__(self):
+        return "{}(<{} results>)".format(self.__class__.__name__, len(self))
@@ -0,0 +1,199 @@
+import json
+import os
+
+import numpy as np
+
+from .models import all_models
+from .resultset import ResultSet, result_dtype
+
+__all__ = ["store_columns", "ResultStoreWriter", "ResultStore"]
+
+# Note: every column is a separate `<name>.npy`, quartet ids are in `ids.txt`
+store_columns = ["quartet"] + list(result_dtype.names)
+store_dtypes = {name: result_dtype.fields[name][0] for name in result_dtype.names}
+store_dtypes["quartet"] = np.dtype(np.int64)
+store_files = [name + ".npy" for name in store_columns] + ["ids.txt", "meta.json"]
+STORE_FORMAT = 1
+HEADER_SIZE = 128
+
+
+def _write_npy_header(f, dtype, length):
+    """Write `.npy` (1.0) header of a 1-d array, padded to `HEADER_SIZE` bytes.
+
+    The fixed size allows to rewrite the header with the final length after
+    the data has been streamed.
+    """
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), length
+    )
+    prefix = np.lib.format.MAGIC_PREFIX + b"\x01\x00"
+    size = HEADER_SIZE - len(prefix) - 2
+    f.write(prefix)
+    f.write(np.array(size, dtype="<u2").tobytes())
+    f.write(header.ljust(size - 1).encode("latin1") + b"\n")
+
+
+def _remove_files(path):
+    """Remove files of a store (if any) from the directory `path`."""
+    for name in store_files:
+        filename = os.path.join(path, name)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+class ResultStoreWriter(object):
+    """Stream MLE results of many quartets into a directory of `.npy` columns.
+
+    Data is written to `<path>.tmp` and moved to `path` on `close`, so an
+    interrupted run leaves no partial store behind.
+
+    `path` must be missing, empty or a store (with `meta.json`), and
+    `<path>.tmp` must be missing or a leftover of an interrupted run. Only
+    the files of a store are ever removed, never other files of these
+    directories.
+    """
+
+    def __init__(self, path):
+        self.path = path.rstrip("/") or path
+        self.tmp_path = self.path + ".tmp"
+        if os.path.exists(self.path) and (
+            not os.path.isdir(self.path)
+            or os.listdir(self.path)
+            and not os.path.exists(os.path.join(self.path, "meta.json"))
+        ):
+            raise ValueError("path exists and is not a result store")
+        if os.path.exists(self.tmp_path):
+            if not os.path.isdir(self.tmp_path) or set(os.listdir(self.tmp_path)) - set(
+                store_files
+            ):
+                raise ValueError(
+                    "{} exists and is not an unfinished result store".format(
+                        self.tmp_path
+                    )
+                )
+            _remove_files(self.tmp_path)
+        else:
+            os.makedirs(self.tmp_path)
+        self.files = {}
+        for name in store_columns:
+            f = open(os.path.join(self.tmp_path, name + ".npy"), "wb")
+            _write_npy_header(f, store_dtypes[name], 0)
+            self.files[name] = f
+        self.f_ids = open(os.path.join(self.tmp_path, "ids.txt"), "w")
+        self.n_quartets = 0
+        self.n_rows = 0
+
+    def append(self, id_, results):
+        """Append all `results` (ResultSet) of the quartet `id_`."""
+        if "\n" in str(id_):
+            raise ValueError("quartet id must not contain newlines")
+        self.f_ids.write("{}\n".format(id_))
+        data = results.data
+        self.files["quartet"].write(
+            np.full(len(data), self.n_quartets, dtype=store_dtypes["quartet"]).tobytes()
+        )
+        for name in result_dtype.names:
+            self.files[name].write(np.ascontiguousarray(data[name]).tobytes())
+        self.n_quartets += 1
+        self.n_rows += len(data)
+
+    def close(self):
+        for name, f in self.files.items():
+            f.seek(0)
+            _write_npy_header(f, store_dtypes[name], self.n_rows)
+            f.close()
+        self.f_ids.close()
+        meta = {
+            "format": STORE_FORMAT,
+            "quartets": self.n_quartets,
+            "rows": self.n_rows,
+            "columns": store_columns,
+            "models": [model.name for model in all_models],
+        }
+        with open(os.path.join(self.tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        if not os.path.exists(self.path):
+            os.rename(self.tmp_path, self.path)
+            return
+        # Note: replace the files of the old store, keep anything else
+        _remove_files(self.path)
+        for name in store_files:
+            os.rename(os.path.join(self.tmp_path, name), os.path.join(self.path, name))
+        os.rmdir(self.tmp_path)
+
+    def abort(self):
+        for f in list(self.files.values()) + [self.f_ids]:
+            f.close()
+        _remove_files(self.tmp_path)
+        os.rmdir(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ResultStore(object):
+    """Read a store written by `ResultStoreWriter`, memory-mapping the columns.
+
+    >>> import tempfile
+    >>> from hammlet.models import models_mapping
+    >>> from hammlet.optimizer import OptimizationResult
+    >>> path = os.path.join(tempfile.mkdtemp(), "mle")
+    >>> results = ResultSet.from_results([
+    ...     OptimizationResult(models_mapping["PT"], (2, 1, 3, 4), -7.5, (9, 0, 1, 0.5, 1)),
+    ...     OptimizationResult(models_mapping["P"], (1, 2, 3, 4), -9.0, (9, 0, 0, 0.5, 0.5)),
+    ... ])
+    >>> with ResultStoreWriter(path) as writer:
+    ...     writer.append("q1", results)
+    ...     writer.append("q2", results[:1])
+    >>> store = ResultStore(path)
+    >>> store.ids, len(store), store["quartet"].tolist()
+    (['q1', 'q2'], 3, [0, 0, 1])
+    >>> [(r.model.name, r.permutation, r.LL) for r in store.results("q2")]
+    [('PT', (2, 1, 3, 4), -7.5)]
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["format"] != STORE_FORMAT:
+            raise ValueError("unsupported store format {}".format(self.meta["format"]))
+        if self.meta["models"] != [model.name for model in all_models]:
+            raise ValueError("store was written with another set of models")
+        with open(os.path.join(path, "ids.txt")) as f:
+            self.ids = f.read().split("\n")[:-1]
+        self.columns = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+            for name in self.meta["columns"]
+        }
+        quartet = self.columns["quartet"]
+        # Note: rows of every quartet are contiguous and in order of quartets
+        self.offsets = np.searchsorted(quartet, np.arange(len(self.ids) + 1))
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def resultset(self, start=0, stop=None):
+        """ResultSet of rows `start:stop` (copied from the mapped columns)."""
+        index = slice(start, stop)
+        data = np.empty(len(self.columns["LL"][index]), dtype=result_dtype)
+        for name in result_dtype.names:
+            data[name] = self.columns[name][index]
+        return ResultSet(data)
+
+    def results(self, id_or_index):
+        """ResultSet of a quartet given by its id or index."""
+        if isinstance(id_or_index, (int, np.integer)):
+            index = id_or_index
+        else:
+            index = self.ids.index(id_or_index)
+        return self.resultset(self.offsets[index], self.offsets[index + 1])
@@ -0,0 +1,126 @@
+import itertools
+
+import numpy as np
+from scipy.special import comb
+
+__all__ = [
+    "samplers",
+    "n_quartets",
+    "sample_uniform",
+    "sample_balanced",
+    "sample_focal",
+]
+
+samplers = ["uniform", "balanced", "focal"]
+
+
+def n_quartets(n, n_focal=0):
+    """Number of quartets of `n` species (with at least one of `n_focal` species).
+
+    >>> n_quartets(300), n_quartets(10, n_focal=1)
+    (330791175, 84)
+    """
+    total = comb(n, 4, exact=True)
+    if n_focal:
+        total -= comb(n - n_focal, 4, exact=True)
+    return total
+
+
+def _distinct(draw, total, budget):
+    """Yield distinct quartets from `draw()` until `budget` or `total` of them."""
+    seen = set()
+    while len(seen) < min(budget, total):
+        quartet = draw()
+        if quartet not in seen:
+            seen.add(quartet)
+            yield quartet
+
+
+def sample_uniform(n, budget, rng):
+    """Yield `budget` distinct quartets `a<b<c<d` of `n` species, uniformly.
+
+    Quartets are drawn lazily (with rejection of repeats), all of them are
+    only enumerated when `budget` covers all quartets.
+
+    >>> quartets = list(sample_uniform(300, 1000, np.random.default_rng(1)))
+    >>> len(quartets), len(set(quartets)), all(q == tuple(sorted(q)) for q in quartets)
+    (1000, 1000, True)
+    >>> len(list(sample_uniform(6, 100, np.random.default_rng(1))))
+    15
+    """
+    if budget >= n_quartets(n):
+        return itertools.combinations(range(n), 4)
+
+    def draw():
+        return tuple(sorted(rng.choice(n, 4, replace=False).tolist()))
+
+    return _distinct(draw, n_quartets(n), budget)
+
+
+def sample_balanced(n, coverage, budget, rng):
+    """Yield distinct quartets until every species is in `coverage` of them.
+
+    Species still below `coverage` are shuffled and split into quartets (the
+    last one is filled up with random other species), so every round covers
+    them once more. At most `budget` quartets are yielded.
+
+    >>> quartets = list(sample_balanced(30, 3, 10000, np.random.default_rng(1)))
+    >>> counts = np.bincount(np.ravel(quartets), minlength=30)
+    >>> counts.min() >= 3, len(quartets) <= 30 * 3 // 4 + 3
+    (True, True)
+    >>> len(list(sample_balanced(30, 3, 10, np.random.default_rng(1))))
+    10
+    """
+    # Note: a species is in at most C(n-1, 3) quartets
+    coverage = min(coverage, comb(n - 1, 3, exact=True))
+    counts = np.zeros(n, dtype=np.int64)
+    seen = set()
+    total = min(budget, n_quartets(n))
+    while len(seen) < total:
+        species = rng.permutation(np.flatnonzero(counts < coverage)).tolist()
+        if not species:
+            return
+        for start in range(0, len(species), 4):
+            group = species[start : start + 4]
+            if len(group) < 4:
+                others = np.setdiff1d(np.arange(n), group)
+                group += rng.choice(others, 4 - len(group), replace=False).tolist()
+            quartet = tuple(sorted(group))
+            if quartet in seen:
+                continue
+            seen.add(quartet)
+            counts[list(quartet)] += 1
+            yield quartet
+            if len(seen) >= total:
+                return
+
+
+def sample_focal(n, focal, budget, rng):
+    """Yield `budget` distinct quartets with at least one of the `focal` species.
+
+    Quartets are drawn uniformly for every focal species in turn (the focal
+    species and three random others).
+
+    >>> quartets = list(sample_focal(100, [7], 50, np.random.default_rng(1)))
+    >>> len(set(quartets)), all(7 in q for q in quartets)
+    (50, True)
+    >>> len(list(sample_focal(6, [0, 1], 100, np.random.default_rng(1))))
+    14
+    """
+    focal = sorted(set(focal))
+    total = n_quartets(n, n_focal=len(focal))
+    if budget >= total:
+        return (
+            quartet
+            for quartet in itertools.combinations(range(n), 4)
+            if set(quartet) & set(focal)
+        )
+    turns = itertools.cycle(focal)
+
+    def draw():
+        species = next(turns)
+        others = rng.choice(n - 1, 3, replace=False)
+        others[others >= species] += 1
+        return tuple(sorted([species] + others.tolist()))
+
+    return _distinct(draw, total, budget)
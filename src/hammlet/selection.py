@@ -0,0 +1,472 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from .chibar import ChiBarNull
+from .ecdf import NullDistribution
+from .printers import log_debug, log_info, log_success, log_warn
+from .resultset import ResultSet
+from .utils import get_pvalue
+
+__all__ = [
+    "get_bootstrap_times",
+    "LevelFits",
+    "LevelTester",
+    "select_forward",
+    "select_reverse",
+    "result_fields",
+    "get_forward_fields",
+    "get_reverse_fields",
+    "format_forward_result",
+    "format_reverse_result",
+]
+
+
+def get_bootstrap_times(critical_pvalues, bootstrap_times=None):
+    """Number of bootstrap samples sufficient for the smallest p-value."""
+    # Bootstrap samples are shared by all p-values, so size them for the smallest one
+    critical_pvalue_min = min(critical_pvalues)
+    if bootstrap_times:
+        rep = bootstrap_times
+    else:
+        if 0.1 <= critical_pvalue_min:
+            rep = 100
+        elif 0.01 <= critical_pvalue_min < 0.1:
+            rep = 1000
+        else:
+            log_warn("Are you crazy? p={} is too small!".format(critical_pvalue_min))
+            rep = 2000
+        # elif 0.001 <= critical_pvalue < 0.01:
+        #     rep = 10000
+        # elif 0.0001 <= critical_pvalue < 0.001:
+        #     rep = 100000
+        # else:
+        #     rep = 1000000
+    log_info(
+        "Going to use {} bootstrap samples for p={}".format(rep, critical_pvalue_min)
+    )
+    return rep
+
+
+class LevelFits(object):
+    """Fits of all models of every level, computed on first access.
+
+    Selection procedures often stop after a couple of comparisons, so the
+    levels they never reach are never fitted. Indexing by level returns the
+    best result, `results(level)` returns all of them (sorted by LL).
+    """
+
+    def __init__(self, optimizer, models_by_level, debug=False):
+        self.optimizer = optimizer
+        self.models_by_level = models_by_level
+        self.debug = debug
+        self.results_by_level = OrderedDict()  # {level: ResultSet}, in fit order
+
+    def results(self, level):
+        if level not in self.results_by_level:
+            if self.debug:
+                log_debug("Fitting level {}...".format(level))
+            self.results_by_level[level] = ResultSet.from_results(
+                self.optimizer.many(
+                    self.models_by_level[level], perms="model", sort=False
+                )
+            ).sorted()
+        return self.results_by_level[level]
+
+    def __getitem__(self, level):
+        return self.results(level).best()
+
+    def __contains__(self, level):
+        return level in self.results_by_level
+
+    def __len__(self):
+        return len(self.results_by_level)
+
+
+class LevelTester(object):
+    """ECDF criterion for the best models of a senior and a junior level.
+
+    Critical values are taken from precomputed `ecdfs`, interpolated from
+    `ecdf_table`, simulated from the asymptotic chi-bar-square mixture
+    (`chibar`, see `ChiBarNull`), or bootstrapped. Simulated and bootstrapped
+    null distributions are kept by their (junior model, senior models) key,
+    so they are computed once and reused by every p-value and by both forward
+    and reverse selection. With `control_variate`, the chi-bar-square
+    statistic of every bootstrap replicate is its control variate.
+    """
+
+    def __init__(
+        self,
+        r,
+        theta0,
+        method,
+        ecdfs=None,
+        ecdf_table=None,
+        chibar=False,
+        rep=None,
+        use_best_senior_model=False,
+        sequential=False,
+        sequential_confidence=0.99,
+        seed_sequence=None,
+        warm_start=True,
+        prune=None,
+        ecdf_cache=None,
+        checkpoint=None,
+        control_variate=False,
+        jobs=1,
+        debug=False,
+    ):
+        self.r = r
+        self.theta0 = theta0
+        self.method = method
+        self.ecdfs = ecdfs
+        self.ecdf_table = ecdf_table
+        self.chibar = chibar
+        self.rep = rep
+        self.use_best_senior_model = use_best_senior_model
+        self.sequential = sequential
+        self.sequential_confidence = sequential_confidence
+        self.seed_sequence = seed_sequence
+        self.warm_start = warm_start
+        self.prune = prune
+        self.ecdf_cache = ecdf_cache
+        self.checkpoint = checkpoint
+        self.control_variate = control_variate
+        self.jobs = jobs
+        self.debug = debug
+        self.nulls = OrderedDict()  # {key: (label, NullDistribution or ChiBarNull)}
+
+    def get_null(
+        self, level_senior, level_junior, result_senior, result_junior, models_senior
+    ):
+        if self.use_best_senior_model:
+            models_senior = [result_senior.model]
+            name_senior = result_senior.model
+        else:
+            name_senior = level_senior
+        label = "{}-{}".format(level_senior, level_junior)
+        chibar = None
+        if self.chibar or self.control_variate:
+            chibar = ChiBarNull(
+                models_senior=models_senior,
+                model_junior=result_junior.model,
+                theta=result_junior.theta,
+                r=self.r,
+                theta0=self.theta0,
+                method=self.method,
+                seed_sequence=self.seed_sequence,
+                debug=self.debug,
+            )
+        if self.chibar:
+            if chibar.key not in self.nulls:
+                log_info(
+                    "Simulating chi-bar-square null of {}/{}...".format(
+                        name_senior, result_junior.model
+                    )
+                )
+                self.nulls[chibar.key] = (label, chibar)
+            return self.nulls[chibar.key][1]
+        null = NullDistribution(
+            models_senior=models_senior,
+            model_junior=result_junior.model,
+            theta=result_junior.theta,
+            r=self.r,
+            theta0=self.theta0,
+            method=self.method,
+            seed_sequence=self.seed_sequence,
+            warm_start=self.warm_start,
+            prune=self.prune,
+            checkpoint=self.checkpoint,
+            control=chibar,
+            debug=self.debug,
+        )
+        if null.key in self.nulls:
+            return self.nulls[null.key][1]
+        log_info(
+            "Bootstrapping {}/{} {} times...".format(
+                name_senior,
+                result_junior.model,
+                self.rep,
+            )
+        )
+        self.nulls[null.key] = (label, null)
+        # Note: controls need the replicates, which cached samples do not keep
+        if self.ecdf_cache and not self.control_variate:
+            n_cached = self.ecdf_cache.load(null)
+            if n_cached:
+                log_info("Loaded {} cached bootstrap samples".format(n_cached))
+        return null
+
+    def is_significant(
+        self,
+        level_senior,
+        level_junior,
+        result_senior,
+        result_junior,
+        models_senior,
+        critical_pvalue,
+        ecdfs_index,
+        strict=True,
+    ):
+        """Whether 2*delta LL exceeds the critical value (reaches it unless `strict`).
+
+        Raises ValueError when the critical value is missing in `ecdf_table`.
+        """
+        d = 2 * (result_senior.LL - result_junior.LL)
+        if self.ecdfs is not None or self.ecdf_table is not None:
+            if self.ecdfs is not None:
+                z = self.ecdfs[ecdfs_index]
+            else:
+                z = self.ecdf_table.critical_value(
+                    "{}-{}".format(level_senior, level_junior),
+                    result_junior.model,
+                    result_junior.theta,
+                    self.r,
+                    critical_pvalue,
+                )
+            log_info(
+                "{}-{}: 2*delta LL = {:.3f}, critical LL = {:.3f}".format(
+                    level_senior, level_junior, d, z
+                )
+            )
+            return d > z if strict else not d < z
+
+        null = self.get_null(
+            level_senior, level_junior, result_senior, result_junior, models_senior
+        )
+        if self.chibar:
+            z = null.critical_value(critical_pvalue)
+            log_info(
+                "{}-{}: 2*delta LL = {:.3f}, critical LL = {:.3f} (chi-bar-square, {}/{} cones)".format(
+                    level_senior, level_junior, d, z, *null.n_cones
+                )
+            )
+            return d > z if strict else not d < z
+        n_before = len(null)
+        if self.sequential:
+            is_significant = null.sequential_test(
+                d,
+                critical_pvalue,
+                max_times=self.rep,
+                confidence=self.sequential_confidence,
+                jobs=self.jobs,
+                strict=strict,
+            )
+        else:
+            null.extend(max(0, self.rep - n_before), jobs=self.jobs)
+        if self.ecdf_cache and len(null) > n_before:
+            self.ecdf_cache.store(null)
+        boot = null.sorted()
+        i = null.critical_index(critical_pvalue)
+        z = boot[i]
+        if not self.sequential:
+            is_significant = d > z if strict else not d < z
+        log_info(
+            "{}-{}: 2*delta LL = {:.3f}, critical LL = {:.3f} ({}th of {}, range={:.3f}..{:.3f})".format(
+                level_senior, level_junior, d, z, i, len(boot), boot[0], boot[-1]
+            )
+        )
+        if null.cache.hits and len(null) > n_before:
+            log_info(
+                "Reused fits for {} of {} replicates with duplicate y".format(
+                    null.cache.hits, null.cache.hits + null.cache.misses
+                )
+            )
+        if self.sequential and len(boot) < self.rep:
+            log_info(
+                "Sequential test settled after {} of {} replicates".format(
+                    len(boot), self.rep
+                )
+            )
+        return is_significant
+
+    def save_samples(self, f):
+        """Save sorted bootstrap samples into `.npz` keyed by level pair."""
+        np.savez(f, **{label: null.sorted() for label, null in self.nulls.values()})
+
+
+def select_forward(
+    levels, best_result_by_level, models_by_level, critical_pvalue, tester=None
+):
+    """Stepwise selection from the most complex level towards polytomy.
+
+    Stops at the first level which is significantly better than the next one.
+    Without `tester`, the chi-square likelihood-ratio test is used.
+    Returns the final level and its best result.
+    """
+    for level_current, level_next in zip(levels, levels[1:]):
+        result_current = best_result_by_level[level_current]
+        result_next = best_result_by_level[level_next]
+        if tester is not None:
+            if tester.is_significant(
+                level_current,
+                level_next,
+                result_current,
+                result_next,
+                models_by_level[level_current],
+                critical_pvalue,
+                ecdfs_index=levels.index(level_current),
+            ):
+                log_success("Last 2*delta LL > critical LL, stopping")
+                return level_current, result_current
+        else:
+            stat, p = get_pvalue(result_current, result_next, df=1)
+            log_info(
+                "{}-{}: stat = {:.3f}, p-value = {:.5f}".format(
+                    level_current, level_next, stat, p
+                )
+            )
+            if p <= critical_pvalue:
+                log_success("Last p-value <= critical_pvalue, stopping")
+                return level_current, result_current
+    if tester is not None:
+        log_success("All 2*delta LLs <= critical LLs, accepting polytomy")
+    else:
+        log_success("All p-value > critical_pvalue, accepting polytomy")
+    return levels[-1], best_result_by_level[levels[-1]]
+
+
+def select_reverse(
+    levels, best_result_by_level, models_by_level, critical_pvalue, tester=None
+):
+    """Reverse selection: the simplest level not significantly worse than the first one.
+
+    Without `tester`, the chi-square likelihood-ratio test is used.
+    Returns the final level, its best result and the p-value of the last test
+    (0 with `tester`).
+    """
+    level_complex = levels[0]
+    result_complex = best_result_by_level[level_complex]
+    pgood = 0  # meaningless value with ecdf
+    for level_simple in levels[1:]:
+        result_simple = best_result_by_level[level_simple]
+        if tester is not None:
+            if not tester.is_significant(
+                level_complex,
+                level_simple,
+                result_complex,
+                result_simple,
+                models_by_level[level_complex],
+                critical_pvalue,
+                ecdfs_index=int(level_simple[1:]),
+                strict=False,
+            ):
+                log_success("Last 2*delta LL < critical LL, stopping")
+                return level_simple, result_simple, pgood
+        else:
+            df = int(level_complex[1:]) - int(level_simple[1:])
+            stat, pgood = get_pvalue(result_complex, result_simple, df=df)
+            log_info(
+                "{}-{}: df = {}, stat = {:.3f}, p-value = {:.5f}".format(
+                    level_complex, level_simple, df, stat, pgood
+                )
+            )
+            if pgood >= critical_pvalue:
+                log_success("Last p-value >= critical_pvalue, stopping")
+                return level_simple, result_simple, pgood
+    return level_complex, result_complex, pgood
+
+
+result_fields = [
+    "Level",
+    "Model",
+    "Mnemo",
+    "Perm",
+    "LL",
+    "n0",
+    "T1",
+    "T3",
+    "g1",
+    "g3",
+    "pbad",
+    "pgood",
+    "ppoly",
+]
+
+
+def get_result_fields(final_level, final_result, pbad, pgood, ppoly):
+    """Values of `result_fields` for the final result."""
+    n0, T1, T3, g1, g3 = final_result.theta
+    return [
+        final_level,
+        final_result.model.name,
+        final_result.model.mnemonic_name,
+        "".join(map(str, final_result.permutation)),
+        final_result.LL,
+        n0,
+        T1,
+        T3,
+        g1,
+        g3,
+        pbad,
+        pgood,
+        ppoly,
+    ]
+
+
+def format_result(tag, fields):
+    # Ex: [levels],N3,1H3,H1:TT0g,1234,444.45,98.99,1.0,2.0,0,0.5,0.01,0.6,0.0001
+    return ",".join(["[{}]".format(tag)] + list(map(str, fields)))
+
+
+def get_forward_fields(levels, best_result_by_level, final_level, final_result):
+    if final_level == levels[0]:
+        pbad = 0
+    else:
+        _, pbad = get_pvalue(
+            best_result_by_level[levels[levels.index(final_level) - 1]],
+            final_result,
+            df=1,
+        )
+    if final_level == levels[-1]:
+        pgood = 0
+    else:
+        _, pgood = get_pvalue(
+            final_result,
+            best_result_by_level[levels[levels.index(final_level) + 1]],
+            df=1,
+        )
+    if final_level == "N0":
+        ppoly = 1
+    else:
+        _, ppoly = get_pvalue(
+            final_result, best_result_by_level["N0"], df=int(final_level[1:])
+        )
+    return get_result_fields(final_level, final_result, pbad, pgood, ppoly)
+
+
+def format_forward_result(levels, best_result_by_level, final_level, final_result):
+    fields = get_forward_fields(levels, best_result_by_level, final_level, final_result)
+    return format_result("levels", fields)
+
+
+def get_reverse_fields(levels, best_result_by_level, final_level, final_result, pgood):
+    level_complex = levels[0]
+    result_complex = best_result_by_level[level_complex]
+    if final_level == levels[0] or final_level == levels[1]:
+        pbad = 0
+    else:
+        level_prev = levels[levels.index(final_level) - 1]
+        _, pbad = get_pvalue(
+            result_complex,
+            best_result_by_level[level_prev],
+            df=int(level_complex[1:]) - int(level_prev[1:]),
+        )
+    if final_level == "N0":
+        ppoly = 1
+    else:
+        _, ppoly = get_pvalue(
+            final_result,
+            best_result_by_level["N0"],
+            df=int(final_level[1:]),
+        )
+    return get_result_fields(final_level, final_result, pbad, pgood, ppoly)
+
+
+def format_reverse_result(
+    levels, best_result_by_level, final_level, final_result, pgood
+):
+    fields = get_reverse_fields(
+        levels, best_result_by_level, final_level, final_result, pgood
+    )
+    return format_result("reverse", fields)
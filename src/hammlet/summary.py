@@ -0,0 +1,127 @@
+from __future__ import division
+
+import array
+import math
+import random
+
+import numpy as np
+
+__all__ = ["QuantileSample", "RunningSummary"]
+
+
+class QuantileSample(object):
+    """Values of a column for exact quantiles, in bounded memory.
+
+    All values are kept (as doubles) until there are `size` of them, then a
+    uniform reservoir sample of `size` values is kept instead (algorithm R of
+    Vitter, 1985), and quantiles are estimated from it.
+
+    >>> sample = QuantileSample(size=4)
+    >>> for x in [5, 1, 4, 2]:
+    ...     sample.add(x)
+    >>> sample.quantile(0.5), sample.exact
+    (3.0, True)
+    >>> for x in range(100):
+    ...     sample.add(x)
+    >>> len(sample.values), sample.count, sample.exact
+    (4, 104, False)
+    """
+
+    def __init__(self, size=100000, seed=0):
+        self.size = size
+        self.values = array.array("d")
+        self.count = 0
+        self.random = random.Random(seed)
+
+    @property
+    def exact(self):
+        return self.count <= self.size
+
+    def add(self, x):
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(x)
+            return
+        i = self.random.randrange(self.count)
+        if i < self.size:
+            self.values[i] = x
+
+    def quantile(self, p):
+        """The `p`-quantile (linear interpolation between order statistics)."""
+        if not self.values:
+            return float("nan")
+        return float(np.quantile(np.frombuffer(self.values, dtype=np.float64), p))
+
+
+class RunningSummary(object):
+    """Mean, standard deviation, extremes and quantiles of table columns.
+
+    Rows are added one by one. Quantiles are exact up to `max_values` rows,
+    then they are estimated from a uniform sample of `max_values` rows, so
+    memory does not grow beyond it (see `exact`).
+
+    >>> summary = RunningSummary(["LL"], quantiles=(0.5,))
+    >>> for x in [3, 1, 2]:
+    ...     summary.add([x])
+    >>> summary.headers
+    ['Column', 'mean', 'sd', 'min', 'q0.5', 'max']
+    >>> summary.to_data()
+    [['LL', 2.0, 1.0, 1, 2.0, 3]]
+    """
+
+    def __init__(self, names, quantiles=(0.05, 0.5, 0.95), max_values=100000):
+        self.names = list(names)
+        self.quantiles = list(quantiles)
+        self.max_values = max_values
+        self.count = 0
+        self.means = [0.0] * len(self.names)
+        self.m2s = [0.0] * len(self.names)
+        self.mins = [float("inf")] * len(self.names)
+        self.maxs = [float("-inf")] * len(self.names)
+        self.samples = [QuantileSample(max_values) for _ in self.names]
+
+    def __len__(self):
+        return self.count
+
+    def add(self, values):
+        # Note: Welford's online algorithm for mean and variance
+        self.count += 1
+        for j, x in enumerate(values):
+            delta = x - self.means[j]
+            self.means[j] += delta / self.count
+            self.m2s[j] += delta * (x - self.means[j])
+            self.mins[j] = min(self.mins[j], x)
+            self.maxs[j] = max(self.maxs[j], x)
+            self.samples[j].add(x)
+
+    def mean(self, name):
+        return self.means[self.names.index(name)]
+
+    def sd(self, name):
+        if self.count < 2:
+            return float("nan")
+        return math.sqrt(self.m2s[self.names.index(name)] / (self.count - 1))
+
+    @property
+    def exact(self):
+        """Whether quantiles are exact (from all rows)."""
+        return all(sample.exact for sample in self.samples)
+
+    def quantile(self, name, p):
+        return self.samples[self.names.index(name)].quantile(p)
+
+    @property
+    def headers(self):
+        return (
+            ["Column", "mean", "sd", "min"]
+            + ["q{}".format(p) for p in self.quantiles]
+            + ["max"]
+        )
+
+    def to_data(self):
+        return [
+            [name, self.means[j], self.sd(name), self.mins[j]]
+            + [self.samples[j].quantile(p) for p in self.quantiles]
+            + [self.maxs[j]]
+            for j, name in enumerate(self.names)
+        ]
@@ -1,3 +1,4 @@
+import itertools
 import time
 from collections import deque
 from functools import wraps
@@ -11,12 +12,14 @@ __all__ = [
     "convert_permutation",
     "morph4",
     "morph10",
+    "compose_permutations",
+    "invert_permutation",
+    "canonize_y",
     "ij2pattern",
     "pattern2ij",
     "get_a",
     "likelihood",
     "get_pvalue",
-    "get_LL2",
     "get_paths",
     "get_chain",
     "get_chains",
@@ -125,6 +128,48 @@ def morph10(iterable, permutation):
     )
 
 
+def compose_permutations(first, second):
+    """Compose permutations, so that `morph10(morph10(y, first), second)` is
+    `morph10(y, compose_permutations(first, second))`.
+
+    >>> compose_permutations((2, 4, 3, 1), (2, 1, 4, 3))
+    (4, 2, 1, 3)
+    """
+    return tuple(first[i - 1] for i in second)
+
+
+def invert_permutation(permutation):
+    """Inverse permutation.
+
+    >>> invert_permutation((2, 4, 3, 1))
+    (4, 1, 3, 2)
+    >>> compose_permutations((2, 4, 3, 1), (4, 1, 3, 2))
+    (1, 2, 3, 4)
+    """
+    inverse = [0] * 4
+    for i, p in enumerate(permutation, start=1):
+        inverse[p - 1] = i
+    return tuple(inverse)
+
+
+def canonize_y(y):
+    """Canonical representative of `y` under relabelings of species.
+
+    Returns `(y_canonical, permutation)` with the lexicographically smallest
+    `y_canonical = morph10(y, permutation)` over all 24 permutations.
+
+    >>> canonize_y((10, 8, 7, 4, 21, 7, 2, 39, 30, 28))
+    ((10, 4, 7, 8, 28, 30, 2, 39, 7, 21), (1, 4, 3, 2))
+    >>> canonize_y(morph10((10, 8, 7, 4, 21, 7, 2, 39, 30, 28), (3, 1, 4, 2)))[0]
+    (10, 4, 7, 8, 28, 30, 2, 39, 7, 21)
+    """
+    y = tuple(y)
+    return min(
+        (morph10(y, permutation), permutation)
+        for permutation in itertools.permutations((1, 2, 3, 4))
+    )
+
+
 def ij2pattern(i, j):
     """Convert (i,j) pair into string pattern.
 
@@ -207,28 +252,6 @@ def get_pvalue(result_complex, result_simple, df):
     return (stat, p)
 
 
-def get_LL2(
-    models_high,
-    model_low,
-    y,
-    r,
-    theta0,
-    method,
-    debug=False,
-):
-    from .optimizer import Optimizer
-
-    y_poissoned = tuple(np.random.poisson(y))
-    optimizer = Optimizer(y_poissoned, r, theta0, method, debug=debug)
-    results_high = optimizer.many(models_high, perms="model")
-    results_low = optimizer.many_perms(model_low, perms="model")
-    best_result_high = max(results_high, key=lambda it: it.LL)
-    best_result_low = max(results_low, key=lambda it: it.LL)
-    LLx = best_result_high.LL
-    LLy = best_result_low.LL
-    return 2 * (LLx - LLy)
-
-
 def get_paths(hierarchy, initial_model):
     from .models import Model
 
@@ -270,6 +293,11 @@ def get_chains(paths, results, critical_pvalue):
 
 
 def results_to_data(results):
+    from .resultset import ResultSet
+
+    if isinstance(results, ResultSet):
+        return results.to_data()
+
     data = []
     for result in results:
         model = result.model
@@ -0,0 +1,179 @@
+import io
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from hammlet import batch as batch_lib
+from hammlet.batch import (
+    analyze_group,
+    analyze_quartet,
+    get_headers,
+    group_quartets,
+    read_quartets,
+)
+from hammlet.commands import batch
+from hammlet.utils import morph10
+
+HCTM = (10, 8, 7, 4, 21, 7, 2, 39, 30, 28)
+
+
+def test_read_quartets_tsv_default_r():
+    f = io.StringIO(
+        "y11\ty12\ty13\ty14\ty22\ty23\ty24\ty33\ty34\ty44\n"
+        "10\t8\t7\t4\t21\t7\t2\t39\t30\t28\n"
+    )
+    assert list(read_quartets(f, "tsv", r_default=(1, 2, 1, 1))) == [
+        ("1", HCTM, (1, 2, 1, 1))
+    ]
+
+
+def test_read_quartets_errors():
+    with pytest.raises(ValueError, match="missing columns"):
+        list(read_quartets(io.StringIO("id,y11\nq,1\n")))
+    with pytest.raises(ValueError, match="line 2: expected ten y values"):
+        list(
+            read_quartets(
+                io.StringIO('{"y": [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]}\n{"y": [1]}\n'),
+                "jsonl",
+            )
+        )
+
+
+def test_analyze_quartet_stat():
+    rows = analyze_quartet(("hctm", HCTM, (1, 1, 1, 1)), "stat")
+    assert [row[:4] for row in rows] == [
+        ["hctm", "levels", "N2", "T2"],
+        ["hctm", "reverse", "N1", "PT"],
+    ]
+    assert all(len(row) == len(get_headers("stat")) for row in rows)
+
+
+def test_analyze_group_same_as_quartets():
+    quartets = [
+        ("a", HCTM, (1, 2, 1, 1)),
+        ("b", morph10(HCTM, (3, 1, 4, 2)), (1, 2, 1, 1)),
+        ("c", morph10(HCTM, (2, 1, 3, 4)), (1, 1, 1, 1)),
+    ]
+    groups = group_quartets(quartets)
+    assert [[index for index, _ in group] for group in groups] == [[0, 1], [2]]
+    assert analyze_group(groups[0], "mle-nr") == [
+        (index, analyze_quartet(quartet, "mle-nr")) for index, quartet in groups[0]
+    ]
+
+
+def fake_analyze_quartet(quartet, pipeline, fail=None, **kwargs):
+    id_, y, r = quartet
+    if id_ == fail:
+        raise RuntimeError("crash")
+    return [[id_, "N4", "2H1", "H1:TTgg", "1234", -float(sum(y))] + [1.0] * 5]
+
+
+def test_batch_resume(tmp_path, monkeypatch):
+    input_filename = str(tmp_path / "quartets.csv")
+    with open(input_filename, "w") as f:
+        f.write("id,y11,y12,y13,y14,y22,y23,y24,y33,y34,y44\n")
+        for i in range(10):
+            f.write("q{},{}\n".format(i, ",".join([str(i + 1)] * 10)))
+    output_filename = str(tmp_path / "results.csv")
+    checkpoint_path = str(tmp_path / "checkpoint")
+    args = ["-i", input_filename, "-o", output_filename, "--pipeline", "mle-nr"]
+    args += ["--checkpoint", checkpoint_path, "--checkpoint-every", "3"]
+    runner = CliRunner()
+    monkeypatch.setattr(
+        batch_lib,
+        "analyze_quartet",
+        lambda quartet, pipeline, **kwargs: fake_analyze_quartet(
+            quartet, pipeline, fail="q7"
+        ),
+    )
+    result = runner.invoke(batch, args)
+    assert result.exit_code == 1
+    assert "Analysis failed: quartet q7: RuntimeError: crash" in result.output
+    assert not os.path.exists(output_filename)
+
+    calls = []
+
+    def analyze_rest(quartet, pipeline, **kwargs):
+        calls.append(quartet[0])
+        return fake_analyze_quartet(quartet, pipeline)
+
+    monkeypatch.setattr(batch_lib, "analyze_quartet", analyze_rest)
+    result = runner.invoke(batch, args + ["--resume"])
+    assert result.exit_code == 0, result.output
+    # Note: q0..q6 were completed (and committed) before the interruption
+    assert calls == ["q7", "q8", "q9"]
+    with open(output_filename) as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith("id,Level,Model")
+    assert [line.split(",")[0] for line in lines[1:]] == [
+        "q{}".format(i) for i in range(10)
+    ]
+
+    result = runner.invoke(batch, args + ["--resume", "-x", "2H1"])
+    assert "checkpoint was created with different parameters" in result.output
+
+
+def test_batch_checkpoint_directory(tmp_path, monkeypatch):
+    input_filename = str(tmp_path / "quartets.csv")
+    with open(input_filename, "w") as f:
+        f.write("id,y11,y12,y13,y14,y22,y23,y24,y33,y34,y44\n")
+        for i in range(4):
+            f.write("q{},{}\n".format(i, ",".join([str(i + 1)] * 10)))
+    output_filename = str(tmp_path / "results.csv")
+    checkpoint_path = tmp_path / "checkpoint"
+    checkpoint_path.mkdir()
+    (checkpoint_path / "data.txt").write_text("important")
+    args = ["-i", input_filename, "-o", output_filename, "--pipeline", "mle-nr"]
+    args += ["--checkpoint", str(checkpoint_path), "--checkpoint-every", "2"]
+    runner = CliRunner()
+    for extra in ([], ["--resume"]):
+        result = runner.invoke(batch, args + extra)
+        assert result.exit_code == 1
+        assert "directory is not empty and is not a checkpoint" in result.output
+    assert os.listdir(str(checkpoint_path)) == ["data.txt"]
+
+    # Note: quartets without rows (q1) are committed too
+    monkeypatch.setattr(
+        batch_lib,
+        "analyze_quartet",
+        lambda quartet, pipeline, **kwargs: (
+            [] if quartet[0] == "q1" else fake_analyze_quartet(quartet, pipeline)
+        ),
+    )
+    (checkpoint_path / "data.txt").unlink()
+    for extra in ([], [], ["--resume"]):
+        result = runner.invoke(batch, args + extra)
+        assert result.exit_code == 0, result.output
+        # Note: a restart removes only files of the checkpoint
+        (checkpoint_path / "notes.txt").write_text("kept")
+        assert sorted(os.listdir(str(checkpoint_path))) == [
+            "000000.csv",
+            "000001.csv",
+            "manifest.json",
+            "notes.txt",
+        ]
+    with open(output_filename) as f:
+        assert [line.split(",")[0] for line in f.read().splitlines()[1:]] == [
+            "q0",
+            "q2",
+            "q3",
+        ]
+
+
+def test_batch_markers_errors(tmp_path):
+    markers_filename = str(tmp_path / "markers.txt")
+    with open(markers_filename, "w") as f:
+        f.write("A B C D E\n1 0 1 1 0\n0 1 1 0 1\n")
+    args = ["--markers", markers_filename, "-o", str(tmp_path / "results.csv")]
+    runner = CliRunner()
+    result = runner.invoke(batch, args + ["--sample", "focal", "--focal", "Z"])
+    assert result.exit_code == 1
+    assert "unknown focal species: Z" in result.output
+
+    with open(markers_filename, "a") as f:
+        f.write("1 x 1 1 1\n")
+    result = runner.invoke(batch, args + ["--output-mle", str(tmp_path / "mle")])
+    assert result.exit_code == 1
+    assert "line 4: expected 5 symbols" in result.output
+    assert sorted(os.listdir(str(tmp_path))) == ["markers.txt"]
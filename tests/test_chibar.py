@@ -0,0 +1,45 @@
+import numpy as np
+from click.testing import CliRunner
+
+from hammlet.chibar import ChiBarNull, cone_norms
+from hammlet.commands import stat_levels
+from hammlet.models import models_mapping
+
+
+def test_cone_norms_half_line():
+    # Note: one constrained direction gives 0.5*chi2(0) + 0.5*chi2(1)
+    Z = np.random.default_rng(1).standard_normal((20000, 3))
+    norms = np.sort(cone_norms(Z, np.array([[1.0], [1.0], [0.0]]), np.array([True])))
+    assert abs(np.mean(norms == 0) - 0.5) < 0.02
+    assert abs(norms[int(0.95 * len(norms))] - 2.706) < 0.15
+
+
+def test_chibar_null_is_reproducible():
+    senior, junior = models_mapping["1H3"], models_mapping["T2"]
+    theta = junior.apply_bounds((300, 1, 0.5, 0.3, 0.3))
+    args = ([senior], junior, theta, (1, 1, 1, 1), (180, 0.5, 0.5, 0.5, 0.5), "SLSQP")
+    null = ChiBarNull(*args, seed_sequence=1, size=5000)
+    same = ChiBarNull(*args, seed_sequence=1, size=5000)
+    assert np.array_equal(null.sorted(), same.sorted())
+    assert null.n_cones[0] > 0 and null.n_cones[1] > 0
+    # Note: 1000 bootstrap replicates give 3.56 here
+    assert 3 < null.critical_value(0.05) < 4.5
+
+
+def test_stat_levels_null_chibar():
+    y = "10 8 7 4 21 7 2 39 30 28".split()
+    runner = CliRunner()
+    result = runner.invoke(stat_levels, ["-y"] + y + ["--null", "chibar", "-n", "10"])
+    assert result.exit_code != 0
+    assert "-n/--times" in result.output
+    result = runner.invoke(stat_levels, ["-y"] + y + ["--control-variate"])
+    assert result.exit_code != 0
+    assert "--control-variate" in result.output
+    result = runner.invoke(stat_levels, ["-y"] + y + ["--null", "chibar", "--ecdf"])
+    assert result.exit_code != 0
+    assert "--null" in result.output
+    result = runner.invoke(
+        stat_levels, ["-y"] + y + ["--null", "chibar", "--seed", "1"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "chi-bar-square" in result.output
@@ -0,0 +1,115 @@
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+from hammlet.batch import analyze_quartet, get_headers
+from hammlet.commands import stat, stat_levels
+from hammlet.database import ResultsDB
+
+HCTM = (10, 8, 7, 4, 21, 7, 2, 39, 30, 28)
+
+
+@pytest.fixture(scope="module")
+def analyzed():
+    return [
+        analyze_quartet((id_, HCTM, r), "stat", with_results=True)
+        for id_, r in [("q1", (1, 1, 1, 1)), ("q2", (1, 2, 1, 1))]
+    ]
+
+
+def test_batch_results(tmp_path, analyzed):
+    db = ResultsDB(str(tmp_path / "results.db"), buffer_size=50)
+    run = db.add_run("batch", {"pipeline": "stat"})
+    for rows, results in analyzed:
+        db.add_fits(run, rows[0][0], results)
+        db.add_decisions(run, get_headers("stat"), rows)
+    db.close()
+
+    db = ResultsDB(str(tmp_path / "results.db"))
+    _, rows = db.query("decisions", procedure="levels")
+    assert [row[1:6] for row in rows] == [
+        ("q1", "levels", 0.05, "N2", "T2"),
+        ("q2", "levels", 0.05, "N2", "T2"),
+    ]
+    # Note: from level to ppoly, as in the batch results table
+    assert rows[0][4:] == tuple(analyzed[0][0][0][2:-1])
+    _, rows = db.query("fits")
+    assert len(rows) == sum(len(results) for _, results in analyzed)
+
+    headers, rows = db.query("fits", model="2H1", top=3)
+    assert [row[1] for row in rows] == ["q1"] * 3 + ["q2"] * 3
+    LL = rows[0][headers.index("LL")]
+    assert LL == max(r.LL for r in analyzed[0][1] if r.model.name == "2H1")
+
+
+def test_ecdfs_and_sql(tmp_path):
+    db = ResultsDB(str(tmp_path / "results.db"))
+    key = dict(junior="1H1", senior=["2H1"], method="SLSQP", theta=[1] * 5, r=[1] * 4)
+    db.add_ecdf("abc", key, [0.5, 1.5, 2.5])
+    assert db.get_ecdf("abc").tolist() == [0.5, 1.5, 2.5]
+    assert db.get_ecdf("missing") is None
+    headers, rows = db.query("ecdfs", junior="1H1")
+    assert rows[0][:5] == ("abc", "1H1", "2H1", "SLSQP", 3)
+
+    assert db.execute("SELECT COUNT(*) AS n FROM ecdfs") == (["n"], [(1,)])
+    with pytest.raises(Exception, match="readonly"):
+        db.execute("DELETE FROM ecdfs")
+    with pytest.raises(ValueError):
+        db.query("ecdfs", top=1)
+
+
+def test_readonly(tmp_path, analyzed):
+    path = tmp_path / "results.db"
+    db = ResultsDB(str(path))
+    run = db.add_run("batch", {"pipeline": "stat"})
+    db.add_fits(run, "q1", analyzed[0][1])
+    db.close()
+    # Note: as a database created without WAL
+    connection = sqlite3.connect(str(path))
+    connection.execute("PRAGMA journal_mode=DELETE")
+    connection.close()
+    data = path.read_bytes()
+
+    db = ResultsDB(str(path), readonly=True)
+    assert len(db.query("fits")[1]) == len(analyzed[0][1])
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        db.add_run("batch", {})
+    db.close()
+    assert path.read_bytes() == data
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["results.db"]
+    with pytest.raises(sqlite3.OperationalError):
+        ResultsDB(str(tmp_path / "missing.db"), readonly=True)
+
+
+def test_stat_commands_db(tmp_path):
+    path = str(tmp_path / "results.db")
+    y = list(map(str, HCTM))
+    runner = CliRunner()
+    result = runner.invoke(stat, ["-y"] + y + ["-p", "0.05,0.01", "--db", path])
+    assert result.exit_code == 0, result.output
+    args = ["--preset", "hctm", "--ecdf", "-n", "5", "--prune-perms", "1"]
+    result = runner.invoke(stat_levels, args + ["--db", path])
+    assert result.exit_code == 0, result.output
+
+    db = ResultsDB(path, readonly=True)
+    _, rows = db.query("runs")
+    assert [row[2] for row in rows] == ["stat", "stat-levels"]
+    _, rows = db.query("decisions", run=1)
+    assert [row[1:5] for row in rows] == [
+        (" ".join(y), "levels", 0.05, "N2"),
+        (" ".join(y), "reverse", 0.05, "N1"),
+        (" ".join(y), "levels", 0.01, "N2"),
+        (" ".join(y), "reverse", 0.01, "N1"),
+    ]
+    assert db.query("decisions", run=2, quartet="hctm")[1][0][4] == "N2"
+    # Note: fits of all levels reached, N0 included for the p-values of results
+    assert {row[2] for row in db.query("fits", run=2)[1]} == {
+        "N4",
+        "N3",
+        "N2",
+        "N1",
+        "N0",
+    }
+    _, rows = db.query("ecdfs")
+    assert [(row[1], row[4]) for row in rows] == [("1H3", 5), ("T2", 5), ("PT", 5)]
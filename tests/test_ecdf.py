@@ -0,0 +1,144 @@
+import io
+
+import numpy as np
+import pytest
+
+from hammlet import ecdf
+from hammlet.checkpoint import Checkpoint
+from hammlet.chibar import ChiBarNull
+from hammlet.ecdf import EcdfCache, EcdfTable, NullDistribution, get_model_axes
+from hammlet.models import models_mapping
+
+
+def make_table():
+    axes = [[50, 100], [0.5, 1], [0.5, 1], [0, 1], [0, 1]]
+    table = EcdfTable(axes, [(1, 1, 1, 1)], [0.05, 0.01], 10, "SLSQP")
+    model = models_mapping["PT"]
+    shape = [1] + list(map(len, get_model_axes(model, axes))) + [2]
+    values = np.arange(np.prod(shape), dtype=np.float32).reshape(shape)
+    table.values["N2-N1", "PT"] = values
+    return table, model, values
+
+
+def test_ecdf_table_grid_points():
+    table, model, values = make_table()
+    # PT (0Tn1): only n0 and T3 are free
+    assert values.shape == (1, 2, 1, 2, 1, 1, 2)
+    value = table.critical_value(
+        "N2-N1", model, (100, 0, 0.5, 0.5, 1), (1, 1, 1, 1), 0.01
+    )
+    assert value == values[0, 1, 0, 0, 0, 0, 1]
+
+
+def test_ecdf_table_interpolation_and_clipping():
+    table, model, values = make_table()
+    low = values[0, 0, 0, 0, 0, 0, 0]
+    high = values[0, 0, 0, 1, 0, 0, 0]
+    value = table.critical_value(
+        "N2-N1", model, (10, 0, 0.75, 0.5, 1), (1, 1, 1, 1), 0.05
+    )
+    assert value == pytest.approx((low + high) / 2)
+
+
+def test_ecdf_table_save_load():
+    table, model, _ = make_table()
+    f = io.BytesIO()
+    table.save(f)
+    f.seek(0)
+    loaded = EcdfTable.load(f)
+    assert loaded.rs == table.rs
+    assert loaded.pvalues == table.pvalues
+    theta = (75, 0, 0.6, 0.5, 1)
+    assert loaded.critical_value(
+        "N2-N1", model, theta, (1, 1, 1, 1), 0.05
+    ) == table.critical_value("N2-N1", model, theta, (1, 1, 1, 1), 0.05)
+
+
+def test_ecdf_table_missing_entries():
+    table, model, _ = make_table()
+    with pytest.raises(ValueError):
+        table.critical_value("N4-N3", model, (75, 0, 0.6, 0.5, 1), (1, 1, 1, 1), 0.05)
+    with pytest.raises(ValueError):
+        table.critical_value("N2-N1", model, (75, 0, 0.6, 0.5, 1), (2, 1, 1, 1), 0.05)
+    with pytest.raises(ValueError):
+        table.critical_value("N2-N1", model, (75, 0, 0.6, 0.5, 1), (1, 1, 1, 1), 0.1)
+
+
+def test_ecdf_table_excluded(monkeypatch):
+    calls = []
+
+    def fake_table_point(task, models_senior, pvalues, **kwargs):
+        calls.append((task[1].name, [model.name for model in models_senior]))
+        return [1.0] * len(pvalues)
+
+    monkeypatch.setattr(ecdf, "table_point", fake_table_point)
+    axes = [[50], [0.5], [0.5], [0], [0]]
+    excluded = ["2H1", "1H1"]
+    table = EcdfTable(axes, [(1, 1, 1, 1)], [0.05], 10, "SLSQP", excluded=excluded)
+    table.compute(pairs=["N4-N3"])
+    assert calls and all(senior == ["2H2"] for _, senior in calls)
+    assert "1H1" not in [junior for _, junior in calls]
+
+    f = io.BytesIO()
+    table.save(f)
+    f.seek(0)
+    loaded = EcdfTable.load(f)
+    loaded.check_excluded([models_mapping[name] for name in excluded])
+    with pytest.raises(ValueError, match="computed with excluded models: 1H1 2H1"):
+        loaded.check_excluded([])
+
+
+def test_sequential_test_same_as_critical_value():
+    null = NullDistribution(
+        [models_mapping["2H1"]],
+        models_mapping["1H1"],
+        (100, 1, 2, 0.5, 0),
+        (1, 1, 1, 1),
+        None,
+        "SLSQP",
+        seed_sequence=1,
+    )
+    null.sample = np.arange(100, dtype=float)
+    z = null.critical_value(0.05)
+    for stat in [z - 0.5, z, z + 0.5]:
+        # Note: the full sample is there, so no replicates are drawn
+        assert null.sequential_test(stat, 0.05, max_times=100) == (stat > z)
+        assert null.sequential_test(stat, 0.05, max_times=100, strict=False) == (
+            stat >= z
+        )
+
+
+def test_ecdf_cache_separates_fit_options(tmp_path):
+    cache = EcdfCache(str(tmp_path))
+    args = ([models_mapping["2H1"]], models_mapping["1H1"], (100, 1, 2, 0.5, 0))
+    args += ((1, 1, 1, 1), (10, 0.5, 0.5, 0.5, 0.5), "SLSQP")
+    exact = NullDistribution(*args, warm_start=False)
+    exact.sample = np.arange(5.0)
+    cache.store(exact)
+    assert cache.load(NullDistribution(*args, warm_start=False)) == 5
+    # Note: samples of warm started or pruned fits are not exact ones
+    assert cache.load(NullDistribution(*args, warm_start=True)) == 0
+    assert cache.load(NullDistribution(*args, warm_start=False, prune=2)) == 0
+    other_theta0 = args[:4] + ((20, 0.5, 0.5, 0.5, 0.5), "SLSQP")
+    assert cache.load(NullDistribution(*other_theta0, warm_start=False)) == 0
+
+
+def test_control_variates_of_restored_replicates(tmp_path):
+    args = ([models_mapping["2H1"]], models_mapping["1H1"], (100, 1, 2, 0.5, 0))
+    args += ((1, 1, 1, 1), (60, 0.5, 0.5, 0.5, 0.5), "SLSQP")
+    control = ChiBarNull(*args, seed_sequence=1, size=2000)
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.jsonl"), {}, seed=1, every=10)
+    null = NullDistribution(*args, seed_sequence=1, checkpoint=checkpoint)
+    null.extend(20)
+    controls = control.control(null.draw(0, 20))
+    # Note: controls of restored replicates are computed from their streams
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.jsonl"), {}, resume=True)
+    restored = NullDistribution(
+        *args, seed_sequence=1, checkpoint=checkpoint, control=control
+    )
+    assert np.array_equal(restored.get_controls(), controls)
+    i = restored.critical_index(0.05)
+    assert i == ecdf.stratified_critical_index(
+        null.sample, controls, control.get_control_sample(), 0.05
+    )
+    assert restored.critical_value(0.05) == null.sorted()[i]
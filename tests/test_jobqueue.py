@@ -0,0 +1,84 @@
+import io
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from hammlet.jobqueue import JobQueue, merge_outputs, run_worker
+
+HEADERS = ["id", "sum"]
+
+
+def fake_analyze(quartets):
+    for id_, y, r in quartets:
+        if id_ == "bad":
+            raise ValueError("bad quartet")
+        time.sleep(0.01)
+        yield [[id_, sum(y)]]
+
+
+def get_quartets(n):
+    return [("q{}".format(i), (i,) * 10, (1, 1, 1, 1)) for i in range(n)]
+
+
+def consume_worker(path, worker):
+    list(run_worker(path, fake_analyze, HEADERS, worker=worker))
+
+
+def test_local_workers_merge(tmp_path):
+    path = str(tmp_path / "queue")
+    JobQueue.create(path, {}, get_quartets(50), shard_size=4)
+    workers = [
+        multiprocessing.Process(target=consume_worker, args=(path, "w{}".format(i)))
+        for i in range(3)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    queue = JobQueue(path)
+    assert queue.status()["done"] == 13
+    f = io.StringIO()
+    assert merge_outputs(queue, f) == 50
+    lines = f.getvalue().splitlines()
+    assert lines[0] == "id,sum"
+    assert lines[1:] == ["q{},{}".format(i, 10 * i) for i in range(50)]
+
+
+def test_stale_claim_requeued(tmp_path):
+    path = str(tmp_path / "queue")
+    queue = JobQueue.create(path, {}, get_quartets(4), shard_size=2)
+    # Note: a worker which died after claiming the first shard
+    assert queue.claim("dead")[0] == 1
+    assert queue.requeue_stale(timeout=60) == []
+    statuses = [status for _, _, status in run_worker(path, fake_analyze, HEADERS)]
+    assert statuses == ["done"]
+    assert queue.status()["claimed"] == 1
+    time.sleep(0.01)
+    assert queue.requeue_stale(timeout=0, max_attempts=2) == [1]
+    assert list(run_worker(path, fake_analyze, HEADERS)) == [(1, 2, "done")]
+    assert merge_outputs(queue, io.StringIO()) == 4
+    # Note: the dead worker comes back, its results are not accepted
+    assert not queue.complete(1, "dead", "late.csv")
+    assert not queue.heartbeat(1, "dead")
+
+
+def test_failed_and_lost_shards(tmp_path):
+    path = str(tmp_path / "queue")
+    queue = JobQueue.create(path, {}, [("bad", (1,) * 10, (1, 1, 1, 1))])
+    assert list(run_worker(path, fake_analyze, HEADERS)) == [(1, 1, "failed")]
+    assert queue.shards()[0][-1] == "ValueError: bad quartet"
+    with pytest.raises(ValueError, match="1 failed"):
+        merge_outputs(queue, io.StringIO())
+    assert queue.retry_failed() == 1
+
+    def requeue_meanwhile(quartets):
+        queue.requeue_stale(timeout=0)
+        return fake_analyze([("q0", (1,) * 10, (1, 1, 1, 1))])
+
+    assert list(run_worker(path, requeue_meanwhile, HEADERS, max_shards=1)) == [
+        (1, 1, "lost")
+    ]
+    assert queue.status()["pending"] == 1
+    assert os.listdir(queue.shards_path) == []
@@ -0,0 +1,131 @@
+import io
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+from hammlet.markers import (
+    MarkerMatrix,
+    iter_quartets,
+    pack_bits,
+    popcount,
+    quartet_counts,
+    read_markers,
+    sampled_counts,
+    y_pairs,
+)
+
+
+def brute_force_y(present, quartet):
+    absent = ~present[list(quartet)]
+    n_absent = absent.sum(axis=0)
+    return tuple(
+        int(np.sum(absent[i] & absent[j] & (n_absent == (1 if i == j else 2))))
+        for i, j in y_pairs
+    )
+
+
+def test_popcount_random():
+    rng = np.random.RandomState(42)
+    bits = rng.rand(3, 200) < 0.3
+    assert popcount(pack_bits(bits)).tolist() == bits.sum(axis=1).tolist()
+
+
+def test_quartet_counts_brute_force():
+    rng = np.random.RandomState(42)
+    present = rng.rand(8, 150) < 0.7
+    matrix = MarkerMatrix("ABCDEFGH", present)
+    # Note: small blocks, so quartets of one pair are split into chunks
+    got = {}
+    for quartets, ys in quartet_counts(matrix, max_words=5):
+        for quartet, y in zip(quartets.tolist(), ys.tolist()):
+            got[tuple(quartet)] = tuple(y)
+    expected = {
+        quartet: brute_force_y(present, quartet)
+        for quartet in itertools.combinations(range(8), 4)
+    }
+    assert list(got) == list(expected)
+    assert got == expected
+
+
+def test_iter_quartets_hctm():
+    path = os.path.join(
+        os.path.dirname(__file__), "..", "data", "data_human_colugo_tupaia_mouse"
+    )
+    with open(path) as f:
+        matrix = read_markers(f)
+    assert list(iter_quartets(matrix, r=(1, 2, 1, 1))) == [
+        (
+            ",".join(matrix.names),
+            (10, 8, 7, 4, 21, 7, 2, 39, 30, 28),
+            (1, 2, 1, 1),
+        )
+    ]
+
+
+def test_read_markers_space_separated_01():
+    matrix = read_markers(io.StringIO("A B C D\n1 0 1 1\n0 1 1 0\n"))
+    assert matrix.names == ["A", "B", "C", "D"]
+    assert matrix.n_loci == 2
+    ((_, y, _),) = iter_quartets(matrix)
+    assert y == brute_force_y(
+        np.array([[1, 0], [0, 1], [1, 1], [1, 0]], dtype=bool), range(4)
+    )
+    # Note: a number of loci only after all symbols (or in a count column)
+    assert read_markers(io.StringIO("A B C D\n1 0 1 1 3\n")).n_loci == 3
+    assert read_markers(io.StringIO("A B C D y_ij\n1 0 1 1 0\n1 0 1 1 1\n")).n_loci == 1
+    with pytest.raises(ValueError, match="line 2: expected 5 symbols"):
+        read_markers(io.StringIO("A B C D E\n+ + - - 30\n"))
+    with pytest.raises(ValueError, match="line 3: expected 4 symbols"):
+        read_markers(io.StringIO("A B C D\n1 0 1 1\n1 0 x 1\n"))
+
+
+def test_read_markers_chunks():
+    rng = np.random.RandomState(3)
+    present = rng.rand(70, 6) < 0.5
+    counts = rng.randint(0, 4, size=70)
+    text = "A B C D E F y_ij\n" + "".join(
+        "{} {}\n".format(" ".join("+" if x else "-" for x in row), count)
+        for row, count in zip(present, counts)
+    )
+    whole = read_markers(io.StringIO(text))
+    chunked = read_markers(io.StringIO(text), chunk_size=7)
+    assert whole.n_loci == chunked.n_loci == counts.sum()
+    for matrix in (whole, chunked):
+        assert dict(
+            (tuple(q), tuple(y))
+            for qs, ys in quartet_counts(matrix)
+            for q, y in zip(qs.tolist(), ys.tolist())
+        ) == {
+            quartet: brute_force_y(np.repeat(present, counts, axis=0).T, quartet)
+            for quartet in itertools.combinations(range(6), 4)
+        }
+
+
+def test_iter_quartets_skip_empty():
+    f = io.StringIO("A B C D E\n+ + + + -\n")
+    matrix = read_markers(f)
+    assert [id_ for id_, _, _ in iter_quartets(matrix)] == [
+        "A,B,C,E",
+        "A,B,D,E",
+        "A,C,D,E",
+        "B,C,D,E",
+    ]
+    assert len(list(iter_quartets(matrix, skip_empty=False))) == 5
+
+
+def test_sampled_counts_brute_force():
+    rng = np.random.RandomState(7)
+    present = rng.rand(30, 200) < 0.6
+    matrix = MarkerMatrix([str(i) for i in range(30)], present)
+    quartets = [tuple(sorted(rng.choice(30, 4, replace=False))) for _ in range(50)]
+    # Note: small blocks, so quartets are split into chunks
+    chunks = list(sampled_counts(matrix, iter(quartets), max_words=40))
+    assert len(chunks) > 1
+    got = [
+        (tuple(quartet), tuple(y))
+        for chunk, ys in chunks
+        for quartet, y in zip(chunk.tolist(), ys.tolist())
+    ]
+    assert got == [(quartet, brute_force_y(present, quartet)) for quartet in quartets]
@@ -0,0 +1,51 @@
+import gzip
+import itertools
+
+import numpy as np
+import pytest
+
+from hammlet.patterns import read_patterns_y
+from hammlet.utils import pattern2ij
+
+PATTERNS = ["".join(p) for p in itertools.product("+-", repeat=4)]
+
+
+def expected_y(patterns):
+    pairs = [(i, j) for i in range(1, 5) for j in range(i, 5)]
+    y = [0] * 10
+    for pattern in patterns:
+        if pattern.count("-") in (1, 2):
+            y[pairs.index(pattern2ij(pattern))] += 1
+    return tuple(y)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 2**20])
+def test_read_patterns_y(tmp_path, chunk_size):
+    rng = np.random.RandomState(42)
+    patterns = [PATTERNS[i] for i in rng.randint(0, 16, size=500)]
+    text = "Human Colugo Tupaia Mouse\n" + "".join(
+        " ".join(pattern) + "\n" for pattern in patterns
+    )
+    path = tmp_path / "patterns.txt"
+    path.write_text(text)
+    y, names, counts = read_patterns_y(str(path), chunk_size)
+    assert names == ["Human", "Colugo", "Tupaia", "Mouse"]
+    assert counts.sum() == 500
+    assert y == expected_y(patterns)
+
+    # Note: mixed layouts, blank lines and no trailing newline
+    path_gz = tmp_path / "patterns.txt.gz"
+    lines = [p if i % 3 else "\t".join(p) + "\n" for i, p in enumerate(patterns)]
+    with gzip.open(str(path_gz), "wt") as f:
+        f.write("\n".join(lines))
+    assert read_patterns_y(str(path_gz), chunk_size)[:2] == (y, None)
+
+
+def test_read_patterns_y_errors(tmp_path):
+    path = tmp_path / "patterns.txt"
+    path.write_text("A B C D\n++--\n+-+\n")
+    with pytest.raises(ValueError, match="line 3: expected 4 symbols, got 3"):
+        read_patterns_y(str(path))
+    path.write_text("++--\n+-+- 12\n")
+    with pytest.raises(ValueError, match="line 2: expected"):
+        read_patterns_y(str(path))
@@ -0,0 +1,50 @@
+import itertools
+
+from hammlet.models import models_mapping
+from hammlet.optimizer import OptimizationResult
+from hammlet.resultset import ResultSet, pack_permutation, unpack_permutation
+from hammlet.utils import results_to_data
+
+
+def make_results():
+    perms = list(itertools.permutations((1, 2, 3, 4)))
+    names = ["2H1", "1H1", "T1", "PT", "P", "2H2"]
+    return [
+        OptimizationResult(
+            models_mapping[names[i % len(names)]],
+            perms[i % len(perms)],
+            -float((i * 7919) % 101),
+            (float(i), 0.1 * i, 0.2 * i, 0.5, 0.25),
+        )
+        for i in range(50)
+    ]
+
+
+def test_pack_permutation_roundtrip():
+    for perm in itertools.permutations((1, 2, 3, 4)):
+        assert unpack_permutation(pack_permutation(perm)) == perm
+
+
+def test_resultset_roundtrip():
+    results = make_results()
+    assert list(ResultSet.from_results(results)) == results
+
+
+def test_resultset_to_data_matches_results_to_data():
+    results = make_results()
+    results.sort(key=lambda it: it.LL, reverse=True)
+    assert results_to_data(ResultSet.from_results(results)) == results_to_data(results)
+
+
+def test_resultset_sorted_matches_python_sort():
+    results = make_results()
+    expected = sorted(results, key=lambda it: it.LL, reverse=True)
+    assert list(ResultSet.from_results(results).sorted()) == expected
+    assert list(ResultSet.from_results(results).top(7)) == expected[:7]
+
+
+def test_resultset_group_by_level():
+    grouped = ResultSet.from_results(make_results()).group_by_level()
+    assert set(grouped) == {"N4", "N3", "N2", "N1", "N0"}
+    assert sum(map(len, grouped.values())) == 50
+    assert all(r.model.name in ("2H1", "2H2") for r in grouped["N4"])
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+
+from hammlet.models import models_mapping
+from hammlet.optimizer import OptimizationResult
+from hammlet.resultset import ResultSet
+from hammlet.resultstore import ResultStore, ResultStoreWriter
+
+
+def make_resultset(n, offset=0):
+    return ResultSet.from_results(
+        OptimizationResult(
+            models_mapping[["2H1", "T2", "P"][i % 3]],
+            (2, 1, 4, 3),
+            -float(i + offset),
+            (float(i), 0.1 * i, 0.2, 0.5, 0.25),
+        )
+        for i in range(n)
+    )
+
+
+def test_store_roundtrip(tmp_path):
+    path = str(tmp_path / "mle")
+    resultsets = [make_resultset(n, 10 * n) for n in [3, 0, 5]]
+    with ResultStoreWriter(path) as writer:
+        for i, results in enumerate(resultsets):
+            writer.append("q{}".format(i), results)
+    assert not os.path.exists(path + ".tmp")
+
+    store = ResultStore(path)
+    assert store.ids == ["q0", "q1", "q2"]
+    assert len(store) == 8
+    assert isinstance(store["LL"], np.memmap)
+    for i, results in enumerate(resultsets):
+        assert list(store.results(i)) == list(results)
+    assert list(store.results("q2")) == list(resultsets[2])
+    assert list(store.resultset()) == list(ResultSet.concatenate(resultsets))
+
+
+def test_store_empty(tmp_path):
+    path = str(tmp_path / "mle")
+    with ResultStoreWriter(path):
+        pass
+    store = ResultStore(path)
+    assert store.ids == []
+    assert len(store) == 0
+    assert len(store.resultset()) == 0
+
+
+def test_store_aborted(tmp_path):
+    path = str(tmp_path / "mle")
+    with pytest.raises(KeyboardInterrupt):
+        with ResultStoreWriter(path) as writer:
+            writer.append("q0", make_resultset(2))
+            raise KeyboardInterrupt
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_store_keeps_other_files(tmp_path):
+    path = tmp_path / "mle"
+    path.mkdir()
+    (path / "notes.txt").write_text("mine")
+    with pytest.raises(ValueError, match="not a result store"):
+        ResultStoreWriter(str(path))
+    assert os.listdir(str(path)) == ["notes.txt"]
+
+    (path / "notes.txt").unlink()
+    for n in [3, 2]:
+        with ResultStoreWriter(str(path)) as writer:
+            writer.append("q0", make_resultset(n))
+        # Note: files added to a store survive its replacement
+        (path / "notes.txt").write_text("mine")
+    assert len(ResultStore(str(path))) == 2
+    assert (path / "notes.txt").read_text() == "mine"
+
+    tmp = tmp_path / "mle.tmp"
+    tmp.mkdir()
+    (tmp / "data.csv").write_text("mine")
+    with pytest.raises(ValueError, match="not an unfinished result store"):
+        ResultStoreWriter(str(path))
+    assert os.listdir(str(tmp)) == ["data.csv"]
@@ -0,0 +1,53 @@
+import itertools
+
+import numpy as np
+import pytest
+from scipy.special import comb
+
+from hammlet.sampling import n_quartets, sample_balanced, sample_focal, sample_uniform
+
+
+def rng():
+    return np.random.default_rng(42)
+
+
+def test_uniform_distinct_and_reproducible():
+    quartets = list(sample_uniform(200, 5000, rng()))
+    assert len(set(quartets)) == 5000
+    assert all(0 <= a < b < c < d < 200 for a, b, c, d in quartets)
+    assert quartets == list(sample_uniform(200, 5000, rng()))
+
+
+def test_uniform_is_uniform():
+    # Note: 35 quartets of 7 species, each drawn first with probability 1/35
+    counts = {}
+    for seed in range(3500):
+        quartet = next(iter(sample_uniform(7, 1, np.random.default_rng(seed))))
+        counts[quartet] = counts.get(quartet, 0) + 1
+    assert len(counts) == n_quartets(7)
+    assert 60 < min(counts.values()) and max(counts.values()) < 145
+
+
+@pytest.mark.parametrize("n,coverage", [(4, 1), (9, 2), (50, 5), (103, 3)])
+def test_balanced_coverage(n, coverage):
+    quartets = list(sample_balanced(n, coverage, 10**6, rng()))
+    assert len(set(quartets)) == len(quartets)
+    counts = np.bincount(np.ravel(quartets), minlength=n)
+    assert counts.min() >= min(coverage, comb(n - 1, 3, exact=True))
+    # Note: species are covered round by round, so few are covered more often
+    assert len(quartets) <= n * coverage // 4 + 2 * coverage
+
+
+def test_balanced_small_and_budget():
+    # Every species of 6 is in 10 quartets, there are only 15 of them
+    assert len(list(sample_balanced(6, 100, 10**6, rng()))) == 15
+    assert len(list(sample_balanced(100, 10, 7, rng()))) == 7
+
+
+def test_focal():
+    quartets = list(sample_focal(50, [3, 10], 1000, rng()))
+    assert len(set(quartets)) == 1000
+    assert all(3 in quartet or 10 in quartet for quartet in quartets)
+    everything = set(sample_focal(8, [0], 10**6, rng()))
+    assert everything == {q for q in itertools.combinations(range(8), 4) if 0 in q}
+    assert len(set(sample_focal(8, [0], 34, rng()))) == 34
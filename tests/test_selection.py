@@ -0,0 +1,125 @@
+from collections import namedtuple
+
+from click.testing import CliRunner
+
+from hammlet.commands import stat, stat_levels
+from hammlet.models import models_mapping
+from hammlet.optimizer import OptimizationResult
+from hammlet.selection import LevelFits, LevelTester, select_forward, select_reverse
+
+FakeResult = namedtuple("FakeResult", ["model", "LL", "theta"])
+
+
+def make_results(LLs):
+    return {
+        level: FakeResult(level, LL, None)
+        for level, LL in zip(["N4", "N3", "N2", "N1", "N0"], LLs)
+    }
+
+
+def test_select_forward_chi2():
+    # N4-N3 and N3-N2 are insignificant, N2-N1 is significant
+    best = make_results([100.0, 99.9, 99.5, 90.0, 89.0])
+    levels = ["N4", "N3", "N2", "N1", "N0"]
+    level, result = select_forward(levels, best, {}, 0.05)
+    assert level == "N2"
+    assert result is best["N2"]
+
+
+def test_select_forward_polytomy():
+    best = make_results([100.0, 99.9, 99.8, 99.7, 99.6])
+    levels = ["N4", "N3", "N2", "N1", "N0"]
+    assert select_forward(levels, best, {}, 0.05)[0] == "N0"
+
+
+def test_select_reverse_chi2():
+    best = make_results([100.0, 99.9, 99.5, 90.0, 80.0])
+    levels = ["N4", "N0", "N1", "N2", "N3"]
+    level, result, pgood = select_reverse(levels, best, {}, 0.05)
+    assert level == "N2"
+    assert pgood >= 0.05
+
+
+def test_select_with_ecdfs():
+    best = make_results([100.0, 99.0, 98.0, 97.0, 96.0])
+    models = {level: [] for level in best}
+    # 2*delta LL is 2 for every forward comparison
+    tester = LevelTester((1, 1, 1, 1), None, "SLSQP", ecdfs=[3, 3, 1, 3])
+    levels = ["N4", "N3", "N2", "N1", "N0"]
+    assert select_forward(levels, best, models, 0.05, tester)[0] == "N2"
+    # 2*delta LL is 8, 6, 4 and 2 for N4-N0,...,N4-N3
+    tester = LevelTester((1, 1, 1, 1), None, "SLSQP", ecdfs=[1, 7, 1, 1])
+    levels = ["N4", "N0", "N1", "N2", "N3"]
+    assert select_reverse(levels, best, models, 0.05, tester)[0] == "N1"
+
+
+class FakeOptimizer(object):
+    def __init__(self, LL_by_model):
+        self.LL_by_model = LL_by_model
+        self.fitted = []
+
+    def many(self, models, perms, sort):
+        self.fitted.extend(models)
+        return [
+            OptimizationResult(
+                model,
+                (1, 2, 3, 4),
+                self.LL_by_model[model.name],
+                (1.0, 0.5, 0.5, 0.5, 0.5),
+            )
+            for model in models
+        ]
+
+
+def test_level_fits_are_lazy():
+    optimizer = FakeOptimizer({"2H1": 100.0, "1H1": 99.9, "T1": 90.0, "P": 80.0})
+    models_by_level = {
+        "N4": [models_mapping["2H1"]],
+        "N3": [models_mapping["1H1"]],
+        "N2": [models_mapping["T1"]],
+        "N1": [models_mapping["PT"]],
+        "N0": [models_mapping["P"]],
+    }
+    fits = LevelFits(optimizer, models_by_level)
+    levels = ["N4", "N3", "N2", "N1", "N0"]
+    assert select_forward(levels, fits, models_by_level, 0.05)[0] == "N3"
+    assert "N1" not in fits
+    assert [model.name for model in optimizer.fitted] == ["2H1", "1H1", "T1"]
+    # Already fitted levels are not fitted again
+    assert fits["N3"].LL == 99.9
+    assert len(optimizer.fitted) == len(fits) == 3
+
+
+def test_output_result_pvalue_column(tmp_path):
+    y = "10 8 7 4 21 7 2 39 30 28".split()
+    path = str(tmp_path / "result.txt")
+    runner = CliRunner()
+    outputs = {}
+    for command, pvalues in [
+        (stat_levels, "0.05"),
+        (stat_levels, "0.05,0.01"),
+        (stat, "0.05,0.01"),
+    ]:
+        args = ["-y"] + y + ["-p", pvalues, "--output-result", path]
+        result = runner.invoke(command, args)
+        assert result.exit_code == 0, result.output
+        with open(path) as f:
+            outputs[command.name, pvalues] = f.read().splitlines()
+    # Note: the p-value is appended as the last column only with several ones
+    (line,) = outputs["stat-levels", "0.05"]
+    assert outputs["stat-levels", "0.05,0.01"] == [line + ",0.05", line + ",0.01"]
+    assert [line.rsplit(",", 1)[1] for line in outputs["stat", "0.05,0.01"]] == [
+        "0.05",
+        "0.05",
+        "0.01",
+        "0.01",
+    ]
+
+
+def test_result_lines_fit_levels_on_demand():
+    y = "10 8 7 4 21 7 2 39 30 28".split()
+    result = CliRunner().invoke(stat_levels, ["-y"] + y)
+    assert result.exit_code == 0, result.output
+    # Note: selection stops at N2, so N0 is only fitted for --output-result
+    levels = [line.split()[0] for line in result.output.splitlines() if "H1:" in line]
+    assert levels == ["N4", "N3", "N2", "N1"]
@@ -0,0 +1,25 @@
+import numpy as np
+
+from hammlet.summary import QuantileSample, RunningSummary
+
+
+def test_quantiles_exact():
+    xs = np.random.default_rng(1).chisquare(1, size=100)
+    summary = RunningSummary(["x"], quantiles=(0.05, 0.5, 0.95))
+    for n, x in enumerate(xs, start=1):
+        summary.add([x])
+        if n in (1, 5, 6, 100):
+            assert [summary.quantile("x", p) for p in summary.quantiles] == list(
+                np.quantile(xs[:n], summary.quantiles)
+            )
+    assert summary.exact
+
+
+def test_quantiles_reservoir():
+    xs = np.random.default_rng(2).normal(size=20000)
+    sample = QuantileSample(size=2000)
+    for x in xs:
+        sample.add(x)
+    assert not sample.exact
+    assert len(sample.values) == 2000
+    assert abs(sample.quantile(0.95) - np.quantile(xs, 0.95)) < 0.15